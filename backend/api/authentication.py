@@ -6,12 +6,51 @@ import json
 import time
 from typing import Optional, Tuple
 from django.conf import settings
+from django.utils import timezone
+from django.db.models.signals import post_delete, post_save
 from rest_framework import authentication
+from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from core.cache import TTLCache
 from users.models import User
+from users.write_buffer import user_write_buffer
 
 logger = logging.getLogger(__name__)
 
+# hash initData -> (initData, user_id) для уже проверенных подписей
+_verified_init_data_cache = TTLCache(
+    max_size=getattr(settings, 'TELEGRAM_INIT_DATA_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TELEGRAM_INIT_DATA_CACHE_TTL', 3600),
+)
+
+# ключ DRF Token -> пользователь
+_token_user_cache = TTLCache(
+    max_size=getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60),
+)
+
+
+def issue_tokens_for_user(user: User) -> dict:
+    """
+    Выпускает пару JWT-токенов. В claims кладем всё, что нужно
+    эндпоинтам на чтение, чтобы они не обращались к таблице users.
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh['telegram_id'] = user.telegram_id
+    refresh['is_staff'] = user.is_staff
+    refresh['is_superuser'] = user.is_superuser
+    refresh['delivery_type'] = user.delivery_type
+    refresh['selected_restaurant_for_pickup'] = user.selected_restaurant_for_pickup_id
+    refresh['selected_branch_for_pickup'] = user.selected_branch_for_pickup_id
+
+    return {
+        'access_token': str(refresh.access_token),
+        'refresh_token': str(refresh),
+    }
+
 
 class TelegramAuthentication(authentication.BaseAuthentication):
     """
@@ -21,9 +60,21 @@ class TelegramAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request) -> Optional[Tuple[User, None]]:
         init_data = self._extract_init_data(request)
         if not init_data:
-            logger.warning("Telegram init_data не найдена в запросе")
+            logger.debug("Telegram init_data не найдена в запросе")
             return None
 
+        return self.authenticate_credentials(init_data), None
+
+    def authenticate_credentials(self, init_data: str) -> User:
+        """
+        Проверяет init_data и возвращает соответствующего пользователя
+        """
+        # Повторные запросы той же сессии мини-приложения не проверяем заново
+        cached_user = self._get_cached_user(init_data)
+        if cached_user is not None:
+            user_write_buffer.enqueue(cached_user.pk, last_activity=timezone.now())
+            return cached_user
+
         # Валидируем init_data
         validation_result = self._validate_telegram_init_data(init_data)
 
@@ -45,7 +96,9 @@ class TelegramAuthentication(authentication.BaseAuthentication):
         # Создаем или получаем пользователя
         try:
             user, created = self._get_or_create_user(user_data)
-            return user, None
+            self._cache_verified_init_data(init_data, user)
+            user_write_buffer.enqueue(user.pk, last_activity=timezone.now())
+            return user
 
         except Exception as e:
             logger.exception(f"Ошибка при создании/получении пользователя")
@@ -57,6 +110,51 @@ class TelegramAuthentication(authentication.BaseAuthentication):
             init_data = request.GET.get('init_data')
         return init_data
 
+    def _split_init_data(self, init_data: str) -> dict:
+        params = {}
+        for param in init_data.split('&'):
+            if '=' in param:
+                key, value = param.split('=', 1)
+                params[key] = value
+        return params
+
+    def _get_cached_user(self, init_data: str) -> Optional[User]:
+        received_hash = self._split_init_data(init_data).get('hash')
+        if not received_hash:
+            return None
+
+        entry = _verified_init_data_cache.get(received_hash)
+        if entry is None:
+            return None
+
+        # Ключ - только hash, поэтому сверяем initData целиком
+        cached_init_data, user_id = entry
+        if not hmac.compare_digest(cached_init_data, init_data):
+            return None
+
+        try:
+            return User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            _verified_init_data_cache.delete(received_hash)
+            return None
+
+    def _cache_verified_init_data(self, init_data: str, user: User) -> None:
+        params = self._split_init_data(init_data)
+        received_hash = params.get('hash')
+        if not received_hash:
+            return
+
+        # Запись живет не дольше, чем сама initData считается актуальной
+        ttl = None
+        try:
+            auth_date = int(params['auth_date'])
+            max_age = getattr(settings, 'TELEGRAM_INIT_DATA_MAX_AGE', 86400)
+            ttl = auth_date + max_age - time.time()
+        except (KeyError, ValueError):
+            pass
+
+        _verified_init_data_cache.set(received_hash, (init_data, user.pk), ttl=ttl)
+
     def _validate_telegram_init_data(self, init_data: str):
         if not init_data:
             logger.error("Пустой init_data")
@@ -95,11 +193,7 @@ class TelegramAuthentication(authentication.BaseAuthentication):
             return True
 
         try:
-            parsed_params = {}
-            for param in init_data.split('&'):
-                if '=' in param:
-                    key, value = param.split('=', 1)
-                    parsed_params[key] = value
+            parsed_params = self._split_init_data(init_data)
 
             received_hash = parsed_params.get('hash')
             if not received_hash:
@@ -212,19 +306,110 @@ class TelegramAuthentication(authentication.BaseAuthentication):
             return user, True
 
     def _update_user_if_needed(self, user: User, user_data: dict) -> None:
-        updated = False
+        changes = {}
 
         if user.first_name != user_data.get('first_name', ''):
-            user.first_name = user_data.get('first_name', '')
-            updated = True
+            changes['first_name'] = user_data.get('first_name', '')
 
         if user.last_name != user_data.get('last_name', ''):
-            user.last_name = user_data.get('last_name', '')
-            updated = True
+            changes['last_name'] = user_data.get('last_name', '')
 
         if user.username != user_data.get('username', f"tg_{user.telegram_id}"):
-            user.username = user_data.get('username', f"tg_{user.telegram_id}")
-            updated = True
+            changes['username'] = user_data.get('username', f"tg_{user.telegram_id}")
+
+        if changes:
+            changes['updated_at'] = timezone.now()
+            for field, value in changes.items():
+                setattr(user, field, value)
+            # Пишем в БД в фоне, запрос не ждет UPDATE
+            user_write_buffer.enqueue(user.pk, **changes)
+
+
+class ActivityTrackingJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT без обращения к таблице users; last_activity обновляется
+    через отложенную запись. is_active и is_blocked не проверяются:
+    блокировка действует после истечения access-токена
+    (SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']), refresh ее проверяет.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            user_write_buffer.enqueue(result[0].id, last_activity=timezone.now())
+        return result
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    TokenAuthentication с кэшем ключ -> пользователь в памяти процесса
+    """
+
+    def authenticate_credentials(self, key):
+        user = _token_user_cache.get(key)
+        if user is None:
+            user, _ = super().authenticate_credentials(key)
+            _token_user_cache.set(key, user)
+        elif not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, None
+
+
+def _invalidate_token_cache_for_token(sender, instance, **kwargs):
+    _token_user_cache.delete(instance.key)
+
+
+def _invalidate_token_cache_for_user(sender, instance, **kwargs):
+    _token_user_cache.discard_where(lambda user: user.pk == instance.pk)
+
+
+post_delete.connect(_invalidate_token_cache_for_token, sender=Token)
+post_save.connect(_invalidate_token_cache_for_user, sender=User)
+post_delete.connect(_invalidate_token_cache_for_user, sender=User)
+
+
+class CredentialDispatchAuthentication(authentication.BaseAuthentication):
+    """
+    Единая точка аутентификации: по виду учетных данных в запросе
+    запускается только соответствующий бэкенд. Запрос без учетных
+    данных остается анонимным без единого обращения к БД.
+    """
+    jwt_authentication = JWTAuthentication()
+    token_authentication = CachedTokenAuthentication()
+    telegram_authentication = TelegramAuthentication()
+    session_authentication = authentication.SessionAuthentication()
+
+    jwt_keywords = {header_type.lower().encode() for header_type in jwt_settings.AUTH_HEADER_TYPES}
+    token_keyword = CachedTokenAuthentication.keyword.lower().encode()
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if auth:
+            keyword = auth[0].lower()
+            if keyword in self.jwt_keywords:
+                return self.jwt_authentication.authenticate(request)
+            if keyword == self.token_keyword:
+                return self.token_authentication.authenticate(request)
+
+        if request.META.get('HTTP_X_TELEGRAM_INIT_DATA') or request.GET.get('init_data'):
+            return self.telegram_authentication.authenticate(request)
+
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return self.session_authentication.authenticate(request)
+
+        return None
+
+    def authenticate_header(self, request):
+        return self.jwt_authentication.authenticate_header(request)
+
+
+class StatelessCredentialDispatchAuthentication(CredentialDispatchAuthentication):
+    """
+    Для эндпоинтов, которым достаточно id пользователя: JWT проверяется
+    без запроса к БД (request.user - TokenUser с claims из токена),
+    остальные виды учетных данных - как в CredentialDispatchAuthentication.
+    """
+    jwt_authentication = ActivityTrackingJWTAuthentication()
+
 
-        if updated:
-            user.save()
\ No newline at end of file
+STATELESS_AUTHENTICATION_CLASSES = [StatelessCredentialDispatchAuthentication]
@@ -0,0 +1,131 @@
+"""
+Пакетный расчет доставки (см. restaurants.quotes).
+
+POST /branches/quotes/
+{
+    "branches": [1, 2] или "restaurant": 5 (все активные филиалы ресторана),
+    "points": [{"lat": 55.75, "lng": 37.61}],
+    "addresses": [10, 11] (сохраненные адреса текущего пользователя),
+    "order_amount": "1200.00" (необязательно)
+}
+Считаются все пары точка x филиал одним проходом. В ответе quotes - по
+паре: branch_id, point (номер в points) или address_id, distance_meters,
+deliverable, delivery_fee (null, если доставка невозможна), zone_id и
+reason. Филиалы с зонами считаются по зонам (restaurants.zones). Адреса без
+координат перечислены в addresses_without_location.
+"""
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from restaurants.models import RestaurantBranch
+from restaurants.zones import check_many
+from users.models import UserAddress
+
+MAX_QUOTE_PAIRS = 2000
+
+
+class QuoteRequestError(ValueError):
+    pass
+
+
+def parse_order_amount(value):
+    """Сумма заказа из запроса (Decimal или None); ValueError, если это не конечное число"""
+    if value in (None, ''):
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'Некорректная сумма заказа: {value!r}')
+    if not amount.is_finite():
+        raise ValueError(f'Некорректная сумма заказа: {value!r}')
+    return amount
+
+
+def _int_list(value, name):
+    if not isinstance(value, list):
+        raise QuoteRequestError(f'{name} должен быть списком id')
+    try:
+        return list(dict.fromkeys(int(item) for item in value))
+    except (TypeError, ValueError):
+        raise QuoteRequestError(f'{name} должен быть списком id')
+
+
+def _points(value):
+    if not isinstance(value, list):
+        raise QuoteRequestError('points должен быть списком {"lat", "lng"}')
+    points = []
+    for point in value:
+        try:
+            latitude, longitude = float(point['lat']), float(point['lng'])
+        except (KeyError, TypeError, ValueError):
+            raise QuoteRequestError('points должен быть списком {"lat", "lng"}')
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise QuoteRequestError('Координаты вне диапазона')
+        points.append((latitude, longitude))
+    return points
+
+
+def _branches(data):
+    queryset = RestaurantBranch.objects.filter(is_active=True, restaurant__is_active=True)
+    if 'branches' in data:
+        ids = _int_list(data['branches'], 'branches')
+        branches = queryset.in_bulk(ids)
+        return [branches[pk] for pk in ids if pk in branches]
+    if 'restaurant' in data:
+        try:
+            restaurant_id = int(data['restaurant'])
+        except (TypeError, ValueError):
+            raise QuoteRequestError('restaurant должен быть id')
+        return list(queryset.filter(restaurant_id=restaurant_id).order_by('pk'))
+    raise QuoteRequestError('Нужен branches или restaurant')
+
+
+def delivery_quotes_response(request):
+    data = request.data if isinstance(request.data, dict) else {}
+    try:
+        branches = _branches(data)
+        points = [('point', index, *point) for index, point in enumerate(_points(data.get('points', [])))]
+        address_ids = _int_list(data.get('addresses', []), 'addresses')
+        order_amount = parse_order_amount(data.get('order_amount'))
+    except QuoteRequestError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({'error': 'Некорректная сумма заказа'}, status=status.HTTP_400_BAD_REQUEST)
+
+    without_location = []
+    if address_ids:
+        if not request.user.is_authenticated:
+            return Response({'error': 'Адреса доступны только после входа'}, status=status.HTTP_401_UNAUTHORIZED)
+        addresses = UserAddress.objects.filter(user=request.user, pk__in=address_ids).values_list(
+            'pk', 'latitude', 'longitude'
+        )
+        for pk, latitude, longitude in sorted(addresses):
+            if latitude is None or longitude is None:
+                without_location.append(pk)
+            else:
+                points.append(('address_id', pk, float(latitude), float(longitude)))
+
+    if not points:
+        return Response({'error': 'Нужны points или addresses'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(points) * len(branches) > MAX_QUOTE_PAIRS:
+        return Response(
+            {'error': f'Не больше {MAX_QUOTE_PAIRS} пар точка x филиал за запрос'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    checks = check_many(branches, [(point[2], point[3]) for point in points], order_amount)
+    quotes = []
+    for index, check in enumerate(checks):
+        key, value, _, _ = points[index // len(branches)]
+        quotes.append({
+            'branch_id': branches[index % len(branches)].pk,
+            key: value,
+            'distance_meters': round(check.distance_meters),
+            'deliverable': check.deliverable,
+            'delivery_fee': str(check.delivery_fee) if check.deliverable else None,
+            'zone_id': check.zone_id,
+            'reason': check.reason,
+        })
+    return Response({'quotes': quotes, 'addresses_without_location': without_location})
@@ -0,0 +1,125 @@
+"""
+Счетчики для фильтров списка товаров ("Веганское (12)").
+
+Все счетчики считаются одним запросом: GROUP BY категории с условными
+COUNT(...) FILTER (WHERE ...) по каждому флагу. Счетчик фасета учитывает
+все текущие фильтры, кроме своего собственного, - то есть показывает,
+сколько товаров останется, если выбрать это значение.
+Результат кэшируется по menu_version ресторана.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django_filters import utils
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import SearchFilter
+from rest_framework.response import Response
+
+from catalog.models import Restaurant
+from core.cache import TTLCache
+
+FACET_FLAGS = ('is_vegetarian', 'is_vegan', 'is_gluten_free', 'is_popular', 'is_new', 'is_recommended')
+FACET_FIELDS = (*FACET_FLAGS, 'category')
+
+_local_facets = TTLCache(max_size=1024, ttl=3600)
+
+FACETS_CACHE_TIMEOUT = 24 * 3600
+
+
+def _count(condition):
+    return Count('pk', filter=condition) if condition else Count('pk')
+
+
+def _selected_except(selected, excluded=None):
+    condition = Q()
+    for name, value in selected.items():
+        if name != excluded:
+            condition &= Q(**{name: value})
+    return condition
+
+
+def compute_facets(queryset, selected):
+    """
+    Счетчики фасетов одним запросом.
+    queryset - товары со всеми фильтрами, кроме фасетных;
+    selected - {поле фасета: значение} для выбранных фасетов.
+    """
+    aggregates = {
+        'total_count': _count(_selected_except(selected)),
+        'category_count': _count(_selected_except(selected, 'category')),
+        **{f'{flag}_count': _count(_selected_except(selected, flag) & Q(**{flag: True})) for flag in FACET_FLAGS},
+    }
+    rows = queryset.order_by().values(
+        'category_id', 'category__name', 'category__slug', 'category__display_order'
+    ).annotate(**aggregates)
+
+    total = 0
+    flags = dict.fromkeys(FACET_FLAGS, 0)
+    categories = []
+    for row in rows:
+        total += row['total_count']
+        for flag in FACET_FLAGS:
+            flags[flag] += row[f'{flag}_count']
+        if row['category_id'] is not None and row['category_count']:
+            categories.append(row)
+
+    categories.sort(key=lambda row: (row['category__display_order'], row['category__name']))
+    return {
+        'total': total,
+        'flags': flags,
+        'categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'slug': row['category__slug'],
+             'count': row['category_count']}
+            for row in categories
+        ],
+    }
+
+
+def _cache_key(request):
+    """Ключ кэша по menu_version ресторана; без ресторана счетчики не кэшируются"""
+    try:
+        restaurant_id = int(request.query_params.get('restaurant', ''))
+    except ValueError:
+        return None
+    version = Restaurant.objects.filter(pk=restaurant_id).values_list('menu_version', flat=True).first()
+    if version is None:
+        return None
+    params = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+    params_key = hashlib.md5(repr(params).encode()).hexdigest()[:16]
+    return f'product_facets:{restaurant_id}:{version}:{params_key}'
+
+
+def product_facets(view, request):
+    """Фасеты для фильтров и поиска списка товаров view (ProductViewSet)"""
+    queryset = view.get_queryset()
+    filterset_class = DjangoFilterBackend().get_filterset_class(view, queryset)
+    filterset = filterset_class(request.query_params, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        raise utils.translate_validation(filterset.errors)
+
+    selected = {}
+    for name, value in filterset.form.cleaned_data.items():
+        if value is None or value == '':
+            continue
+        if name in FACET_FIELDS:
+            selected[name] = value
+        else:
+            queryset = filterset.filters[name].filter(queryset, value)
+    queryset = SearchFilter().filter_queryset(request, queryset, view)
+    return compute_facets(queryset, selected)
+
+
+def product_facets_response(view, request):
+    key = _cache_key(request)
+    if key is None:
+        return Response(product_facets(view, request))
+
+    facets = _local_facets.get(key)
+    if facets is None:
+        facets = cache.get(key)
+        if facets is None:
+            facets = product_facets(view, request)
+            cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+        _local_facets.set(key, facets)
+    return Response(facets)
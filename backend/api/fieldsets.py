@@ -0,0 +1,124 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import SerializerMethodField
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Сериализатор с ограниченным набором полей: Serializer(..., fields=[...]).
+    Именованные наборы - в Meta.field_views, например {'card': [...]}.
+    Столбцы, которые читают SerializerMethodField, перечисляются в
+    Meta.method_field_sources, чтобы выборку можно было сузить через only().
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        self._requested_fields = fields
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self._requested_fields is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in self._requested_fields}
+
+    @classmethod
+    def resolve_requested_fields(cls, query_params):
+        """Набор полей из ?view=<имя> или ?fields=a,b,c; None - все поля"""
+        view = query_params.get('view')
+        if view:
+            return tuple(getattr(cls.Meta, 'field_views', {}).get(view, ())) or None
+
+        fields = [name for name in query_params.get('fields', '').split(',') if name]
+        return tuple(fields) or None
+
+
+def get_only_fields(serializer, model):
+    """
+    Столбцы модели, которых достаточно сериализатору, для QuerySet.only().
+    None - если набор определить нельзя (метод-поле без method_field_sources,
+    property модели и т.п.), тогда выборку не сужаем.
+    """
+    method_sources = getattr(getattr(serializer, 'Meta', None), 'method_field_sources', {})
+    columns = {model._meta.pk.name}
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, SerializerMethodField):
+            if name not in method_sources:
+                return None
+            columns.update(source.replace('.', '__') for source in method_sources[name])
+            continue
+
+        attrs = field.source_attrs
+        try:
+            model_field = model._meta.get_field(attrs[0])
+        except FieldDoesNotExist:
+            return None
+
+        if model_field.many_to_many or model_field.one_to_many:
+            # Загружается отдельным prefetch-запросом по pk
+            continue
+        if not model_field.is_relation:
+            if len(attrs) > 1:
+                return None
+            columns.add(model_field.name)
+            continue
+
+        # Связь к одному: нужен внешний ключ, по нему же идет select_related
+        if len(attrs) > 1:
+            if len(attrs) > 2:
+                return None
+            columns.add('__'.join(attrs))
+        elif not isinstance(field, PrimaryKeyRelatedField):
+            # Вложенный объект или его строковое представление - набор столбцов неизвестен
+            return None
+        columns.add(model_field.name)
+
+    return sorted(columns)
+
+
+def narrow_queryset(queryset, serializer, *extra_fields):
+    """queryset.only() по полям сериализатора, если их столбцы известны"""
+    only_fields = get_only_fields(serializer, queryset.model)
+    if only_fields is None:
+        return queryset
+    return queryset.only(*only_fields, *extra_fields)
+
+
+class SparseFieldsViewMixin:
+    """
+    ?fields=a,b,c или ?view=card для GET-запросов: сериализатор отдает только
+    эти поля, а выборка сужается до нужных столбцов через only()
+    """
+
+    def get_requested_fields(self):
+        if self.request is None or self.request.method != 'GET':
+            return None
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, SparseFieldsSerializerMixin):
+            return None
+        return serializer_class.resolve_requested_fields(self.request.query_params)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if isinstance(queryset, QuerySet) and self.get_requested_fields() is not None:
+            queryset = narrow_queryset(queryset, self.get_serializer(), *self._ordering_columns(queryset))
+        return queryset
+
+    def _ordering_columns(self, queryset):
+        # Keyset-пагинация читает поля сортировки у последней строки страницы
+        paginator_ordering = getattr(self.paginator, 'ordering', ())
+        if isinstance(paginator_ordering, str):
+            paginator_ordering = (paginator_ordering,)
+        ordering = [*queryset.query.order_by, *paginator_ordering]
+        names = {str(field).lstrip('-') for field in ordering}
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        return sorted(names & concrete)
@@ -0,0 +1,69 @@
+"""
+Дельта меню для клиентов, которые хранят меню у себя (см. catalog.sync).
+
+GET /restaurants/{id}/menu/changes/?since=<token>
+Ответ: token - передать в since в следующий раз; reset - заменить меню
+целиком; для categories, products, options, option_values - upserts
+(новые и измененные строки) и deletes (id строк, которые нужно удалить).
+Если ничего не менялось, ответ - один токен и пустые списки.
+"""
+from collections import defaultdict
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from catalog.models import ProductOptionMapping
+from catalog.sync import menu_changes
+from .prefetch import optimize_queryset
+from .serializers import (
+    CategorySerializer,
+    MenuChangesOptionSerializer,
+    MenuChangesOptionValueSerializer,
+    ProductSerializer,
+)
+
+# вид строки -> (ключ в ответе, сериализатор)
+SECTIONS = {
+    'category': ('categories', CategorySerializer),
+    'product': ('products', ProductSerializer),
+    'option': ('options', MenuChangesOptionSerializer),
+    'option_value': ('option_values', MenuChangesOptionValueSerializer),
+}
+
+
+def _serialize_products(queryset, request):
+    """Товары (с ?fields= / ?view=, как в списке) с id их опций"""
+    fields = ProductSerializer.resolve_requested_fields(request.query_params)
+    serializer = ProductSerializer(fields=fields)
+    products = list(optimize_queryset(queryset, serializer))
+    data = ProductSerializer(products, many=True, fields=fields, context={'request': request}).data
+
+    option_ids = defaultdict(list)
+    mappings = ProductOptionMapping.objects.filter(product_id__in=[product.pk for product in products])
+    for product_id, option_id in mappings.order_by('option__display_order', 'option_id').values_list(
+        'product_id', 'option_id'
+    ):
+        option_ids[product_id].append(option_id)
+    for item, product in zip(data, products):
+        item['option_ids'] = option_ids[product.pk]
+    return data
+
+
+def menu_changes_response(restaurant, request):
+    since = request.query_params.get('since') or None
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'Некорректный токен since'}, status=status.HTTP_400_BAD_REQUEST)
+
+    changes = menu_changes(restaurant.pk, since)
+    data = {'token': str(changes.token), 'reset': changes.reset}
+    for kind, (section, serializer_class) in SECTIONS.items():
+        queryset = changes.upserts[kind].order_by('pk')
+        if kind == 'product':
+            upserts = _serialize_products(queryset, request)
+        else:
+            upserts = serializer_class(optimize_queryset(queryset, serializer_class), many=True).data
+        data[section] = {'upserts': upserts, 'deletes': changes.deletes[kind]}
+    return Response(data)
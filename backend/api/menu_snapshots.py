@@ -0,0 +1,119 @@
+import hashlib
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from catalog.models import Category, Product
+from core.cache import TTLCache
+from .fieldsets import narrow_queryset
+from .prefetch import optimize_queryset
+from .serializers import CategorySerializer, MenuCategorySerializer, ProductSerializer, RestaurantSerializer
+
+# Снимки неизменны для версии, поэтому храним их и в памяти процесса
+_local_snapshots = TTLCache(max_size=256, ttl=24 * 3600)
+
+SNAPSHOT_CACHE_TIMEOUT = 24 * 3600
+
+
+@dataclass(frozen=True)
+class MenuSnapshot:
+    version: int
+    content: bytes
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+
+def _build_full(restaurant, context):
+    categories = Category.objects.filter(restaurant=restaurant, is_active=True, is_visible=True)
+    products = optimize_queryset(
+        Product.objects.filter(category_id__in=categories.values_list('id', flat=True), is_available=True),
+        ProductSerializer
+    )
+
+    return {
+        'restaurant': RestaurantSerializer(restaurant).data,
+        'categories': CategorySerializer(categories, many=True).data,
+        'products': ProductSerializer(products, many=True, context=context).data
+    }
+
+
+def _build_card(restaurant, context):
+    """Как full, но товары - только поля карточки (ProductSerializer.Meta.field_views['card'])"""
+    categories = Category.objects.filter(restaurant=restaurant, is_active=True, is_visible=True)
+    fields = ProductSerializer.Meta.field_views['card']
+    serializer = ProductSerializer(fields=fields)
+    products = narrow_queryset(optimize_queryset(
+        Product.objects.filter(category_id__in=categories.values_list('id', flat=True), is_available=True),
+        serializer
+    ), serializer)
+
+    return {
+        'restaurant': RestaurantSerializer(restaurant).data,
+        'categories': CategorySerializer(categories, many=True).data,
+        'products': ProductSerializer(products, many=True, fields=fields, context=context).data
+    }
+
+
+def _build_nested(restaurant, context):
+    categories = Category.objects.filter(
+        restaurant=restaurant,
+        is_active=True,
+        is_visible=True
+    ).prefetch_related('products')
+    return MenuCategorySerializer(categories, many=True).data
+
+
+# layout -> функция построения данных меню
+LAYOUTS = {
+    'full': _build_full,
+    'card': _build_card,
+    'nested': _build_nested,
+}
+
+
+def menu_layout(request, default):
+    """layout из ?view= (например, card), если такой есть, иначе default"""
+    view = request.query_params.get('view')
+    return view if view in LAYOUTS else default
+
+
+def get_menu_snapshot(restaurant, layout, request) -> MenuSnapshot:
+    """
+    Возвращает сериализованное меню ресторана для текущей menu_version.
+    Снимок собирается один раз на версию (и базовый URL, так как
+    ProductSerializer отдает абсолютные ссылки на изображения).
+    """
+    version = restaurant.menu_version
+    base_url = request.build_absolute_uri('/')
+    base_url_key = hashlib.md5(base_url.encode()).hexdigest()[:12]
+    key = f'menu_snapshot:{restaurant.pk}:{version}:{layout}:{base_url_key}'
+
+    content = _local_snapshots.get(key)
+    if content is None:
+        content = cache.get(key)
+        if content is None:
+            data = LAYOUTS[layout](restaurant, {'request': request})
+            content = JSONRenderer().render(data)
+            cache.set(key, content, SNAPSHOT_CACHE_TIMEOUT)
+        _local_snapshots.set(key, content)
+
+    return MenuSnapshot(version=version, content=content)
+
+
+def menu_snapshot_response(restaurant, layout, request):
+    """Ответ со снимком меню; 304, если у клиента актуальная версия"""
+    snapshot = get_menu_snapshot(restaurant, layout, request)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if snapshot.etag in [tag.strip() for tag in if_none_match.split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(snapshot.content, content_type='application/json')
+
+    response['ETag'] = snapshot.etag
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,127 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Keyset-пагинация по (поле, id): страница - это WHERE по значениям
+    последней строки предыдущей страницы, без COUNT(*) и OFFSET.
+
+    Включается параметром cursor (пустое значение - первая страница),
+    ответ: {'next': ссылка или null, 'results': [...]}. Без cursor работает
+    обычная постраничная пагинация, чтобы не ломать существующих клиентов.
+
+    Сортировку из OrderingFilter (?ordering=) можно использовать, если ее
+    первое поле входит в keyset_fields (индексируемые NOT NULL поля).
+    """
+    cursor_query_param = 'cursor'
+    keyset_page_size = 20
+    keyset_max_page_size = 100
+    keyset_page_size_query_param = 'page_size'
+    ordering = ('display_order', 'id')
+    keyset_fields = ()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Списки (например, результаты поиска) уже упорядочены - только постранично
+        self.keyset = self.cursor_query_param in request.query_params and isinstance(queryset, QuerySet)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.keyset_ordering = self.get_keyset_ordering(queryset, request, view)
+        queryset = queryset.order_by(*self.keyset_ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after_q(self.decode_cursor(cursor)))
+
+        page_size = self.get_keyset_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_keyset_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.keyset_page_size_query_param])
+        except (KeyError, ValueError):
+            return self.keyset_page_size
+        return max(1, min(page_size, self.keyset_max_page_size))
+
+    def get_keyset_ordering(self, queryset, request, view):
+        """Сортировка из ?ordering=, если она индексируемая, иначе ordering класса"""
+        if view is not None and any(
+            issubclass(backend, OrderingFilter) for backend in getattr(view, 'filter_backends', ())
+        ) and request.query_params.get('ordering'):
+            requested = [str(field) for field in queryset.query.order_by]
+            if requested and requested[0].lstrip('-') in self.keyset_fields:
+                first = requested[0]
+                return (first, '-id' if first.startswith('-') else 'id')
+        return self.ordering
+
+    def encode_cursor(self, instance):
+        values = [_cursor_value(getattr(instance, field.lstrip('-'))) for field in self.keyset_ordering]
+        payload = json.dumps({'o': list(self.keyset_ordering), 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            values = payload['v']
+            ordering = tuple(payload['o'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Некорректный курсор')
+        # Курсор от другой сортировки нельзя применить к этой
+        if ordering != tuple(self.keyset_ordering) or len(values) != len(ordering):
+            raise NotFound('Некорректный курсор')
+        return values
+
+    def _after_q(self, values):
+        """(a, b) > (va, vb) в порядке сортировки: a > va OR (a = va AND b > vb)"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.keyset_ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+
+class DisplayOrderKeysetPagination(KeysetPagination):
+    ordering = ('display_order', 'id')
+    keyset_fields = ('display_order', 'price', 'created_at')
+
+
+class CreatedAtKeysetPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    keyset_fields = ('created_at',)
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
@@ -0,0 +1,170 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import QuerySet, prefetch_related_objects
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+logger = logging.getLogger(__name__)
+
+_relations_cache = {}
+_relations_cache_lock = threading.Lock()
+
+
+def _walk_source(model, attrs, prefix, to_many, select_related, prefetch_related):
+    """
+    Проходит связи модели по частям source и раскладывает пути
+    в select_related (к одному) или prefetch_related (ко многим).
+    Возвращает (модель, путь, to_many) или None, если путь не из связей.
+    """
+    for attr in attrs:
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            # property или метод модели - дальше не разбираем
+            return None
+        if not model_field.is_relation:
+            return None
+
+        prefix = f'{prefix}__{attr}' if prefix else attr
+        if model_field.many_to_many or model_field.one_to_many:
+            to_many = True
+        (prefetch_related if to_many else select_related).add(prefix)
+        model = model_field.related_model
+    return model, prefix, to_many
+
+
+def _collect_relations(serializer, model, prefix, to_many, select_related, prefetch_related):
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        attrs = field.source_attrs
+        # PK-поле по FK берет значение из <fk>_id и не загружает объект
+        if isinstance(field, PrimaryKeyRelatedField) and len(attrs) == 1:
+            continue
+
+        is_relational = isinstance(field, (BaseSerializer, RelatedField, ManyRelatedField))
+        walked = _walk_source(
+            model, attrs if is_relational else attrs[:-1], prefix, to_many, select_related, prefetch_related
+        )
+
+        nested = field.child if isinstance(field, ListSerializer) else field
+        if walked is not None and isinstance(nested, BaseSerializer) and hasattr(nested, 'fields'):
+            _collect_relations(nested, *walked, select_related, prefetch_related)
+
+    # Связи, которые читают SerializerMethodField: Meta.related_sources = ['a.b', ...]
+    meta = getattr(serializer, 'Meta', None)
+    for source in getattr(meta, 'related_sources', ()):
+        _walk_source(model, source.split('.'), prefix, to_many, select_related, prefetch_related)
+
+
+def get_serializer_relations(serializer, model):
+    """
+    Возвращает (select_related, prefetch_related) для всех связей, которые
+    читает сериализатор: вложенные сериализаторы, source='a.b' и related-поля
+    """
+    key = (type(serializer), model, tuple(serializer.fields))
+    relations = _relations_cache.get(key)
+    if relations is None:
+        select_related, prefetch_related = set(), set()
+        _collect_relations(serializer, model, '', False, select_related, prefetch_related)
+        relations = (sorted(select_related), sorted(prefetch_related))
+        with _relations_cache_lock:
+            _relations_cache[key] = relations
+    return relations
+
+
+def _as_serializer(serializer):
+    return serializer() if isinstance(serializer, type) else serializer
+
+
+def optimize_queryset(queryset, serializer, select_related_extra=(), prefetch_related_extra=()):
+    """serializer - класс или экземпляр сериализатора одного объекта"""
+    serializer = _as_serializer(serializer)
+    select_related, prefetch_related = get_serializer_relations(serializer, queryset.model)
+    select_related = [*select_related, *select_related_extra]
+    prefetch_related = [*prefetch_related, *prefetch_related_extra]
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+def prefetch_for_serializer(instances, serializer):
+    """То же для уже загруженных объектов (например, после get_or_create)"""
+    if not instances:
+        return
+    select_related, prefetch_related = get_serializer_relations(_as_serializer(serializer), type(instances[0]))
+    lookups = [*select_related, *prefetch_related]
+    if lookups:
+        prefetch_related_objects(instances, *lookups)
+
+
+class AutoPrefetchMixin:
+    """
+    Подгружает связи, которые читает сериализатор, одним JOIN или
+    prefetch-запросом. Связи из SerializerMethodField сериализатор
+    перечисляет в Meta.related_sources, а связи, нужные только view, -
+    select_related_extra / prefetch_related_extra.
+
+    В DEBUG каждый SQL-запрос во время сериализации GET-ответа считается
+    ленивой загрузкой и попадает в лог (или в AssertionError при
+    AUTO_PREFETCH_RAISE_ON_LAZY_LOAD = True).
+    """
+    select_related_extra = ()
+    prefetch_related_extra = ()
+
+    def filter_queryset(self, queryset):
+        # filter_queryset, а не get_queryset: view часто переопределяют get_queryset целиком
+        queryset = super().filter_queryset(queryset)
+        if not isinstance(queryset, QuerySet):
+            return queryset
+        return optimize_queryset(
+            queryset,
+            self.get_serializer(),
+            self.select_related_extra,
+            self.prefetch_related_extra
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        lazy_load_check = getattr(self, '_lazy_load_check', None)
+        if lazy_load_check is not None and args:
+            # Выборку вычисляем заранее, чтобы ее запросы не считались ленивыми
+            if isinstance(args[0], QuerySet):
+                args = (list(args[0]),) + args[1:]
+            serializer = super().get_serializer(*args, **kwargs)
+            lazy_load_check['armed'] = True
+            return serializer
+        return super().get_serializer(*args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.DEBUG or request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+
+        self._lazy_load_check = {'armed': False, 'queries': []}
+        with connection.execute_wrapper(self._record_lazy_load):
+            response = super().dispatch(request, *args, **kwargs)
+
+        lazy_queries = self._lazy_load_check['queries']
+        self._lazy_load_check = None
+        if lazy_queries:
+            message = (
+                f"{type(self).__name__}: {len(lazy_queries)} ленивых загрузок при сериализации, "
+                f"первый запрос: {lazy_queries[0]}"
+            )
+            if getattr(settings, 'AUTO_PREFETCH_RAISE_ON_LAZY_LOAD', False):
+                raise AssertionError(message)
+            logger.warning(message)
+        return response
+
+    def _record_lazy_load(self, execute, sql, params, many, context):
+        lazy_load_check = getattr(self, '_lazy_load_check', None)
+        if lazy_load_check is not None and lazy_load_check['armed']:
+            lazy_load_check['queries'].append(sql)
+        return execute(sql, params, many, context)
@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from catalog.models import OptionValue, Product, ProductOption, ProductOptionMapping
+from core.cache import TTLCache
+from .serializers import ProductOptionSerializer
+
+# Граф опций неизменен для menu_version ресторана товара
+_local_graphs = TTLCache(max_size=4096, ttl=3600)
+
+GRAPH_CACHE_TIMEOUT = 24 * 3600
+
+
+def _product_versions(product_ids):
+    """{id товара: menu_version его ресторана} для существующих товаров, одним запросом"""
+    rows = Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'restaurant__menu_version', 'category__restaurant__menu_version'
+    )
+    return {
+        pk: restaurant_version if restaurant_version is not None else category_restaurant_version
+        for pk, restaurant_version, category_restaurant_version in rows
+    }
+
+
+def load_option_graphs(product_ids):
+    """
+    Опции товаров со значениями: {id товара: [опции]}.
+    Три запроса при любом числе товаров: привязки, опции, значения.
+    """
+    mappings = list(
+        ProductOptionMapping.objects.filter(product_id__in=product_ids).values_list('product_id', 'option_id')
+    )
+    option_ids = {option_id for _, option_id in mappings}
+    options = list(
+        ProductOption.objects.filter(pk__in=option_ids, is_active=True).prefetch_related(
+            Prefetch('values', queryset=OptionValue.objects.order_by('display_order', 'id'))
+        ).order_by('display_order', 'id')
+    )
+
+    serialized = {
+        option.pk: option_data
+        for option, option_data in zip(options, ProductOptionSerializer(options, many=True).data)
+    }
+    order = {option_id: position for position, option_id in enumerate(serialized)}
+
+    graphs = {product_id: [] for product_id in product_ids}
+    for product_id, option_id in sorted(mappings, key=lambda mapping: order.get(mapping[1], 0)):
+        if option_id in serialized:
+            graphs[product_id].append(serialized[option_id])
+    return graphs
+
+
+def get_option_graphs(product_ids):
+    """
+    Графы опций с кэшем (память процесса, затем общий кэш Django).
+    Товары, которых нет в базе, в результат не попадают.
+    """
+    versions = _product_versions(product_ids)
+    keys = {product_id: f'product_options:{product_id}:{version}' for product_id, version in versions.items()
+            if version is not None}
+
+    graphs = {}
+    for product_id, key in keys.items():
+        graph = _local_graphs.get(key)
+        if graph is not None:
+            graphs[product_id] = graph
+
+    missing = {key: product_id for product_id, key in keys.items() if product_id not in graphs}
+    if missing:
+        for key, graph in cache.get_many(list(missing)).items():
+            graphs[missing[key]] = graph
+            _local_graphs.set(key, graph)
+
+    to_load = [product_id for product_id in versions if product_id not in graphs]
+    if to_load:
+        loaded = load_option_graphs(to_load)
+        to_cache = {}
+        for product_id, graph in loaded.items():
+            graphs[product_id] = graph
+            key = keys.get(product_id)
+            # Товар без ресторана не версионируется - не кэшируем
+            if key is not None:
+                _local_graphs.set(key, graph)
+                to_cache[key] = graph
+        if to_cache:
+            cache.set_many(to_cache, GRAPH_CACHE_TIMEOUT)
+
+    return graphs
@@ -1,11 +1,16 @@
 
 from rest_framework import serializers
 from users.models import User, UserAddress
-from restaurants.models import Restaurant, RestaurantBranch
+from restaurants.hours import annotate_open_now
+from restaurants.models import DeliveryZone, Restaurant, RestaurantBranch
+from restaurants.polygons import polygon_points
 from catalog.models import Category, Product, Tag, ProductOption, OptionValue
 from orders.models import Order, OrderItem, Cart, CartItem, PromoCode, BonusRule, UserBonusTransaction
 from payments.models import Payment
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from .fieldsets import SparseFieldsSerializerMixin
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,6 +48,8 @@ class UserSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'telegram_id', 'registration_date',
                             'created_at', 'updated_at', 'pickup_restaurant_info']
+        # Связи, которые читает get_pickup_restaurant_info (см. api.prefetch)
+        related_sources = ['selected_branch_for_pickup.restaurant', 'selected_restaurant_for_pickup']
 
     def get_pickup_restaurant_info(self, obj):
         """Возвращает информацию о выбранном ресторане для самовывоза"""
@@ -171,18 +178,44 @@ class AdminRestaurantSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class RestaurantBranchListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # is_open для всего списка: локальное время - один раз на часовой пояс
+        branches = list(data.all() if hasattr(data, 'all') else data)
+        annotate_open_now(branches)
+        return super().to_representation(branches)
+
+
 class RestaurantBranchSerializer(serializers.ModelSerializer):
     restaurant_name = serializers.CharField(source='restaurant.name')
+    is_open = serializers.SerializerMethodField()
 
     class Meta:
         model = RestaurantBranch
         fields = [
             'id', 'name', 'restaurant', 'restaurant_name', 'address',
             'city', 'latitude', 'longitude', 'phone', 'business_hours',
+            'schedule_exceptions', 'is_open',
             'min_order_amount', 'delivery_fee', 'free_delivery_threshold',
             'delivery_radius_meters', 'accepted_payment_methods',
             'is_accepting_orders'
         ]
+        list_serializer_class = RestaurantBranchListSerializer
+
+    def get_is_open(self, obj):
+        is_open = getattr(obj, 'is_open', None)
+        return obj.is_open_now() if is_open is None else is_open
+
+
+class DeliveryZoneSerializer(serializers.ModelSerializer):
+    polygon = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DeliveryZone
+        fields = ['id', 'name', 'polygon', 'delivery_fee', 'min_order_amount', 'free_delivery_threshold']
+
+    def get_polygon(self, obj):
+        return polygon_points(obj.polygon)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -200,11 +233,11 @@ class ProductOptionSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'option_type', 'is_required',
             'min_selection', 'max_selection', 'values'
         ]
+        related_sources = ['values']
 
     def get_values(self, obj):
-        # Return the option values for this product option
-        values = OptionValue.objects.filter(option=obj)
-        return OptionValueSerializer(values, many=True).data
+        # Return the option values for this product option (из prefetch_related, если он был)
+        return OptionValueSerializer(obj.values.all(), many=True).data
 
 
 class OptionValueSerializer(serializers.ModelSerializer):
@@ -217,6 +250,20 @@ class OptionValueSerializer(serializers.ModelSerializer):
         ]
 
 
+class MenuChangesOptionSerializer(ProductOptionSerializer):
+    """Опция для дельты меню: значения отдаются отдельно"""
+    values = None
+
+    class Meta(ProductOptionSerializer.Meta):
+        fields = [name for name in ProductOptionSerializer.Meta.fields if name != 'values'] + ['display_order']
+        related_sources = []
+
+
+class MenuChangesOptionValueSerializer(OptionValueSerializer):
+    class Meta(OptionValueSerializer.Meta):
+        fields = OptionValueSerializer.Meta.fields + ['option']
+
+
 class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     # Измените поля для приема одного файла, а не списка
     main_image = serializers.ImageField(required=False, allow_null=True, write_only=True)
@@ -230,7 +277,7 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'description', 'short_description', 'price',
+            'id', 'name', 'sku', 'description', 'short_description', 'price',
             'old_price', 'cost_price', 'category', 'restaurant',
             'weight_grams', 'volume_ml', 'calories', 'proteins', 'fats', 'carbohydrates',
             'main_image', 'additional_images', 'video_url', 'is_available',
@@ -242,27 +289,26 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'main_image_url', 'image_urls']
 
+    # image_variants пишет фоновая обработка изображений (catalog.images), сериализатор его не сохраняет
+    IMAGE_FIELDS = ['main_image_url', 'image_urls', 'updated_at']
+
     def create(self, validated_data):
         # Извлекаем файлы изображений
         main_image = validated_data.pop('main_image', None)
         additional_images = validated_data.pop('additional_images', [])
 
-        # Создаем продукт без изображений
-        product = Product.objects.create(**validated_data)
+        with transaction.atomic():
+            # Создаем продукт без изображений
+            product = Product.objects.create(**validated_data)
 
-        # Сохраняем основное изображение
-        if main_image:
-            product.main_image_url = self.save_image(main_image, product, 'main')
-            product.save()
-
-        # Сохраняем дополнительные изображения
-        if additional_images:
-            image_urls = []
-            for img in additional_images:
-                url = self.save_image(img, product, 'additional')
-                image_urls.append(url)
-            product.image_urls = image_urls
-            product.save()
+            # Сохраняем основное и дополнительные изображения
+            if main_image:
+                product.main_image_url = self.save_image(main_image)
+            if additional_images:
+                product.image_urls = [self.save_image(img) for img in additional_images]
+            if main_image or additional_images:
+                product.save(update_fields=self.IMAGE_FIELDS)
+                self.schedule_image_processing(product)
 
         return product
 
@@ -278,40 +324,38 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         # Обновляем основное изображение если предоставлено
         if main_image is not None:
             if main_image:  # Новое изображение
-                instance.main_image_url = self.save_image(main_image, instance, 'main')
+                instance.main_image_url = self.save_image(main_image)
             else:  # None - удаляем изображение
                 instance.main_image_url = None
 
         # Обновляем дополнительные изображения если предоставлены
         if additional_images is not None:
-            image_urls = []
-            for img in additional_images:
-                url = self.save_image(img, instance, 'additional')
-                image_urls.append(url)
-            instance.image_urls = image_urls
+            instance.image_urls = [self.save_image(img) for img in additional_images]
 
-        instance.save()
+        update_fields = [
+            field.attname for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name != 'image_variants'
+        ]
+        with transaction.atomic():
+            instance.save(update_fields=update_fields)
+            if main_image or additional_images:
+                self.schedule_image_processing(instance)
         return instance
 
-    def save_image(self, image_file, product, image_type='additional'):
-        """Сохраняет изображение и возвращает URL"""
-        import os
-        from django.core.files.storage import default_storage
-        from django.utils.timezone import now
+    def save_image(self, image_file):
+        """Сохраняет изображение под именем из хэша содержимого и возвращает URL"""
+        from catalog.images import store_original
 
-        # Генерируем уникальное имя файла
-        timestamp = now().strftime('%Y%m%d_%H%M%S')
-        ext = os.path.splitext(image_file.name)[1]
-        filename = f'{image_type}_{timestamp}_{product.id}{ext}'
+        return store_original(image_file)
 
-        # Сохраняем файл
-        file_path = default_storage.save(f'products/{product.id}/{filename}', image_file)
+    def schedule_image_processing(self, product):
+        """Уменьшенные варианты строятся в фоне (catalog.images) после коммита сохранения товара"""
+        from catalog.images import image_processor
 
-        # Возвращаем URL
-        return f'/media/{file_path}'
+        image_processor.schedule(product.pk)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', allow_null=True)
     restaurant_name = serializers.CharField(source='restaurant.name', allow_null=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -320,6 +364,9 @@ class ProductSerializer(serializers.ModelSerializer):
     # Добавляем поле для полного URL изображения
     main_image_url_full = serializers.SerializerMethodField()
     image_urls_full = serializers.SerializerMethodField()
+    # Уменьшенные варианты: {'webp': 'url 320w, url 640w', 'jpeg': ...} или null, пока не готовы
+    main_image_srcset = serializers.SerializerMethodField()
+    image_urls_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -327,11 +374,26 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'short_description', 'price',
             'old_price', 'category', 'category_name', 'restaurant',
             'restaurant_name', 'weight_grams', 'calories', 'main_image_url',
-            'main_image_url_full', 'image_urls', 'image_urls_full',
-            'is_popular', 'is_new', 'is_recommended',
+            'main_image_url_full', 'main_image_srcset', 'image_urls', 'image_urls_full',
+            'image_urls_srcset', 'is_popular', 'is_new', 'is_recommended',
             'is_vegetarian', 'is_vegan', 'is_gluten_free', 'tags',
             'in_stock', 'cooking_time_minutes', 'stock_quantity'
         ]
+        # ?view=card - поля карточки товара в меню
+        field_views = {
+            'card': [
+                'id', 'name', 'short_description', 'price', 'old_price', 'category',
+                'main_image_url_full', 'main_image_srcset', 'weight_grams', 'is_popular', 'is_new',
+                'is_vegetarian', 'in_stock',
+            ],
+        }
+        method_field_sources = {
+            'main_image_url_full': ['main_image_url'],
+            'image_urls_full': ['image_urls'],
+            'main_image_srcset': ['main_image_url', 'image_variants'],
+            'image_urls_srcset': ['image_urls', 'image_variants'],
+            'in_stock': ['is_unlimited_stock', 'stock_quantity', 'is_available'],
+        }
 
     def get_main_image_url_full(self, obj):
         if obj.main_image_url:
@@ -350,6 +412,26 @@ class ProductSerializer(serializers.ModelSerializer):
                 return [f"{settings.SITE_URL}{url}" for url in obj.image_urls]
         return obj.image_urls or []
 
+    def _absolute_url(self, url):
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(url)
+        return f"{settings.SITE_URL}{url}" if hasattr(settings, 'SITE_URL') else url
+
+    def _srcset(self, obj, url):
+        from catalog.images import VARIANT_FORMATS, srcset
+
+        variants = (obj.image_variants or {}).get(url) if url else None
+        if not variants:
+            return None
+        return {format_name: srcset(variants, format_name, self._absolute_url) for format_name in VARIANT_FORMATS}
+
+    def get_main_image_srcset(self, obj):
+        return self._srcset(obj, obj.main_image_url)
+
+    def get_image_urls_srcset(self, obj):
+        return [self._srcset(obj, url) for url in obj.image_urls or []]
+
     def get_in_stock(self, obj):
         if obj.is_unlimited_stock:
             return True
@@ -369,20 +451,53 @@ class CategoryWithChildrenSerializer(serializers.ModelSerializer):
                  'display_order', 'is_active', 'is_visible', 'restaurant', 'restaurant_name', 'created_at', 'updated_at', 'children']
 
     def get_children(self, obj):
-        # Get children categories recursively
-        children = Category.objects.filter(parent=obj, is_active=True, is_visible=True)
-        if children.exists():
+        # Дерево загружается одним запросом на ресторан и переиспользуется
+        # всеми вложенными сериализаторами через общий context
+        # ({id ресторана: карта дочерних категорий}, см. catalog.tree)
+        children_maps = self.context.setdefault('category_children', {})
+        children_map = children_maps.get(obj.restaurant_id)
+        if children_map is None:
+            from catalog.tree import category_children_map
+            children_map = children_maps[obj.restaurant_id] = category_children_map([obj.restaurant_id])
+
+        children = children_map.get(obj.id, [])
+        if children:
             return CategoryWithChildrenSerializer(children, many=True, context=self.context).data
         return []
 
 
 class CategorySerializer(serializers.ModelSerializer):
     restaurant = serializers.PrimaryKeyRelatedField(queryset=Restaurant.objects.all(), required=False)
+    parent = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False, allow_null=True)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'image_url', 'icon_url',
-                 'display_order', 'is_active', 'is_visible', 'restaurant', 'created_at', 'updated_at']
+                 'display_order', 'is_active', 'is_visible', 'restaurant', 'parent', 'created_at', 'updated_at']
+
+    def validate_parent(self, parent):
+        # Перенос в собственное поддерево (см. Category.clean)
+        if parent is not None and self.instance is not None:
+            category = Category(pk=self.instance.pk, parent_id=parent.pk)
+            try:
+                category.clean()
+            except DjangoValidationError as e:
+                raise serializers.ValidationError(e.message_dict['parent'])
+        return parent
+
+
+class MenuItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'description', 'main_image_url']
+
+
+class MenuCategorySerializer(serializers.ModelSerializer):
+    products = MenuItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'description', 'products']
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -427,12 +542,20 @@ class OrderSerializer(serializers.ModelSerializer):
     branch = RestaurantBranchSerializer(read_only=True)
     delivery_address = UserAddressSerializer(read_only=True)
     items = OrderItemSerializer(many=True, read_only=True)
+    branch_id = serializers.PrimaryKeyRelatedField(
+        source='branch', queryset=RestaurantBranch.objects.filter(is_active=True, is_accepting_orders=True),
+        write_only=True
+    )
+    delivery_address_id = serializers.PrimaryKeyRelatedField(
+        source='delivery_address', queryset=UserAddress.objects.all(),
+        write_only=True, required=False, allow_null=True
+    )
 
     class Meta:
         model = Order
         fields = [
-            'id', 'order_number', 'user', 'branch', 'order_type', 'status',
-            'delivery_address', 'preferred_delivery_time', 'delivery_time_slot',
+            'id', 'order_number', 'user', 'branch', 'branch_id', 'order_type', 'status',
+            'delivery_address', 'delivery_address_id', 'preferred_delivery_time', 'delivery_time_slot',
             'subtotal', 'delivery_fee', 'service_fee', 'packaging_fee',
             'discount_amount', 'bonus_used', 'total_amount', 'tips_amount',
             'promo_code', 'promo_discount_amount', 'bonus_percent_used', 'bonus_earned',
@@ -447,6 +570,16 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'order_number', 'user', 'created_at', 'updated_at']
 
+    def validate(self, attrs):
+        address = attrs.get('delivery_address')
+        request = self.context.get('request')
+        if address is not None and request is not None and address.user_id != request.user.id:
+            raise serializers.ValidationError({'delivery_address_id': 'Адрес не найден'})
+        order_type = attrs.get('order_type', getattr(self.instance, 'order_type', None))
+        if self.instance is None and order_type == 'delivery' and address is None:
+            raise serializers.ValidationError({'delivery_address_id': 'Для доставки нужен адрес'})
+        return attrs
+
 
 class PromoCodeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -74,6 +74,10 @@ urlpatterns = [
     path('products/<int:pk>/options/', views.ProductOptionsView.as_view(), name='product-options'),
     path('products/search/', views.ProductSearchView.as_view(), name='product-search'),
 
+    # Массовый импорт и экспорт каталога (персонал)
+    path('catalog/import/', views.CatalogImportView.as_view(), name='catalog-import'),
+    path('catalog/export/', views.CatalogExportView.as_view(), name='catalog-export'),
+
     # Branch endpoints
     path('branches/<int:pk>/availability/', views.BranchAvailabilityView.as_view(), name='branch-availability'),
     path('branches/<int:pk>/delivery_zones/', views.BranchDeliveryZonesView.as_view(), name='branch-delivery-zones'),
@@ -93,6 +97,9 @@ urlpatterns = [
     path('dashboard/recent-orders/', views.RecentOrdersView.as_view(), name='dashboard-recent-orders'),
     path('dashboard/popular-products/', views.PopularProductsView.as_view(), name='dashboard-popular-products'),
 
+    # Метрики для Prometheus (только для персонала)
+    path('_metrics', views.MetricsView.as_view(), name='metrics'),
+
     # Delivery endpoints
     path('delivery_preferences/', views.DeliveryPreferencesView.as_view(), name='delivery_preferences'),
 ]
\ No newline at end of file
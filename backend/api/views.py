@@ -3,12 +3,16 @@ from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate, login
 from django.http import JsonResponse
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db.models import Count, Sum, F
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.db import transaction
+from django.db.models import Count, Sum, F, Q
 from django.db.models.functions import TruncDate
 from django.utils import timezone
 from django.contrib.auth import authenticate, login, logout
@@ -17,10 +21,20 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.hashers import check_password
 from django.middleware.csrf import get_token
 import json
-from datetime import timedelta
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
 from users.models import User, UserAddress
+from restaurants.hours import ORDER_TYPES
 from restaurants.models import Restaurant, RestaurantBranch
+from restaurants.zones import DeliveryUnavailable, branches_delivering_to, check_delivery, check_many
 from catalog.models import Category, Product, Tag, ProductOption, OptionValue
+from catalog.search import search_products
+from catalog.suggest import suggest as suggest_products
+from catalog.tree import category_children_map, subtree_q
+from orders.checkout import ORDER_DEFAULTS, EmptyCart, place_order
+from orders.eta import estimate, order_estimate
+from orders.slots import SlotUnavailable, time_slots
+from orders.stock import InsufficientStock
 from orders.models import Order, OrderItem, Cart, CartItem, PromoCode, BonusRule, UserBonusTransaction
 from payments.models import Payment
 
@@ -28,12 +42,66 @@ logger = logging.getLogger(__name__)
 
 from .serializers import (
     UserSerializer, UserAddressSerializer, RestaurantSerializer,
-    RestaurantBranchSerializer, CategorySerializer, ProductSerializer,
+    RestaurantBranchSerializer, DeliveryZoneSerializer, CategorySerializer, ProductSerializer,
     TagSerializer, OrderSerializer, CartSerializer, PromoCodeSerializer,
     BonusRuleSerializer, UserBonusTransactionSerializer, AdminRestaurantSerializer,
-    ProductCreateUpdateSerializer,
+    ProductCreateUpdateSerializer, CategoryWithChildrenSerializer,
 )
-from .authentication import TelegramAuthentication
+from .menu_snapshots import menu_layout, menu_snapshot_response
+from .fieldsets import SparseFieldsViewMixin, narrow_queryset
+from .prefetch import AutoPrefetchMixin, optimize_queryset, prefetch_for_serializer
+from .product_options import get_option_graphs
+from .facets import product_facets_response
+from .menu_changes import menu_changes_response
+from .delivery_quotes import delivery_quotes_response, parse_order_amount
+from .pagination import CreatedAtKeysetPagination, DisplayOrderKeysetPagination
+from .authentication import TelegramAuthentication, STATELESS_AUTHENTICATION_CLASSES, issue_tokens_for_user
+
+
+def category_products_q(category, request):
+    """Товары категории; с include_subcategories=1 - всего поддерева одним диапазоном по path"""
+    if request.query_params.get('include_subcategories') in ('1', 'true') and category.path:
+        return subtree_q(category.path, 'category__path')
+    return Q(category=category)
+
+
+MAX_BATCH_OPTIONS = 100
+MAX_NEARBY_BRANCHES = 50
+
+
+def product_options_response(pk):
+    try:
+        product_id = int(pk)
+    except (TypeError, ValueError):
+        return Response({'error': 'Товар не найден'}, status=status.HTTP_404_NOT_FOUND)
+
+    graphs = get_option_graphs([product_id])
+    if product_id not in graphs:
+        return Response({'error': 'Товар не найден'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'product_id': product_id, 'options': graphs[product_id]})
+
+
+def search_products_from_request(request, queryset):
+    """Поиск товаров по параметрам q, restaurant, category, tags, min_price, max_price, sort"""
+    params = request.query_params
+    try:
+        restaurant_id = int(params['restaurant']) if params.get('restaurant') else None
+        category_id = int(params['category']) if params.get('category') else None
+        min_price = Decimal(params['min_price']) if params.get('min_price') else None
+        max_price = Decimal(params['max_price']) if params.get('max_price') else None
+    except (ValueError, InvalidOperation):
+        raise ValidationError({'error': 'Некорректные параметры поиска'})
+
+    return search_products(
+        params.get('q', ''),
+        restaurant_id=restaurant_id,
+        category_id=category_id,
+        tags=[tag for value in params.getlist('tags') for tag in value.split(',') if tag],
+        min_price=min_price,
+        max_price=max_price,
+        sort=params.get('sort'),
+        queryset=queryset
+    )
 
 
 @csrf_exempt
@@ -125,7 +193,7 @@ class AuthViewSet(viewsets.ViewSet):
     Аутентификация через Telegram и JWT
     """
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], authentication_classes=[], permission_classes=[AllowAny])
     def telegram(self, request):
         """
         Аутентификация через Telegram initData
@@ -134,33 +202,68 @@ class AuthViewSet(viewsets.ViewSet):
             "initData": "query_id=...&user=..."
         }
         """
-        # This would implement Telegram authentication logic
-        # For now, returning a placeholder response
+        init_data = request.data.get('initData') or request.META.get('HTTP_X_TELEGRAM_INIT_DATA')
+        if not init_data:
+            return Response({'error': 'initData обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user = TelegramAuthentication().authenticate_credentials(init_data)
+        except AuthenticationFailed as e:
+            # Без authentication_classes DRF отдал бы 403 вместо 401
+            return Response({'error': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if not user.is_active or user.is_blocked:
+            return Response({'error': 'Пользователь заблокирован'}, status=status.HTTP_403_FORBIDDEN)
+
         return Response({
-            "message": "Telegram authentication endpoint",
-            "tokens": {
-                "access_token": "fake_access_token",
-                "refresh_token": "fake_refresh_token"
-            }
+            'tokens': issue_tokens_for_user(user),
+            'user': UserSerializer(user).data
         })
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], authentication_classes=[], permission_classes=[AllowAny])
     def refresh(self, request):
         """
         Обновление JWT токена
         POST /api/v1/auth/refresh/
+        {
+            "refresh_token": "..."
+        }
         """
-        # Implementation would go here
-        return Response({"message": "Token refresh endpoint"})
+        raw_token = request.data.get('refresh_token') or request.data.get('refresh')
+        if not raw_token:
+            return Response({'error': 'refresh_token обязателен'}, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['post'])
+        try:
+            refresh = RefreshToken(raw_token)
+            user = User.objects.get(pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True, is_blocked=False)
+        except (TokenError, KeyError, User.DoesNotExist):
+            return Response({'error': 'Недействительный refresh_token'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        # Выпускаем пару заново, чтобы claims (настройки доставки, is_staff) были актуальными
+        if jwt_settings.BLACKLIST_AFTER_ROTATION:
+            refresh.blacklist()
+
+        return Response({'tokens': issue_tokens_for_user(user)})
+
+    @action(detail=False, methods=['post'], authentication_classes=[], permission_classes=[AllowAny])
     def logout(self, request):
         """
         Выход из системы
         POST /api/v1/auth/logout/
+        {
+            "refresh_token": "..."
+        }
         """
-        # Implementation would go here
-        return Response({"message": "Logout endpoint"})
+        raw_token = request.data.get('refresh_token') or request.data.get('refresh')
+        if not raw_token:
+            return Response({'error': 'refresh_token обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            RefreshToken(raw_token).blacklist()
+        except TokenError:
+            # Токен уже отозван или истек - для клиента результат тот же
+            pass
+
+        return Response({'success': True})
 
     @action(detail=False, methods=['get'])
     def me(self, request):
@@ -188,23 +291,6 @@ class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
         permission_classes = [AllowAny]
         return [permission() for permission in permission_classes]
 
-    def get_authenticators(self):
-        """
-        Returns the authenticator classes that this view uses.
-        Allows both authenticated and unauthenticated access.
-        """
-        from .authentication import TelegramAuthentication
-        from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-
-        # Include Telegram authentication along with standard ones
-        authenticator_classes = [
-            TelegramAuthentication,
-            SessionAuthentication,
-            TokenAuthentication
-        ]
-
-        return [auth() for auth in authenticator_classes]
-
     @action(detail=True, methods=['get'])
     def branches(self, request, pk=None):
         """
@@ -212,7 +298,9 @@ class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
         GET /api/v1/restaurants/{id}/branches/
         """
         restaurant = self.get_object()
-        branches = RestaurantBranch.objects.filter(restaurant=restaurant, is_active=True)
+        branches = optimize_queryset(
+            RestaurantBranch.objects.filter(restaurant=restaurant, is_active=True), RestaurantBranchSerializer
+        )
         serializer = RestaurantBranchSerializer(branches, many=True)
         return Response(serializer.data)
 
@@ -220,33 +308,108 @@ class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
     def menu(self, request, pk=None):
         """
         Меню ресторана (категории и товары)
-        GET /api/v1/restaurants/{id}/menu/
+        GET /api/v1/restaurants/{id}/menu/?view=card
         """
         restaurant = self.get_object()
+        return menu_snapshot_response(restaurant, menu_layout(request, 'full'), request)
 
-        # Get categories for the restaurant
-        categories = Category.objects.filter(restaurant=restaurant, is_active=True, is_visible=True)
-        categories_serializer = CategorySerializer(categories, many=True)
+    @action(detail=True, methods=['get'], url_path='menu/changes')
+    def menu_changes(self, request, pk=None):
+        """
+        Изменения меню после токена (дельта-синхронизация)
+        GET /api/v1/restaurants/{id}/menu/changes/?since={token}
+        Без since - все меню; token из ответа передается в следующий запрос.
+        """
+        restaurant = self.get_object()
+        return menu_changes_response(restaurant, request)
+
+
+def branch_availability(branch, order_type):
+    """Открыт ли филиал для типа заказа, когда откроется, если закрыт, и когда будет готов заказ"""
+    schedule_type = order_type if order_type in ORDER_TYPES else 'any'
+    is_open = branch.is_open_now(order_type=schedule_type)
+    next_opening = None if is_open else branch.get_next_opening_time(order_type=schedule_type)
+    # Оценка по текущей загрузке филиала (orders.eta); закрытый филиал начнет готовить после открытия
+    eta = estimate(branch, order_type, at=next_opening)
+    return {
+        'is_open': is_open,
+        'next_opening_at': next_opening.isoformat() if next_opening else None,
+        'can_accept_orders': branch.is_accepting_orders,
+        'order_type': order_type,
+        'preparation_time': f"{branch.preparation_time_min}-{branch.preparation_time_max} minutes",
+        'estimated_ready_at': eta.ready_at.isoformat(),
+        'estimated_delivery_at': eta.delivered_at.isoformat() if eta.delivered_at else None,
+    }
 
-        # Get all products for the restaurant that belong to visible/active categories
-        category_ids = categories.values_list('id', flat=True)
-        products = Product.objects.filter(
-            category_id__in=category_ids,
-            is_available=True
-        )
-        products_serializer = ProductSerializer(products, many=True)
 
-        # Prepare response data
-        response_data = {
-            'restaurant': RestaurantSerializer(restaurant).data,
-            'categories': categories_serializer.data,
-            'products': products_serializer.data
+def branch_delivery_zones(branch, request):
+    """
+    Условия доставки филиала и его зоны; с ?lat=&lng= (и order_amount) - еще
+    и проверка доставки в эту точку
+    """
+    zones = branch.delivery_zones.filter(is_active=True).order_by('delivery_fee', 'pk')
+    data = {
+        'branch_id': branch.id,
+        'delivery_radius_meters': branch.delivery_radius_meters,
+        'delivery_fee': float(branch.delivery_fee),
+        'delivery_fee_ranges': branch.delivery_fee_ranges or [],
+        'free_delivery_threshold': float(branch.free_delivery_threshold) if branch.free_delivery_threshold else None,
+        'zones': DeliveryZoneSerializer(zones, many=True).data,
+    }
+    if 'lat' in request.query_params or 'lng' in request.query_params:
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lng'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Нужны числовые параметры lat и lng'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order_amount = parse_order_amount(request.query_params.get('order_amount'))
+        except ValueError:
+            return Response({'error': 'Некорректная сумма заказа'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({'error': 'Координаты вне диапазона'}, status=status.HTTP_400_BAD_REQUEST)
+        check = check_delivery(branch, latitude, longitude, order_amount)
+        data['quote'] = {
+            'distance_meters': round(check.distance_meters),
+            'deliverable': check.deliverable,
+            'delivery_fee': str(check.delivery_fee) if check.deliverable else None,
+            'zone_id': check.zone_id,
+            'min_order_amount': str(check.min_order_amount) if check.min_order_amount is not None else None,
+            'reason': check.reason,
         }
-
-        return Response(response_data)
+    return Response(data)
+
+
+def branch_time_slots(branch, request):
+    """Слоты даты с оставшейся емкостью (см. orders.slots)"""
+    slot_type = request.query_params.get('slot_type', 'delivery')
+    if slot_type not in ORDER_TYPES:
+        return Response({'error': 'slot_type: delivery или pickup'}, status=status.HTTP_400_BAD_REQUEST)
+    day = request.query_params.get('date')
+    try:
+        day = date.fromisoformat(day) if day else branch.get_schedule().local().date()
+    except ValueError:
+        return Response({'error': 'Дата в формате YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'date': day.isoformat(),
+        'slot_type': slot_type,
+        'slots': [
+            {
+                'time': f'{slot.starts_at:%H:%M}-{slot.ends_at:%H:%M}',
+                'slot': slot.label,
+                'starts_at': slot.starts_at.isoformat(),
+                'ends_at': slot.ends_at.isoformat(),
+                'capacity': slot.capacity,
+                'remaining': slot.remaining,
+                'available': slot.available,
+            }
+            for slot in time_slots(branch, day, slot_type)
+        ],
+    })
 
 
-class RestaurantBranchViewSet(viewsets.ReadOnlyModelViewSet):
+class RestaurantBranchViewSet(AutoPrefetchMixin, viewsets.ReadOnlyModelViewSet):
     """
     Филиалы ресторанов
     """
@@ -262,22 +425,53 @@ class RestaurantBranchViewSet(viewsets.ReadOnlyModelViewSet):
         permission_classes = [AllowAny]
         return [permission() for permission in permission_classes]
 
-    def get_authenticators(self):
+    @action(detail=False, methods=['get'], authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
+    def nearby(self, request):
         """
-        Returns the authenticator classes that this view uses.
-        Allows both authenticated and unauthenticated access.
+        Филиалы, которые доставляют в точку, от ближайшего
+        GET /api/v1/branches/nearby/?lat=55.75&lng=37.61
+        Параметры:
+        - restaurant: id ресторана
+        - order_amount: сумма заказа (для минимальной суммы и бесплатной доставки)
+        - limit: по умолчанию 20, максимум 50
+        Филиалы с зонами доставки отбираются и считаются по зонам. delivery_fee
+        в ответе - стоимость доставки в эту точку (null, если сумма меньше
+        минимальной), zone_id - выбранная зона.
         """
-        from .authentication import TelegramAuthentication
-        from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-
-        # Include Telegram authentication along with standard ones
-        authenticator_classes = [
-            TelegramAuthentication,
-            SessionAuthentication,
-            TokenAuthentication
-        ]
-
-        return [auth() for auth in authenticator_classes]
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lng'])
+            restaurant_id = request.query_params.get('restaurant')
+            restaurant_id = int(restaurant_id) if restaurant_id else None
+            limit = max(1, min(int(request.query_params.get('limit', 20)), MAX_NEARBY_BRANCHES))
+        except (KeyError, ValueError):
+            return Response({'error': 'Нужны числовые параметры lat и lng'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order_amount = parse_order_amount(request.query_params.get('order_amount'))
+        except ValueError:
+            return Response({'error': 'Некорректная сумма заказа'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({'error': 'Координаты вне диапазона'}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = branches_delivering_to(latitude, longitude, restaurant_id, limit)
+        branches = RestaurantBranch.objects.select_related('restaurant').in_bulk([pk for _, pk in matches])
+        ordered = [(distance, branches[pk]) for distance, pk in matches if pk in branches]
+        data = RestaurantBranchSerializer([branch for _, branch in ordered], many=True).data
+        checks = check_many([branch for _, branch in ordered], [(latitude, longitude)], order_amount)
+        for item, (distance, branch), check in zip(data, ordered, checks):
+            item['distance_meters'] = round(distance)
+            item['delivery_fee'] = str(check.delivery_fee) if check.deliverable else None
+            item['zone_id'] = check.zone_id
+        return Response({'results': data})
+
+    @action(detail=False, methods=['post'], authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
+    def quotes(self, request):
+        """
+        Стоимость доставки для многих пар точка/адрес x филиал
+        POST /api/v1/branches/quotes/
+        Формат запроса и ответа - в api.delivery_quotes.
+        """
+        return delivery_quotes_response(request)
 
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
@@ -291,16 +485,7 @@ class RestaurantBranchViewSet(viewsets.ReadOnlyModelViewSet):
         branch = self.get_object()
         order_type = request.query_params.get('order_type', 'delivery')
 
-        # Placeholder implementation
-        is_open = branch.is_open_now()
-        can_accept_orders = branch.is_accepting_orders
-
-        return Response({
-            'is_open': is_open,
-            'can_accept_orders': can_accept_orders,
-            'order_type': order_type,
-            'preparation_time': f"{branch.preparation_time_min}-{branch.preparation_time_max} minutes"
-        })
+        return Response(branch_availability(branch, order_type))
 
     @action(detail=True, methods=['get'])
     def delivery_zones(self, request, pk=None):
@@ -308,14 +493,8 @@ class RestaurantBranchViewSet(viewsets.ReadOnlyModelViewSet):
         Зоны доставки филиала
         GET /api/v1/branches/{id}/delivery_zones/
         """
-        # Placeholder implementation
         branch = self.get_object()
-        return Response({
-            'branch_id': branch.id,
-            'delivery_radius_meters': branch.delivery_radius_meters,
-            'delivery_fee': float(branch.delivery_fee),
-            'free_delivery_threshold': float(branch.free_delivery_threshold) if branch.free_delivery_threshold else None
-        })
+        return branch_delivery_zones(branch, request)
 
     @action(detail=True, methods=['get'])
     def time_slots(self, request, pk=None):
@@ -323,21 +502,14 @@ class RestaurantBranchViewSet(viewsets.ReadOnlyModelViewSet):
         Доступные слоты времени
         GET /api/v1/branches/{id}/time_slots/
         Параметры:
-        - date: YYYY-MM-DD
+        - date: YYYY-MM-DD (по умолчанию - сегодня во времени ресторана)
         - slot_type: delivery/pickup
+        slot в ответе - значение для delivery_time_slot заказа.
         """
-        # Placeholder implementation
-        return Response({
-            'slots': [
-                {'time': '10:00-11:00', 'available': True},
-                {'time': '11:00-12:00', 'available': True},
-                {'time': '12:00-13:00', 'available': False},
-                {'time': '13:00-14:00', 'available': True},
-            ]
-        })
+        return branch_time_slots(self.get_object(), request)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(AutoPrefetchMixin, viewsets.ModelViewSet):
     """
     Категории товаров
     """
@@ -356,7 +528,6 @@ class CategoryViewSet(viewsets.ModelViewSet):
         """
         # Use hierarchical serializer for list view in admin panel
         if self.action == 'list':
-            from .serializers import CategoryWithChildrenSerializer
             return CategoryWithChildrenSerializer
         return CategorySerializer
 
@@ -365,7 +536,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
         Instantiates and returns the list of permissions that this view requires.
         """
         from rest_framework.permissions import IsAuthenticated, AllowAny
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'tree']:
             # Public endpoints for frontend
             permission_classes = [AllowAny]
         else:
@@ -373,22 +544,37 @@ class CategoryViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
-    def get_authenticators(self):
-        """
-        Returns the authenticator classes that this view uses.
-        Allows both authenticated and unauthenticated access.
-        """
-        from .authentication import TelegramAuthentication
-        from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        categories = page if page is not None else list(queryset)
 
-        # Include Telegram authentication along with standard ones
-        authenticator_classes = [
-            TelegramAuthentication,
-            SessionAuthentication,
-            TokenAuthentication
-        ]
+        # Дочерние категории всех ресторанов страницы - одним запросом
+        children_map = category_children_map({category.restaurant_id for category in categories})
+        context = self.get_serializer_context()
+        context['category_children'] = {category.restaurant_id: children_map for category in categories}
+        serializer = self.get_serializer(categories, many=True, context=context)
 
-        return [auth() for auth in authenticator_classes]
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """
+        Дерево видимых категорий ресторана
+        GET /api/v1/categories/tree/?restaurant={id}
+        """
+        try:
+            restaurant_id = int(request.query_params['restaurant'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Параметр restaurant обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        children_map = category_children_map([restaurant_id])
+        context = self.get_serializer_context()
+        context['category_children'] = {restaurant_id: children_map}
+        serializer = CategoryWithChildrenSerializer(children_map.get(None, []), many=True, context=context)
+        return Response(serializer.data)
 
     def perform_create(self, serializer):
         """
@@ -413,14 +599,23 @@ class CategoryViewSet(viewsets.ModelViewSet):
         """
         Товары категории
         GET /api/v1/categories/{id}/products/
+        Параметры:
+        - include_subcategories: 1 - вместе с товарами подкатегорий
+        - view=card или fields=a,b,c - только эти поля товара
         """
         category = self.get_object()
-        products = Product.objects.filter(category=category, is_available=True)
-        serializer = ProductSerializer(products, many=True)
+        fields = ProductSerializer.resolve_requested_fields(request.query_params)
+        products = optimize_queryset(
+            Product.objects.filter(category_products_q(category, request), is_available=True),
+            ProductSerializer(fields=fields)
+        )
+        if fields is not None:
+            products = narrow_queryset(products, ProductSerializer(fields=fields))
+        serializer = ProductSerializer(products, many=True, fields=fields)
         return Response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(SparseFieldsViewMixin, AutoPrefetchMixin, viewsets.ModelViewSet):
     """
     Товары
     """
@@ -430,6 +625,7 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = DisplayOrderKeysetPagination
     parser_classes = [MultiPartParser, FormParser, JSONParser]  # Важно: MultiPartParser должен быть первым!
     filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
     search_fields = ['name', 'description', 'short_description']
@@ -450,7 +646,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         Instantiates and returns the list of permissions that this view requires.
         """
         from rest_framework.permissions import IsAuthenticated, AllowAny
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'search', 'suggest', 'facets', 'options', 'batch_options']:
             # Public endpoints for frontend
             permission_classes = [AllowAny]
         else:
@@ -458,33 +654,36 @@ class ProductViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
-    def get_authenticators(self):
-        """
-        Returns the authenticator classes that this view uses.
-        Allows both authenticated and unauthenticated access.
-        """
-        from .authentication import TelegramAuthentication
-        from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-
-        # Include Telegram authentication along with standard ones
-        authenticator_classes = [
-            TelegramAuthentication,
-            SessionAuthentication,
-            TokenAuthentication
-        ]
-
-        return [auth() for auth in authenticator_classes]
-
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
     def options(self, request, pk=None):
         """
         Доступные опции товара
         GET /api/v1/products/{id}/options/
         """
-        product = self.get_object()
-        # This would return the options available for this product
-        # For now, returning a placeholder
-        return Response({'product_id': product.id, 'options': []})
+        return product_options_response(pk)
+
+    @action(detail=False, methods=['get'], url_path='options', url_name='batch-options',
+            authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
+    def batch_options(self, request):
+        """
+        Опции нескольких товаров
+        GET /api/v1/products/options/?ids=1,2,3
+        """
+        try:
+            product_ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            return Response({'error': 'Некорректный список ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if not product_ids or len(product_ids) > MAX_BATCH_OPTIONS:
+            return Response(
+                {'error': f'Нужно от 1 до {MAX_BATCH_OPTIONS} id товаров'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        graphs = get_option_graphs(product_ids)
+        return Response({'results': [
+            {'product_id': product_id, 'options': graphs[product_id]}
+            for product_id in product_ids if product_id in graphs
+        ]})
 
     @action(detail=True, methods=['post'], url_path='upload-images')
     def upload_images(self, request, pk=None):
@@ -492,33 +691,27 @@ class ProductViewSet(viewsets.ModelViewSet):
         Загрузка изображений для товара
         POST /api/v1/products/{id}/upload-images/
         """
-        from django.core.files.storage import default_storage
-        import os
+        from catalog.images import image_processor, store_original
 
         product = self.get_object()
-
-        # Handle main image
         main_image = request.FILES.get('main_image')
-        if main_image:
-            # Save the main image
-            file_path = default_storage.save(f'products/{product.id}/main_{main_image.name}', main_image)
-            product.main_image_url = f'/media/{file_path}'
-            product.save()
-
-        # Handle additional images
-        additional_images = request.FILES.getlist('additional_images')
-        image_urls = []
-        for img in additional_images:
-            file_path = default_storage.save(f'products/{product.id}/{img.name}', img)
-            image_urls.append(f'/media/{file_path}')
-
-        # Update image_urls field if needed (this assumes it stores a list of URLs)
-        if image_urls:
-            current_urls = product.image_urls or []
-            # Combine existing URLs with new ones, avoiding duplicates
-            all_urls = list(set(current_urls + image_urls))
-            product.image_urls = all_urls
-            product.save()
+        image_urls = [store_original(img) for img in request.FILES.getlist('additional_images')]
+
+        with transaction.atomic():
+            # Handle main image
+            if main_image:
+                product.main_image_url = store_original(main_image)
+
+            # Handle additional images
+            if image_urls:
+                current_urls = product.image_urls or []
+                # Одинаковые файлы получают одинаковый URL, поэтому дубли отбрасываются
+                product.image_urls = current_urls + [url for url in dict.fromkeys(image_urls) if url not in current_urls]
+
+            # image_variants не перезаписываем: его пишет фоновая обработка
+            if main_image or image_urls:
+                product.save(update_fields=['main_image_url', 'image_urls', 'updated_at'])
+                image_processor.schedule(product.pk)
 
         return Response({
             'main_image_url': product.main_image_url,
@@ -533,13 +726,42 @@ class ProductViewSet(viewsets.ModelViewSet):
         GET /api/v1/products/search/
         Параметры:
         - q: поисковый запрос
-        - category: id категории
-        - tags: список тегов
+        - restaurant: id ресторана
+        - category: id категории (вместе с подкатегориями)
+        - tags: список тегов (id или slug через запятую)
         - min_price, max_price
-        - sort: price_asc, price_desc, popular, new
+        - sort: price_asc, price_desc, popular, new (по умолчанию - по релевантности)
         """
-        # Implementation would go here
-        return Response({'results': []})
+        products = search_products_from_request(request, optimize_queryset(Product.objects.all(), ProductSerializer))
+        page = self.paginate_queryset(products)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(products, many=True).data)
+
+    @action(detail=False, methods=['get'], authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
+    def suggest(self, request):
+        """
+        Подсказки для строки поиска (товары и категории, по популярности)
+        GET /api/v1/products/suggest/?restaurant={id}&q=бур
+        Параметры:
+        - limit: число подсказок (по умолчанию 10, максимум 20)
+        """
+        try:
+            restaurant_id = int(request.query_params['restaurant'])
+            limit = min(int(request.query_params.get('limit', 10)), 20)
+        except (KeyError, ValueError):
+            return Response({'error': 'Параметр restaurant обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'results': suggest_products(restaurant_id, request.query_params.get('q', ''), limit)})
+
+    @action(detail=False, methods=['get'], authentication_classes=STATELESS_AUTHENTICATION_CLASSES)
+    def facets(self, request):
+        """
+        Счетчики для фильтров списка товаров
+        GET /api/v1/products/facets/?restaurant={id}&is_vegan=true
+        Принимает те же фильтры и search, что и список.
+        """
+        return product_facets_response(self, request)
 
     def get_serializer_context(self):
         """Передаем request в контекст сериализатора для формирования полных URL"""
@@ -568,34 +790,55 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
         permission_classes = [AllowAny]
         return [permission() for permission in permission_classes]
 
-    def get_authenticators(self):
-        """
-        Returns the authenticator classes that this view uses.
-        Allows both authenticated and unauthenticated access.
-        """
-        from .authentication import TelegramAuthentication
-        from rest_framework.authentication import SessionAuthentication, TokenAuthentication
-
-        # Include Telegram authentication along with standard ones
-        authenticator_classes = [
-            TelegramAuthentication,
-            SessionAuthentication,
-            TokenAuthentication
-        ]
 
-        return [auth() for auth in authenticator_classes]
+def order_tracking(order):
+    """Статус заказа с оценкой времени по текущей загрузке филиала"""
+    eta = order_estimate(order)
+    return Response({
+        'order_id': order.id,
+        'status': order.status,
+        'estimated_preparation': eta.ready_at,
+        'estimated_delivery': eta.delivered_at,
+        'courier_info': {
+            'name': order.courier_name,
+            'phone': order.courier_phone
+        } if order.courier_name else None
+    })
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(AutoPrefetchMixin, viewsets.ModelViewSet):
     """
     Управление заказами
     """
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtKeysetPagination
 
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user)
 
+    def create(self, request, *args, **kwargs):
+        # Нехватка остатков - 409 с нетронутым списком (ValidationError привел бы значения к строкам)
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientStock as e:
+            return Response(
+                {'error': 'Недостаточно остатков', 'shortages': e.shortages}, status=status.HTTP_409_CONFLICT
+            )
+
+    def perform_create(self, serializer):
+        """Оформление из корзины: позиции, суммы и резервы в одной транзакции (orders.checkout)"""
+        try:
+            with transaction.atomic():
+                order = serializer.save(user=self.request.user, **ORDER_DEFAULTS)
+                place_order(order, self.request.user)
+        except EmptyCart as e:
+            raise ValidationError({'cart': str(e)})
+        except DeliveryUnavailable as e:
+            raise ValidationError({'delivery_address_id': str(e), 'reason': e.check.reason})
+        except SlotUnavailable as e:
+            raise ValidationError({'delivery_time_slot': str(e)})
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """
@@ -623,17 +866,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         Отслеживание заказа (для доставки)
         GET /api/v1/orders/{id}/track/
         """
-        order = self.get_object()
-        # Placeholder implementation
-        return Response({
-            'order_id': order.id,
-            'status': order.status,
-            'estimated_delivery': order.estimated_delivery_time,
-            'courier_info': {
-                'name': order.courier_name,
-                'phone': order.courier_phone
-            } if order.courier_name else None
-        })
+        return order_tracking(self.get_object())
 
 
 class UserAddressViewSet(viewsets.ModelViewSet):
@@ -648,7 +881,7 @@ class UserAddressViewSet(viewsets.ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         # Добавляем логирование для отладки
-        logger.warning(f"Creating address with data: {request.data}")
+        logger.debug(f"Creating address with data: {request.data}")
 
         # Проверяем наличие обязательных полей
         if not request.data.get('address'):
@@ -712,10 +945,13 @@ class CartView(APIView):
     Получение корзины
     GET /api/v1/cart/
     """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart, created = Cart.objects.get_or_create(user_id=request.user.id)
+        if not created:
+            prefetch_for_serializer([cart], CartSerializer)
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
@@ -783,10 +1019,13 @@ class UserOrdersView(APIView):
     История заказов пользователя
     GET /api/v1/profile/orders/
     """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        orders = Order.objects.filter(user=request.user).order_by('-created_at')
+        orders = optimize_queryset(
+            Order.objects.filter(user_id=request.user.id).order_by('-created_at'), OrderSerializer
+        )
         serializer = OrderSerializer(orders, many=True)
         return Response(serializer.data)
 
@@ -841,10 +1080,11 @@ class BonusTransactionsView(APIView):
     История бонусных операций
     GET /api/v1/bonus/transactions/
     """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        transactions = UserBonusTransaction.objects.filter(user=request.user).order_by('-created_at')
+        transactions = UserBonusTransaction.objects.filter(user_id=request.user.id).order_by('-created_at')
         serializer = UserBonusTransactionSerializer(transactions, many=True)
         return Response(serializer.data)
 
@@ -966,7 +1206,7 @@ class PaymentWebhookView(APIView):
         return Response({'status': 'received'})
 
 
-class RestaurantBranchesView(generics.ListAPIView):
+class RestaurantBranchesView(AutoPrefetchMixin, generics.ListAPIView):
     """
     Филиалы ресторана
     GET /api/v1/restaurants/{id}/branches/
@@ -989,42 +1229,23 @@ class RestaurantMenuView(APIView):
 
     def get(self, request, pk):
         restaurant = get_object_or_404(Restaurant, id=pk)
-        categories = Category.objects.filter(
-            restaurant=restaurant,
-            is_active=True,
-            is_visible=True
-        ).prefetch_related('products')
-
-        # Serialize the data
-        from rest_framework import serializers
-
-        class MenuItemSerializer(serializers.ModelSerializer):
-            class Meta:
-                model = Product
-                fields = ['id', 'name', 'price', 'description', 'main_image_url']
-
-        class MenuCategorySerializer(serializers.ModelSerializer):
-            products = MenuItemSerializer(many=True, read_only=True)
+        return menu_snapshot_response(restaurant, menu_layout(request, 'nested'), request)
 
-            class Meta:
-                model = Category
-                fields = ['id', 'name', 'description', 'products']
 
-        serializer = MenuCategorySerializer(categories, many=True)
-        return Response(serializer.data)
-
-
-class CategoryProductsView(generics.ListAPIView):
+class CategoryProductsView(SparseFieldsViewMixin, AutoPrefetchMixin, generics.ListAPIView):
     """
     Товары категории
     GET /api/v1/categories/{id}/products/
     """
     serializer_class = ProductSerializer
+    pagination_class = DisplayOrderKeysetPagination
 
     def get_queryset(self):
-        category_id = self.kwargs['pk']
+        category = Category.objects.filter(pk=self.kwargs['pk']).only('id', 'path').first()
+        if category is None:
+            return Product.objects.none()
         return Product.objects.filter(
-            category_id=category_id,
+            category_products_q(category, self.request),
             is_available=True
         )
 
@@ -1035,26 +1256,25 @@ class ProductOptionsView(APIView):
     GET /api/v1/products/{id}/options/
     """
 
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
+
     def get(self, request, pk):
-        # Implementation would go here
-        return Response({'product_id': pk, 'options': []})
+        return product_options_response(pk)
 
 
-class ProductSearchView(generics.ListAPIView):
+class ProductSearchView(AutoPrefetchMixin, generics.ListAPIView):
     """
     Поиск товаров
     GET /api/v1/products/search/
     """
     serializer_class = ProductSerializer
+    # Результат поиска - уже упорядоченный список, а не QuerySet
+    filter_backends = []
 
     def get_queryset(self):
-        query = self.request.query_params.get('q', '')
-        if query:
-            return Product.objects.filter(
-                name__icontains=query,
-                is_available=True
-            )
-        return Product.objects.none()
+        return search_products_from_request(
+            self.request, optimize_queryset(Product.objects.all(), ProductSerializer)
+        )
 
 
 class BranchAvailabilityView(APIView):
@@ -1064,15 +1284,9 @@ class BranchAvailabilityView(APIView):
     """
 
     def get(self, request, pk):
-        branch = get_object_or_404(RestaurantBranch, id=pk)
+        branch = get_object_or_404(RestaurantBranch.objects.select_related('restaurant'), id=pk)
         order_type = request.query_params.get('order_type', 'delivery')
-
-        return Response({
-            'is_open': branch.is_open_now(),
-            'can_accept_orders': branch.is_accepting_orders,
-            'order_type': order_type,
-            'preparation_time': f"{branch.preparation_time_min}-{branch.preparation_time_max} minutes"
-        })
+        return Response(branch_availability(branch, order_type))
 
 
 class BranchDeliveryZonesView(APIView):
@@ -1083,12 +1297,7 @@ class BranchDeliveryZonesView(APIView):
 
     def get(self, request, pk):
         branch = get_object_or_404(RestaurantBranch, id=pk)
-        return Response({
-            'branch_id': branch.id,
-            'delivery_radius_meters': branch.delivery_radius_meters,
-            'delivery_fee': float(branch.delivery_fee),
-            'free_delivery_threshold': float(branch.free_delivery_threshold) if branch.free_delivery_threshold else None
-        })
+        return branch_delivery_zones(branch, request)
 
 
 class BranchTimeSlotsView(APIView):
@@ -1098,15 +1307,8 @@ class BranchTimeSlotsView(APIView):
     """
 
     def get(self, request, pk):
-        # Placeholder implementation
-        return Response({
-            'slots': [
-                {'time': '10:00-11:00', 'available': True},
-                {'time': '11:00-12:00', 'available': True},
-                {'time': '12:00-13:00', 'available': False},
-                {'time': '13:00-14:00', 'available': True},
-            ]
-        })
+        branch = get_object_or_404(RestaurantBranch.objects.select_related('restaurant'), id=pk)
+        return branch_time_slots(branch, request)
 
 
 class CancelOrderView(APIView):
@@ -1128,10 +1330,11 @@ class OrderStatusView(APIView):
     Статус заказа
     GET /api/v1/orders/{id}/status/
     """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        order = get_object_or_404(Order, id=pk, user=request.user)
+        order = get_object_or_404(Order, id=pk, user_id=request.user.id)
         return Response({
             'status': order.status,
             'order_number': order.order_number,
@@ -1144,19 +1347,12 @@ class OrderTrackingView(APIView):
     Отслеживание заказа
     GET /api/v1/orders/{id}/track/
     """
+    authentication_classes = STATELESS_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        order = get_object_or_404(Order, id=pk, user=request.user)
-        return Response({
-            'order_id': order.id,
-            'status': order.status,
-            'estimated_delivery': order.estimated_delivery_time,
-            'courier_info': {
-                'name': order.courier_name,
-                'phone': order.courier_phone
-            } if order.courier_name else None
-        })
+        order = get_object_or_404(Order.objects.select_related('branch'), id=pk, user_id=request.user.id)
+        return order_tracking(order)
 
 
 class GeocodeAddressView(APIView):
@@ -1328,6 +1524,97 @@ class PopularProductsView(APIView):
         return Response({'products': products_data})
 
 
+class MetricsView(APIView):
+    """
+    Метрики запросов в текстовом формате Prometheus
+    GET /api/_metrics
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        from django.http import HttpResponse
+        from core.metrics import registry
+
+        return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class CatalogExportView(APIView):
+    """
+    Потоковый экспорт каталога
+    GET /api/v1/catalog/export/?file_format=jsonl|csv&type=product&restaurant={id}
+    (не format - его занимает DRF для выбора рендерера)
+    CSV - только для одного типа записей (type)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        from django.http import StreamingHttpResponse
+        from catalog.bulk import EXPORT_ORDER, export_csv, export_jsonl
+
+        file_format = request.query_params.get('file_format', 'jsonl')
+        record_type = request.query_params.get('type')
+        try:
+            restaurant_id = int(request.query_params['restaurant']) if request.query_params.get('restaurant') else None
+        except ValueError:
+            return Response({'error': 'Некорректный restaurant'}, status=status.HTTP_400_BAD_REQUEST)
+        if record_type is not None and record_type not in EXPORT_ORDER:
+            return Response({'error': f'type: одно из {", ".join(EXPORT_ORDER)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if file_format == 'csv':
+            if record_type is None:
+                return Response({'error': 'Для CSV нужен type'}, status=status.HTTP_400_BAD_REQUEST)
+            response = StreamingHttpResponse(export_csv(record_type, restaurant_id), content_type='text/csv; charset=utf-8')
+        elif file_format == 'jsonl':
+            types = (record_type,) if record_type else EXPORT_ORDER
+            response = StreamingHttpResponse(export_jsonl(restaurant_id, types), content_type='application/x-ndjson')
+        else:
+            return Response({'error': 'file_format: csv или jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response['Content-Disposition'] = f'attachment; filename="catalog-{record_type or "all"}.{file_format}"'
+        return response
+
+
+class CatalogImportView(APIView):
+    """
+    Массовый импорт каталога из файла
+    POST /api/v1/catalog/import/ (multipart: file, file_format, type, restaurant, dry_run)
+    Формат по умолчанию - по расширению файла; для CSV нужен type.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        import codecs
+        import os
+        from catalog.bulk import RECORD_TYPES, import_records, read_csv, read_jsonl
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Нужен файл (file)'}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('file_format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        record_type = request.data.get('type') or None
+        if file_format not in ('csv', 'jsonl'):
+            return Response({'error': 'file_format: csv или jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+        if record_type is not None and record_type not in RECORD_TYPES:
+            return Response({'error': f'type: одно из {", ".join(RECORD_TYPES)}'}, status=status.HTTP_400_BAD_REQUEST)
+        if file_format == 'csv' and record_type is None:
+            return Response({'error': 'Для CSV нужен type'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            restaurant_id = int(request.data['restaurant']) if request.data.get('restaurant') else None
+        except ValueError:
+            return Response({'error': 'Некорректный restaurant'}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+
+        # Файл читается построчно, большие загрузки Django держит на диске
+        lines = codecs.iterdecode(upload, 'utf-8-sig')
+        records = read_csv(lines, record_type) if file_format == 'csv' else read_jsonl(lines, record_type)
+        try:
+            result = import_records(records, restaurant_id, dry_run=dry_run)
+        except UnicodeDecodeError:
+            return Response({'error': 'Файл должен быть в UTF-8'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict())
+
+
 class AdminRestaurantViewSet(viewsets.ModelViewSet):
     """
     Управление ресторанами для администраторов
@@ -1392,6 +1679,7 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtKeysetPagination
 
     def get_permissions(self):
         """
@@ -0,0 +1,646 @@
+"""
+Массовый импорт и экспорт каталога в CSV и JSONL.
+
+Записи читаются потоком и обрабатываются пачками по CHUNK_SIZE записей
+одного типа: одна выборка существующих строк по естественному ключу,
+затем bulk_create для новых и bulk_update только для изменившихся полей,
+в транзакции на пачку (вместе с путями категорий и menu_version). Импорт не
+атомарен: пачки, записанные до ошибки, остаются. dry_run выполняет все
+пачки в одной транзакции и откатывает ее. Память не зависит от размера файла.
+
+Типы записей и естественные ключи (ресторан - id, из записи или по умолчанию):
+- category: (restaurant, slug); parent - slug родителя;
+  категория без slug обозначается '#<id>';
+- product: (restaurant, sku), без sku - по id; category - slug категории;
+- option: (restaurant, name);
+- option_value: (restaurant, option, value), option - название опции;
+- mapping: (restaurant, product, option), product - sku товара.
+
+В JSONL тип указывается полем "type", CSV содержит записи одного типа.
+Поля, которых нет в записи, не меняются. Импорт только добавляет и
+обновляет - строки, отсутствующие в файле, не удаляются. Записи
+обрабатываются по порядку, поэтому категории и опции должны идти раньше
+товаров и привязок (экспорт пишет их в таком порядке).
+
+bulk-операции не вызывают сигналы и save(), поэтому menu_version,
+sync_version, пути категорий и поисковый индекс обновляются здесь явно.
+"""
+import csv
+import json
+from contextlib import nullcontext
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Category, OptionValue, Product, ProductOption, ProductOptionMapping, SyncVersionedModel
+from .search import index_products, restaurant_products_q
+from .signals import bump_menu_version
+from .sync import next_sync_version, touch
+from .tree import rebuild_category_paths
+
+CHUNK_SIZE = 500
+MAX_ERRORS = 100
+EXPORT_CHUNK_SIZE = 2000
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'да'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'нет'}
+
+
+def _parse(model, name, raw):
+    """Значение поля модели из строки CSV или значения JSON; ValueError при ошибке"""
+    field = model._meta.get_field(name)
+    if raw is None or raw == '':
+        if field.null:
+            return None
+        if field.has_default():
+            return field.get_default()
+        if field.empty_strings_allowed:
+            return ''
+        raise ValueError(f'{name}: значение обязательно')
+
+    if isinstance(field, models.BooleanField) and isinstance(raw, str):
+        lowered = raw.strip().lower()
+        if lowered in TRUE_VALUES:
+            return True
+        if lowered in FALSE_VALUES:
+            return False
+        raise ValueError(f'{name}: ожидается да/нет, получено {raw!r}')
+    if isinstance(field, models.JSONField) and isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise ValueError(f'{name}: некорректный JSON')
+
+    try:
+        value = field.to_python(raw)
+    except ValidationError as e:
+        raise ValueError(f'{name}: {"; ".join(e.messages)}')
+    if isinstance(value, Decimal):
+        # Как хранится в базе - чтобы сравнение с текущим значением было точным
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+def _export_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class RecordType:
+    """Описание типа записи: модель, ключ, поля и ссылки на другие строки"""
+    name = ''
+    model = None
+    fields = ()
+    # Поля, без которых нельзя создать строку
+    required = ()
+
+    def restaurant_id(self, record, default):
+        value = record.get('restaurant') or default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError('restaurant: нужен id ресторана')
+
+    def key(self, record, restaurant_id):
+        raise NotImplementedError
+
+    def references(self, rows):
+        """Ссылки записей пачки на другие строки (одним запросом на тип ссылки)"""
+        return {}
+
+    def values(self, record, references, restaurant_id):
+        return {
+            name: _parse(self.model, name, record[name])
+            for name in self.fields if name in record
+        }
+
+    def existing(self, keys):
+        """{ключ: строка} для уже существующих ключей"""
+        raise NotImplementedError
+
+    def create_values(self, key, values):
+        return values
+
+    def export(self, restaurant_id):
+        """Записи для экспорта (словари), потоком"""
+        raise NotImplementedError
+
+
+def _by_restaurant(keys):
+    grouped = {}
+    for key in keys:
+        grouped.setdefault(key[0], []).append(key)
+    return grouped
+
+
+def _category_ref(slug, pk):
+    """Ссылка на категорию в файле: slug, а для категорий без slug - '#<id>'"""
+    if slug:
+        return slug
+    return f'#{pk}' if pk else ''
+
+
+class CategoryRecord(RecordType):
+    name = 'category'
+    model = Category
+    fields = ('name', 'description', 'image_url', 'icon_url', 'display_order', 'is_active', 'is_visible',
+              'seo_title', 'seo_description')
+    required = ('name',)
+
+    def key(self, record, restaurant_id):
+        if not record.get('slug'):
+            raise ValueError('slug: значение обязательно')
+        return restaurant_id, record['slug']
+
+    def references(self, rows):
+        parent_keys = {(restaurant_id, record['parent']) for restaurant_id, record in rows if record.get('parent')}
+        return {'parents': self.existing(parent_keys)}
+
+    def values(self, record, references, restaurant_id):
+        values = super().values(record, references, restaurant_id)
+        if 'parent' in record:
+            values['parent_id'] = None
+            if record['parent']:
+                parent = references['parents'].get((restaurant_id, record['parent']))
+                if parent is None:
+                    raise ValueError(f'parent: категория {record["parent"]!r} не найдена')
+                values['parent_id'] = parent.pk
+        return values
+
+    def existing(self, keys):
+        found = {}
+        for restaurant_id, restaurant_keys in _by_restaurant(keys).items():
+            refs = [ref for _, ref in restaurant_keys]
+            ids = [int(ref[1:]) for ref in refs if ref.startswith('#') and ref[1:].isdigit()]
+            categories = Category.objects.filter(restaurant_id=restaurant_id).filter(
+                Q(slug__in=refs) | Q(pk__in=ids)
+            ).order_by('pk')
+            for category in categories:
+                if category.slug:
+                    found.setdefault((restaurant_id, category.slug), category)
+                found[(restaurant_id, f'#{category.pk}')] = category
+        return found
+
+    def create_values(self, key, values):
+        if key[1].startswith('#'):
+            raise ValueError(f'slug: категория {key[1]} не найдена, для новой категории нужен slug')
+        return {**values, 'restaurant_id': key[0], 'slug': key[1]}
+
+    def export(self, restaurant_id):
+        categories = Category.objects.order_by('depth', 'path', 'pk')
+        if restaurant_id is not None:
+            categories = categories.filter(restaurant_id=restaurant_id)
+        rows = categories.values('id', 'restaurant_id', 'slug', 'parent_id', 'parent__slug', *self.fields)
+        for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield {
+                'restaurant': row.pop('restaurant_id'),
+                'slug': _category_ref(row.pop('slug'), row.pop('id')),
+                'parent': _category_ref(row.pop('parent__slug'), row.pop('parent_id')),
+                **row,
+            }
+
+
+class ProductRecord(RecordType):
+    name = 'product'
+    model = Product
+    fields = ('name', 'description', 'short_description', 'price', 'old_price', 'cost_price',
+              'is_available', 'stock_quantity', 'low_stock_threshold', 'is_unlimited_stock',
+              'weight_grams', 'volume_ml', 'calories', 'main_image_url', 'image_urls',
+              'is_popular', 'is_new', 'is_recommended', 'is_spicy', 'is_vegetarian', 'is_vegan',
+              'is_gluten_free', 'cooking_time_minutes', 'display_order')
+    required = ('name', 'price')
+
+    def key(self, record, restaurant_id):
+        if record.get('sku'):
+            return restaurant_id, 'sku', str(record['sku'])
+        if record.get('id'):
+            try:
+                return restaurant_id, 'id', int(record['id'])
+            except (TypeError, ValueError):
+                raise ValueError('id: ожидается число')
+        raise ValueError('sku: нужен sku или id товара')
+
+    def references(self, rows):
+        category_keys = {(restaurant_id, record['category']) for restaurant_id, record in rows if record.get('category')}
+        return {'categories': CategoryRecord().existing(category_keys)}
+
+    def values(self, record, references, restaurant_id):
+        values = super().values(record, references, restaurant_id)
+        if 'category' in record:
+            values['category_id'] = None
+            if record['category']:
+                category = references['categories'].get((restaurant_id, record['category']))
+                if category is None:
+                    raise ValueError(f'category: категория {record["category"]!r} не найдена')
+                values['category_id'] = category.pk
+        if record.get('sku'):
+            values['sku'] = str(record['sku'])
+        return values
+
+    def existing(self, keys):
+        found = {}
+        for restaurant_id, restaurant_keys in _by_restaurant(keys).items():
+            skus = [value for _, kind, value in restaurant_keys if kind == 'sku']
+            ids = [value for _, kind, value in restaurant_keys if kind == 'id']
+            products = Product.objects.filter(restaurant_products_q(restaurant_id)).filter(
+                Q(sku__in=skus) | Q(pk__in=ids)
+            ).order_by('pk')
+            for product in products:
+                if product.sku:
+                    found.setdefault((restaurant_id, 'sku', product.sku), product)
+                found.setdefault((restaurant_id, 'id', product.pk), product)
+        return found
+
+    def create_values(self, key, values):
+        return {'description': '', **values, 'restaurant_id': key[0]}
+
+    def export(self, restaurant_id):
+        products = Product.objects.order_by('pk')
+        if restaurant_id is not None:
+            products = products.filter(restaurant_products_q(restaurant_id))
+        else:
+            # Товары без ресторана и категории не попадают ни в одно меню и не импортируются обратно
+            products = products.exclude(restaurant__isnull=True, category__restaurant__isnull=True)
+        rows = products.values(
+            'id', 'sku', 'restaurant_id', 'category_id', 'category__restaurant_id', 'category__slug', *self.fields
+        )
+        for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            restaurant = row.pop('restaurant_id')
+            category_restaurant = row.pop('category__restaurant_id')
+            yield {
+                'restaurant': restaurant if restaurant is not None else category_restaurant,
+                'sku': row.pop('sku'),
+                'id': row.pop('id'),
+                'category': _category_ref(row.pop('category__slug'), row.pop('category_id')),
+                **{name: _export_value(value) for name, value in row.items()},
+            }
+
+
+class OptionRecord(RecordType):
+    name = 'option'
+    model = ProductOption
+    fields = ('description', 'option_type', 'is_required', 'min_selection', 'max_selection', 'default_value',
+              'display_order', 'help_text', 'is_active')
+
+    def key(self, record, restaurant_id):
+        if not record.get('name'):
+            raise ValueError('name: значение обязательно')
+        return restaurant_id, record['name']
+
+    def existing(self, keys):
+        found = {}
+        for restaurant_id, restaurant_keys in _by_restaurant(keys).items():
+            options = ProductOption.objects.filter(
+                restaurant_id=restaurant_id, name__in=[name for _, name in restaurant_keys]
+            ).order_by('pk')
+            for option in options:
+                found.setdefault((restaurant_id, option.name), option)
+        return found
+
+    def create_values(self, key, values):
+        return {**values, 'restaurant_id': key[0], 'name': key[1]}
+
+    def export(self, restaurant_id):
+        options = ProductOption.objects.order_by('pk')
+        if restaurant_id is not None:
+            options = options.filter(restaurant_id=restaurant_id)
+        rows = options.values('restaurant_id', 'name', *self.fields)
+        for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield {'restaurant': row.pop('restaurant_id'), **row}
+
+
+class OptionValueRecord(RecordType):
+    name = 'option_value'
+    model = OptionValue
+    fields = ('description', 'price_modifier', 'cost_modifier', 'is_available', 'stock_quantity',
+              'display_order', 'is_default', 'color', 'icon_url')
+
+    def key(self, record, restaurant_id):
+        if not record.get('option') or not record.get('value'):
+            raise ValueError('option, value: значения обязательны')
+        return restaurant_id, record['option'], record['value']
+
+    def existing(self, keys):
+        options = OptionRecord().existing({(restaurant_id, option) for restaurant_id, option, _ in keys})
+        option_keys = {option.pk: key for key, option in options.items()}
+        found = {}
+        values = OptionValue.objects.filter(
+            option_id__in=list(option_keys), value__in=[value for _, _, value in keys]
+        ).order_by('pk')
+        for option_value in values:
+            restaurant_id, option_name = option_keys[option_value.option_id]
+            found.setdefault((restaurant_id, option_name, option_value.value), option_value)
+        # Опции - для создания новых значений
+        self.options = options
+        return found
+
+    def create_values(self, key, values):
+        option = self.options.get(key[:2])
+        if option is None:
+            raise ValueError(f'option: опция {key[1]!r} не найдена')
+        return {**values, 'option_id': option.pk, 'value': key[2]}
+
+    def export(self, restaurant_id):
+        values = OptionValue.objects.order_by('option_id', 'pk')
+        if restaurant_id is not None:
+            values = values.filter(option__restaurant_id=restaurant_id)
+        rows = values.values('option__restaurant_id', 'option__name', 'value', *self.fields)
+        for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield {
+                'restaurant': row.pop('option__restaurant_id'),
+                'option': row.pop('option__name'),
+                **{name: _export_value(value) for name, value in row.items()},
+            }
+
+
+class MappingRecord(RecordType):
+    name = 'mapping'
+    model = ProductOptionMapping
+
+    def key(self, record, restaurant_id):
+        if not record.get('product') or not record.get('option'):
+            raise ValueError('product, option: значения обязательны')
+        return restaurant_id, str(record['product']), record['option']
+
+    def existing(self, keys):
+        self.products = ProductRecord().existing({(restaurant_id, 'sku', sku) for restaurant_id, sku, _ in keys})
+        self.options = OptionRecord().existing({(restaurant_id, option) for restaurant_id, _, option in keys})
+        product_keys = {product.pk: key for key, product in self.products.items() if key[1] == 'sku'}
+        option_keys = {option.pk: key for key, option in self.options.items()}
+
+        found = {}
+        mappings = ProductOptionMapping.objects.filter(
+            product_id__in=list(product_keys), option_id__in=list(option_keys)
+        )
+        for mapping in mappings:
+            restaurant_id, _, sku = product_keys[mapping.product_id]
+            found[(restaurant_id, sku, option_keys[mapping.option_id][1])] = mapping
+        return found
+
+    def create_values(self, key, values):
+        restaurant_id, sku, option_name = key
+        product = self.products.get((restaurant_id, 'sku', sku))
+        option = self.options.get((restaurant_id, option_name))
+        if product is None:
+            raise ValueError(f'product: товар со sku {sku!r} не найден')
+        if option is None:
+            raise ValueError(f'option: опция {option_name!r} не найдена')
+        return {'product_id': product.pk, 'option_id': option.pk}
+
+    def export(self, restaurant_id):
+        mappings = ProductOptionMapping.objects.exclude(product__sku='').order_by('pk')
+        if restaurant_id is not None:
+            mappings = mappings.filter(option__restaurant_id=restaurant_id)
+        rows = mappings.values_list('option__restaurant_id', 'product__sku', 'option__name')
+        for restaurant, sku, option in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield {'restaurant': restaurant, 'product': sku, 'option': option}
+
+
+RECORD_TYPES = {
+    record_type.name: record_type
+    for record_type in (CategoryRecord, ProductRecord, OptionRecord, OptionValueRecord, MappingRecord)
+}
+# Порядок экспорта: сначала то, на что ссылаются
+EXPORT_ORDER = ('category', 'option', 'option_value', 'product', 'mapping')
+
+
+class ImportResult:
+    def __init__(self):
+        self.counts = {name: {'created': 0, 'updated': 0, 'unchanged': 0} for name in RECORD_TYPES}
+        self.errors = []
+        self.error_count = 0
+        # Состояние текущей пачки (см. _commit_chunk)
+        self.restaurant_ids = set()
+        self.categories_moved = False
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'error': str(message)})
+
+    def as_dict(self):
+        return {'counts': self.counts, 'error_count': self.error_count, 'errors': self.errors}
+
+
+def _creates_cycle(parent_links, category_id, parent_id):
+    """Попадет ли категория в собственное поддерево; parent_links - {id: parent_id}"""
+    seen = set()
+    while parent_id is not None and parent_id not in seen:
+        if parent_id == category_id:
+            return True
+        seen.add(parent_id)
+        parent_id = parent_links.get(parent_id)
+    return False
+
+
+def _import_chunk(record_type, chunk, default_restaurant_id, result):
+    """chunk - [(номер строки, запись)] одного типа"""
+    parsed = []
+    for line, record in chunk:
+        try:
+            restaurant_id = record_type.restaurant_id(record, default_restaurant_id)
+            parsed.append((line, record, restaurant_id, record_type.key(record, restaurant_id)))
+        except ValueError as e:
+            result.error(line, e)
+
+    references = record_type.references([(restaurant_id, record) for _, record, restaurant_id, _ in parsed])
+    rows = {}
+    for line, record, restaurant_id, key in parsed:
+        try:
+            # Повтор ключа в пачке - побеждает последняя запись
+            rows[key] = (line, record_type.values(record, references, restaurant_id))
+        except ValueError as e:
+            result.error(line, e)
+
+    existing = record_type.existing(list(rows))
+    has_updated_at = any(field.name == 'updated_at' for field in record_type.model._meta.concrete_fields)
+    now = timezone.now()
+    to_create, to_update, update_fields = [], [], set()
+    counts = result.counts[record_type.name]
+
+    # Пути категорий пересчитываются только в конце импорта, поэтому цикл ищем по parent_id
+    parent_links = None
+    if record_type.name == 'category' and any('parent_id' in values for _, values in rows.values()):
+        parent_links = dict(
+            Category.objects.filter(restaurant_id__in={key[0] for key in rows}).values_list('pk', 'parent_id')
+        )
+
+    for key, (line, values) in rows.items():
+        instance = existing.get(key)
+        if instance is None:
+            missing = [name for name in record_type.required if values.get(name) in (None, '')]
+            if missing:
+                result.error(line, f'{", ".join(missing)}: значение обязательно для новой записи')
+                continue
+            try:
+                to_create.append(record_type.model(**record_type.create_values(key, values)))
+            except ValueError as e:
+                result.error(line, e)
+            continue
+
+        if parent_links is not None and 'parent_id' in values:
+            if _creates_cycle(parent_links, instance.pk, values['parent_id']):
+                result.error(line, 'parent: цикл в дереве категорий')
+                continue
+            # Следующие строки пачки видят уже принятый перенос
+            parent_links[instance.pk] = values['parent_id']
+        changed = {name: value for name, value in values.items() if getattr(instance, name) != value}
+        if not changed:
+            counts['unchanged'] += 1
+            continue
+        for name, value in changed.items():
+            setattr(instance, name, value)
+        if has_updated_at:
+            instance.updated_at = now
+        to_update.append(instance)
+        update_fields.update(changed)
+        if 'parent_id' in changed:
+            result.categories_moved = True
+
+    has_sync_version = issubclass(record_type.model, SyncVersionedModel)
+    with transaction.atomic():
+        if has_sync_version and (to_create or to_update):
+            sync_version = next_sync_version()
+            for instance in [*to_create, *to_update]:
+                instance.sync_version = sync_version
+        created = record_type.model.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+        if to_update:
+            fields = sorted(
+                update_fields
+                | ({'updated_at'} if has_updated_at else set())
+                | ({'sync_version'} if has_sync_version else set())
+            )
+            record_type.model.objects.bulk_update(to_update, fields, batch_size=CHUNK_SIZE)
+        if record_type.name == 'mapping' and (created or to_update):
+            # Опции товара отдаются при синхронизации в его данных
+            touch(Product.objects.filter(pk__in={mapping.product_id for mapping in [*created, *to_update]}))
+
+    counts['created'] += len(created)
+    counts['updated'] += len(to_update)
+    result.restaurant_ids.update(key[0] for key in rows)
+    _after_chunk(record_type, created, to_update, update_fields, result)
+
+
+def _after_chunk(record_type, created, updated, update_fields, result):
+    if record_type.name == 'category':
+        if created:
+            result.categories_moved = True
+        # Название категории входит в поисковый документ товаров
+        if 'name' in update_fields:
+            index_products(
+                Product.objects.filter(category_id__in=[category.pk for category in updated]).values_list('pk', flat=True)
+            )
+    elif record_type.name == 'product':
+        products = [*created, *updated]
+        index_products([product.pk for product in products])
+        if created or {'main_image_url', 'image_urls'} & update_fields:
+            from .images import image_processor
+            for product in products:
+                if product.main_image_url or product.image_urls:
+                    image_processor.schedule(product.pk)
+
+
+def read_jsonl(lines, record_type=None):
+    """(номер строки, запись) из строк JSONL; тип - поле "type" или record_type"""
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, {'type': None, '_error': 'некорректный JSON'}
+            continue
+        if not isinstance(record, dict):
+            yield line_number, {'type': None, '_error': 'запись должна быть объектом'}
+            continue
+        record.setdefault('type', record_type)
+        yield line_number, record
+
+
+def read_csv(lines, record_type):
+    """(номер строки, запись) из строк CSV с заголовком; все записи - типа record_type"""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        record['type'] = record_type
+        yield reader.line_num, record
+
+
+def _commit_chunk(record_type, chunk, default_restaurant_id, result):
+    """Пачка в своей транзакции; пути категорий и menu_version - в ней же"""
+    result.restaurant_ids, result.categories_moved = set(), False
+    with transaction.atomic():
+        _import_chunk(record_type, chunk, default_restaurant_id, result)
+        if result.categories_moved:
+            rebuild_category_paths()
+        bump_menu_version(*result.restaurant_ids)
+
+
+def import_records(records, default_restaurant_id=None, dry_run=False):
+    """
+    Импортирует записи (итератор (номер строки, запись)), коммитя каждую пачку.
+    dry_run - все проверить и посчитать, но откатить изменения.
+    """
+    result = ImportResult()
+
+    with transaction.atomic() if dry_run else nullcontext():
+        chunk, chunk_type, chunk_slugs = [], None, set()
+        for line, record in records:
+            record_type = record.get('type')
+            if record.get('_error') or record_type not in RECORD_TYPES:
+                result.error(line, record.get('_error') or f'type: неизвестный тип записи {record_type!r}')
+                continue
+            # Родитель категории из этой же пачки должен быть записан раньше нее
+            if chunk and (
+                record_type != chunk_type or len(chunk) >= CHUNK_SIZE
+                or (record_type == 'category' and record.get('parent') in chunk_slugs)
+            ):
+                _commit_chunk(RECORD_TYPES[chunk_type](), chunk, default_restaurant_id, result)
+                chunk, chunk_slugs = [], set()
+            chunk_type = record_type
+            chunk.append((line, record))
+            if record_type == 'category':
+                chunk_slugs.add(record.get('slug'))
+        if chunk:
+            _commit_chunk(RECORD_TYPES[chunk_type](), chunk, default_restaurant_id, result)
+
+        if dry_run:
+            transaction.set_rollback(True)
+
+    return result
+
+
+def export_records(restaurant_id=None, types=EXPORT_ORDER):
+    """(тип, запись) для экспорта, в порядке зависимостей"""
+    for name in EXPORT_ORDER:
+        if name in types:
+            for record in RECORD_TYPES[name]().export(restaurant_id):
+                yield name, record
+
+
+def export_jsonl(restaurant_id=None, types=EXPORT_ORDER):
+    """Строки JSONL для экспорта"""
+    for name, record in export_records(restaurant_id, types):
+        yield json.dumps({'type': name, **record}, ensure_ascii=False, default=str) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_csv(record_type, restaurant_id=None):
+    """Строки CSV (с заголовком) для одного типа записей"""
+    writer = None
+    for _, record in export_records(restaurant_id, (record_type,)):
+        if writer is None:
+            writer = csv.DictWriter(_Echo(), fieldnames=list(record))
+            yield writer.writeheader()
+        yield writer.writerow({
+            name: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+            for name, value in record.items()
+        })
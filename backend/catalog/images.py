@@ -0,0 +1,203 @@
+"""
+Изображения товаров.
+
+Загруженный файл сохраняется сразу под именем из хэша содержимого
+(products/originals/<sha256>.<ext>), поэтому повторная загрузка того же
+файла не создает копию, а имя никогда не меняет содержимое - такие файлы
+можно отдавать с Cache-Control: immutable.
+
+Уменьшенные варианты (IMAGE_VARIANT_WIDTHS, WebP и JPEG) строятся в фоне
+пулом потоков после коммита транзакции и записываются в
+Product.image_variants: {url оригинала: {формат: [{'url', 'width'}]}}.
+Пока вариантов нет, клиенты используют оригинал.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 1280)))
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+WORKERS = getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2)
+# False - варианты строятся синхронно (тесты, management-команды)
+ASYNC = getattr(settings, 'IMAGE_PROCESSING_ASYNC', True)
+
+ORIGINALS_DIR = 'products/originals'
+VARIANTS_DIR = 'products/variants'
+
+
+def _media_url(name):
+    return f'{settings.MEDIA_URL.rstrip("/")}/{name}'
+
+
+def _storage_name(url):
+    """Имя файла в хранилище по URL из базы или None для внешних ссылок"""
+    prefix = settings.MEDIA_URL.rstrip('/') + '/'
+    if url and url.startswith(prefix):
+        return url[len(prefix):]
+    return None
+
+
+def store_original(image_file):
+    """Сохраняет загруженный файл под именем из хэша содержимого, возвращает URL"""
+    image_file.seek(0)
+    content = image_file.read()
+    digest = hashlib.sha256(content).hexdigest()
+    ext = os.path.splitext(image_file.name or '')[1].lower() or '.jpg'
+    name = f'{ORIGINALS_DIR}/{digest}{ext}'
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+    return _media_url(name)
+
+
+def build_variants(url):
+    """
+    Строит варианты изображения (уже существующие файлы не пересоздаются).
+    Возвращает {формат: [{'url', 'width'}]} или None, если файл не читается.
+    """
+    name = _storage_name(url)
+    if name is None or not default_storage.exists(name):
+        return None
+
+    try:
+        with default_storage.open(name, 'rb') as source:
+            content = source.read()
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Не удалось прочитать изображение {name}: {str(e)}")
+        return None
+
+    # Имена вариантов - тоже из хэша, в том числе для файлов, загруженных до хэш-имен
+    digest = hashlib.sha256(content).hexdigest()
+    # Не увеличиваем: ширины больше оригинала заменяются самим оригиналом
+    widths = sorted({min(width, image.width) for width in VARIANT_WIDTHS})
+    variants = {}
+    for format_name, (pil_format, options) in VARIANT_FORMATS.items():
+        variants[format_name] = []
+        for width in widths:
+            variant_name = f'{VARIANTS_DIR}/{digest}_{width}.{format_name}'
+            if not default_storage.exists(variant_name):
+                default_storage.save(variant_name, ContentFile(_encode(image, width, pil_format, options)))
+            variants[format_name].append({'url': _media_url(variant_name), 'width': width})
+    return variants
+
+
+def _encode(image, width, pil_format, options):
+    resized = image
+    if width < image.width:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+    if pil_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+        resized = resized.convert('RGB')
+    elif resized.mode not in ('RGB', 'RGBA', 'L'):
+        resized = resized.convert('RGBA')
+
+    buffer = io.BytesIO()
+    resized.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def process_product_images(product_id):
+    """Строит недостающие варианты для текущих изображений товара"""
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).only('main_image_url', 'image_urls', 'image_variants').first()
+    if product is None:
+        return
+
+    urls = [url for url in [product.main_image_url, *(product.image_urls or [])] if url]
+    built = {}
+    for url in urls:
+        if url not in (product.image_variants or {}):
+            variants = build_variants(url)
+            if variants is not None:
+                built[url] = variants
+    if not built:
+        return
+
+    with transaction.atomic():
+        # Изображения могли смениться, пока строились варианты
+        product = Product.objects.select_for_update().filter(pk=product_id).first()
+        if product is None:
+            return
+        current = {url for url in [product.main_image_url, *(product.image_urls or [])] if url}
+        image_variants = {url: variants for url, variants in (product.image_variants or {}).items() if url in current}
+        image_variants.update({url: variants for url, variants in built.items() if url in current})
+        if image_variants != product.image_variants:
+            product.image_variants = image_variants
+            product.save(update_fields=['image_variants'])
+
+
+class ImageProcessor:
+    """
+    Фоновый пул потоков для обработки изображений. Пул создается лениво в
+    процессе, который ставит задачи (каждый воркер gunicorn держит свой).
+    """
+
+    def __init__(self, workers=2, enabled=True):
+        self.workers = workers
+        self.enabled = enabled
+        self._executor = None
+        self._executor_pid = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, product_id):
+        """Ставит обработку изображений товара после коммита текущей транзакции"""
+        transaction.on_commit(lambda: self._submit(product_id))
+
+    def _submit(self, product_id):
+        if not self.enabled:
+            process_product_images(product_id)
+            return
+        # Несколько загрузок одного товара подряд - одна задача
+        with self._lock:
+            if product_id in self._pending:
+                return
+            self._pending.add(product_id)
+        self._get_executor().submit(self._run, product_id)
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='product-images')
+                    self._executor_pid = pid
+        return self._executor
+
+    def _run(self, product_id):
+        with self._lock:
+            self._pending.discard(product_id)
+        close_old_connections()
+        try:
+            process_product_images(product_id)
+        except Exception:
+            logger.exception(f"Ошибка обработки изображений товара {product_id}")
+        finally:
+            close_old_connections()
+
+
+image_processor = ImageProcessor(workers=WORKERS, enabled=ASYNC)
+
+
+def srcset(variants, format_name, build_url=None):
+    """Строка srcset для формата: 'url 320w, url 640w'"""
+    entries = (variants or {}).get(format_name) or []
+    return ', '.join(
+        f"{build_url(entry['url']) if build_url else entry['url']} {entry['width']}w" for entry in entries
+    ) or None
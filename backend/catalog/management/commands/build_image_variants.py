@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from catalog.images import process_product_images
+from catalog.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные варианты изображений товаров, у которых их еще нет'
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.filter(Q(main_image_url__gt='') | ~Q(image_urls=[])).values_list('pk', flat=True)
+
+        count = 0
+        for product_id in product_ids.iterator():
+            process_product_images(product_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано товаров: {count}'))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.bulk import EXPORT_ORDER, export_csv, export_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Экспортирует каталог в CSV или JSONL (см. catalog.bulk)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='файл; по умолчанию - stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='jsonl')
+        parser.add_argument('--type', choices=EXPORT_ORDER, help='тип записей (обязателен для CSV)')
+        parser.add_argument('--restaurant', type=int)
+
+    def handle(self, *args, **options):
+        if options['format'] == 'csv':
+            if not options['type']:
+                raise CommandError('Для CSV нужен --type')
+            lines = export_csv(options['type'], options['restaurant'])
+        else:
+            types = (options['type'],) if options['type'] else EXPORT_ORDER
+            lines = export_jsonl(options['restaurant'], types)
+
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,37 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.bulk import RECORD_TYPES, import_records, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Импортирует каталог из CSV или JSONL (см. catalog.bulk)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию - по расширению файла')
+        parser.add_argument('--type', choices=sorted(RECORD_TYPES), help='тип записей (обязателен для CSV)')
+        parser.add_argument('--restaurant', type=int, help='ресторан для записей без поля restaurant')
+        parser.add_argument('--dry-run', action='store_true', help='проверить без сохранения')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Укажите --format csv или jsonl')
+        if file_format == 'csv' and not options['type']:
+            raise CommandError('Для CSV нужен --type')
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+            if file_format == 'csv':
+                records = read_csv(lines, options['type'])
+            else:
+                records = read_jsonl(lines, options['type'])
+            result = import_records(records, options['restaurant'], dry_run=options['dry_run'])
+
+        self.stdout.write(json.dumps(result.as_dict(), ensure_ascii=False, indent=2))
+        if result.error_count:
+            self.stderr.write(self.style.WARNING(f'Ошибок: {result.error_count}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Импорт завершен' + (' (dry run)' if options['dry_run'] else '')))
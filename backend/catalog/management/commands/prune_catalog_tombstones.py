@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from catalog.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые записи об удалениях каталога (клиенты с более старым токеном получат меню целиком)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='сколько дней хранить записи (по умолчанию 30)')
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей: {deleted}'))
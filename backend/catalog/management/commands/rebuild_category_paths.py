@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.tree import rebuild_category_paths
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает материализованные пути (path, depth) категорий'
+
+    def handle(self, *args, **options):
+        updated = rebuild_category_paths()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено категорий: {updated}'))
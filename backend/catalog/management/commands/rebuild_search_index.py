@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.search import create_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Создает (если нужно) и перестраивает поисковый индекс товаров'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {count}'))
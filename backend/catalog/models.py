@@ -1,11 +1,32 @@
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from restaurants.models import Restaurant, RestaurantBranch
 
 
-class Category(models.Model):
+class SyncVersionedModel(models.Model):
+    """
+    Строка каталога, которую клиенты получают дельтой (catalog.sync):
+    при каждом сохранении получает новую sync_version в той же транзакции.
+    """
+    sync_version = models.BigIntegerField(default=0, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        from .sync import next_sync_version
+
+        with transaction.atomic():
+            self.sync_version = next_sync_version()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'sync_version'}
+            super().save(*args, **kwargs)
+
+
+class Category(SyncVersionedModel):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='categories', db_index=True, null=True, blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children', db_index=True)
     name = models.CharField(max_length=255)
@@ -24,6 +45,11 @@ class Category(models.Model):
     seo_description = models.TextField(blank=True)
     seo_keywords = models.JSONField(default=list, blank=True)  # List of keywords
 
+    # Материализованный путь от корня: '/<id корня>/.../<id>/', и глубина (0 у корня).
+    # Заполняются в save(); поддерево - диапазон по path (см. catalog.tree.subtree_q)
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
     # Metadata
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
@@ -34,6 +60,7 @@ class Category(models.Model):
         verbose_name_plural = _('categories')
         indexes = [
             models.Index(fields=['restaurant', 'is_active']),
+            models.Index(fields=['restaurant', 'sync_version']),
             models.Index(fields=['parent']),
             models.Index(fields=['display_order']),
         ]
@@ -42,10 +69,61 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    CYCLE_ERROR = 'Категорию нельзя вложить в нее саму или в ее подкатегорию'
+
+    def clean(self):
+        if self.pk and self.pk in self._parent_chain():
+            raise ValidationError({'parent': self.CYCLE_ERROR})
+
     def save(self, *args, **kwargs):
         # Update updated_at timestamp
         self.updated_at = timezone.now()
+        chain = self._parent_chain()
+        if self.pk and self.pk in chain:
+            raise ValidationError({'parent': self.CYCLE_ERROR})
         super().save(*args, **kwargs)
+        self._update_path('/' + ''.join(f'{pk}/' for pk in chain))
+
+    def _parent_chain(self):
+        """
+        id предков от корня до родителя: по path родителя, а у данных без path
+        (созданных до его появления) - подъемом по parent_id. Полный пересчет
+        путей - команда rebuild_category_paths.
+        """
+        if not self.parent_id:
+            return []
+
+        parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first()
+        if parent_path:
+            return [int(part) for part in parent_path.strip('/').split('/')]
+
+        chain = []
+        parent_id = self.parent_id
+        # Старые данные могут быть зациклены - останавливаемся на повторе
+        while parent_id is not None and parent_id not in chain:
+            chain.append(parent_id)
+            parent_id = Category.objects.filter(pk=parent_id).values_list('parent_id', flat=True).first()
+        return chain[::-1]
+
+    def _update_path(self, parent_path):
+        from .tree import move_subtree
+
+        path = f'{parent_path}{self.pk}/'
+        depth = parent_path.count('/') - 1
+        if path == self.path and depth == self.depth:
+            return
+
+        if self.path:
+            # Категорию перенесли - переписываем пути всего поддерева одним UPDATE
+            move_subtree(self.path, path, depth - self.depth)
+        else:
+            Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        self.path, self.depth = path, depth
+
+    @property
+    def ancestor_ids(self):
+        """id предков от корня, без самой категории"""
+        return [int(part) for part in self.path.strip('/').split('/')[:-1]]
 
     @property
     def has_children(self):
@@ -87,11 +165,14 @@ class Tag(models.Model):
         super().save(*args, **kwargs)
 
 
-class Product(models.Model):
+class Product(SyncVersionedModel):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='products', db_index=True, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products', db_index=True)
+    tags = models.ManyToManyField(Tag, blank=True, related_name='products')
 
     name = models.CharField(max_length=255)
+    # Артикул - естественный ключ товара в ресторане для импорта (catalog.bulk)
+    sku = models.CharField(max_length=100, blank=True, default='', db_index=True)
     description = models.TextField()
     short_description = models.TextField(blank=True)
 
@@ -117,6 +198,7 @@ class Product(models.Model):
     # Media
     main_image_url = models.CharField(max_length=500, null=True, blank=True)  # Changed from URLField to CharField to support relative paths
     image_urls = models.JSONField(default=list, blank=True)  # List of image URLs
+    image_variants = models.JSONField(default=dict, blank=True)  # {url оригинала: {формат: [{url, width}]}}, см. catalog.images
     video_url = models.URLField(null=True, blank=True)
 
     # Flags
@@ -151,8 +233,9 @@ class Product(models.Model):
         verbose_name_plural = _('products')
         indexes = [
             models.Index(fields=['restaurant', 'is_available']),
+            models.Index(fields=['category', 'sync_version']),
             models.Index(fields=['category']),
-            models.Index(fields=['display_order']),
+            models.Index(fields=['display_order', 'id']),
             models.Index(fields=['is_popular']),
             models.Index(fields=['is_new']),
             models.Index(fields=['is_vegetarian', 'is_vegan', 'is_gluten_free']),
@@ -191,7 +274,7 @@ class Product(models.Model):
         return 0
 
 
-class ProductOption(models.Model):
+class ProductOption(SyncVersionedModel):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='product_options', db_index=True, null=True, blank=True)
 
     name = models.CharField(max_length=255)
@@ -227,6 +310,7 @@ class ProductOption(models.Model):
         verbose_name_plural = _('product options')
         indexes = [
             models.Index(fields=['restaurant', 'is_active']),
+            models.Index(fields=['restaurant', 'sync_version']),
             models.Index(fields=['display_order']),
         ]
         ordering = ['display_order']
@@ -240,7 +324,7 @@ class ProductOption(models.Model):
         super().save(*args, **kwargs)
 
 
-class OptionValue(models.Model):
+class OptionValue(SyncVersionedModel):
     option = models.ForeignKey(ProductOption, on_delete=models.CASCADE, related_name='values', db_index=True)
 
     value = models.TextField()
@@ -302,4 +386,43 @@ class ProductOptionMapping(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.product.name} - {self.option.name}"
\ No newline at end of file
+        return f"{self.product.name} - {self.option.name}"
+
+class CatalogSyncState(models.Model):
+    """
+    Глобальный счетчик версий каталога для дельта-синхронизации (одна строка).
+    pruned_version - до какой версии удалены старые CatalogTombstone: клиенту
+    с более старым токеном нужна полная синхронизация.
+    """
+    version = models.BigIntegerField(default=0)
+    pruned_version = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'catalog_sync_state'
+
+
+class CatalogTombstone(models.Model):
+    """Запись об удаленной строке каталога для дельта-синхронизации"""
+    KIND_CHOICES = [
+        ('category', 'Category'),
+        ('product', 'Product'),
+        ('option', 'Product option'),
+        ('option_value', 'Option value'),
+    ]
+
+    # Без ресторана - общая опция (или ее значение), удаление отдается всем ресторанам
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='catalog_tombstones', null=True, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    sync_version = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'catalog_tombstones'
+        indexes = [
+            models.Index(fields=['restaurant', 'sync_version']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} @ {self.sync_version}"
@@ -0,0 +1,330 @@
+"""
+Полнотекстовый поиск товаров.
+
+Индекс хранится в отдельной таблице product_search. Она создается и
+заполняется после migrate и командой rebuild_search_index, не в запросах;
+пока таблицы нет, работает только нечеткий поиск:
+- SQLite: виртуальная таблица FTS5, в нее пишутся основы слов (catalog.text.stem);
+- PostgreSQL: tsvector с GIN-индексом и русским словарем самой СУБД.
+
+Название весит больше категории, категория - больше описания. Если точных
+совпадений мало, добавляются товары с похожим по триграммам названием
+(опечатки), они ранжируются ниже точных.
+"""
+import logging
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.db.models import Count, Q
+
+from core.cache import TTLCache
+from restaurants.models import Restaurant
+from .models import Category, Product
+from .text import similarity, stem, tokenize, trigrams
+from .tree import subtree_q
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'product_search'
+MAX_MATCHES = 500
+FUZZY_FALLBACK_THRESHOLD = 5
+FUZZY_MIN_SIMILARITY = 0.35
+
+SORT_ORDERINGS = {
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', 'id'),
+    'new': ('-created_at', 'id'),
+    'popular': ('-order_count', '-is_popular', 'id'),
+}
+
+
+class SqliteSearchBackend:
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "name, category, body, restaurant_id UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def delete(self, cursor, product_ids):
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, restaurant_id, name, category, body) VALUES (%s, %s, %s, %s, %s)',
+            [
+                (pk, restaurant_id, _stemmed(name), _stemmed(category), _stemmed(body))
+                for pk, restaurant_id, name, category, body in documents
+            ]
+        )
+
+    def match(self, cursor, tokens, restaurant_id, limit):
+        # Основы - префиксы словоформ, поэтому ищем по префиксу
+        expression = ' AND '.join(f'"{stem(token)}"*' for token in tokens)
+        sql = f'SELECT rowid, -bm25({SEARCH_TABLE}, 10.0, 4.0, 1.0) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s'
+        params = [expression]
+        if restaurant_id is not None:
+            sql += ' AND restaurant_id = %s'
+            params.append(restaurant_id)
+        cursor.execute(sql + ' ORDER BY 2 DESC LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+class PostgresSearchBackend:
+    document_sql = (
+        "setweight(to_tsvector('russian', %s), 'A') || "
+        "setweight(to_tsvector('russian', %s), 'B') || "
+        "setweight(to_tsvector('russian', %s), 'C')"
+    )
+
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+            'product_id bigint PRIMARY KEY, restaurant_id bigint NULL, document tsvector NOT NULL)'
+        )
+        # Таблицы, созданные раньше с integer
+        cursor.execute(
+            f'ALTER TABLE {SEARCH_TABLE} ALTER COLUMN product_id TYPE bigint, ALTER COLUMN restaurant_id TYPE bigint'
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_restaurant_idx ON {SEARCH_TABLE} (restaurant_id)')
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {SEARCH_TABLE}')
+
+    def delete(self, cursor, product_ids):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (product_id, restaurant_id, document) '
+            f'VALUES (%s, %s, {self.document_sql}) '
+            'ON CONFLICT (product_id) DO UPDATE SET '
+            'restaurant_id = EXCLUDED.restaurant_id, document = EXCLUDED.document',
+            documents
+        )
+
+    def match(self, cursor, tokens, restaurant_id, limit):
+        sql = (
+            f'SELECT product_id, ts_rank_cd(document, query) AS score '
+            f"FROM {SEARCH_TABLE}, to_tsquery('russian', %s) query WHERE document @@ query"
+        )
+        params = [' & '.join(f'{token}:*' for token in tokens)]
+        if restaurant_id is not None:
+            sql += ' AND restaurant_id = %s'
+            params.append(restaurant_id)
+        cursor.execute(sql + ' ORDER BY score DESC LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_index_lock = threading.Lock()
+_index_state = {'ready': False, 'backend': None}
+
+# Триграммы названий товаров ресторана для нечеткого поиска, ключ - (ресторан, menu_version)
+_fuzzy_vocabularies = TTLCache(max_size=256, ttl=3600)
+
+
+def _stemmed(text):
+    return ' '.join(stem(token) for token in tokenize(text))
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+    """Создает таблицу индекса (после migrate и в rebuild_search_index); True, если ее не было"""
+    db = connections[using]
+    backend_class = BACKENDS.get(db.vendor)
+    if backend_class is None:
+        return False
+
+    existed = SEARCH_TABLE in db.introspection.table_names()
+    try:
+        with db.cursor() as cursor:
+            backend_class().create(cursor)
+    except DatabaseError as e:
+        logger.warning(f"Не удалось создать поисковый индекс, будет только нечеткий поиск: {str(e)}")
+        return False
+    # Процесс мог уже запомнить, что индекса нет
+    _index_state.update(ready=False, backend=None)
+    return not existed
+
+
+def get_search_backend():
+    """Бэкенд индекса для текущей БД; None, если БД не поддерживается или индекс не создан"""
+    if _index_state['ready']:
+        return _index_state['backend']
+
+    with _index_lock:
+        if not _index_state['ready']:
+            backend_class = BACKENDS.get(connection.vendor)
+            backend = None
+            if backend_class is not None:
+                if SEARCH_TABLE in connection.introspection.table_names():
+                    backend = backend_class()
+                else:
+                    logger.warning(
+                        "Поисковый индекс не создан (manage.py rebuild_search_index), "
+                        "используется только нечеткий поиск"
+                    )
+            _index_state.update(ready=True, backend=backend)
+    return _index_state['backend']
+
+
+def _documents(products):
+    for product in products:
+        category = product.category
+        restaurant_id = product.restaurant_id or (category.restaurant_id if category else None)
+        body = ' '.join(filter(None, [product.short_description, product.description]))
+        yield product.pk, restaurant_id, product.name, category.name if category else '', body
+
+
+def index_products(product_ids):
+    """Обновляет записи индекса для товаров (удаленные товары убираются)"""
+    backend = get_search_backend()
+    product_ids = list(product_ids)
+    if backend is None or not product_ids:
+        return
+
+    products = Product.objects.filter(pk__in=product_ids).select_related('category')
+    with connection.cursor() as cursor:
+        backend.delete(cursor, product_ids)
+        backend.insert(cursor, list(_documents(products)))
+
+
+def remove_products(product_ids):
+    backend = get_search_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.delete(cursor, list(product_ids))
+
+
+def rebuild_search_index(batch_size=500):
+    """Полная перестройка индекса, возвращает число товаров"""
+    backend = get_search_backend()
+    if backend is None:
+        return 0
+
+    products = Product.objects.select_related('category').order_by('pk').iterator(chunk_size=batch_size)
+    count = 0
+    batch = []
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+        for document in _documents(products):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                backend.insert(cursor, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            backend.insert(cursor, batch)
+            count += len(batch)
+    return count
+
+
+def restaurant_products_q(restaurant_id):
+    # У части товаров ресторан указан только у категории
+    return Q(restaurant_id=restaurant_id) | Q(restaurant__isnull=True, category__restaurant_id=restaurant_id)
+
+
+def _fuzzy_vocabulary(restaurant_id):
+    key = None
+    if restaurant_id is not None:
+        version = Restaurant.objects.filter(pk=restaurant_id).values_list('menu_version', flat=True).first()
+        key = (restaurant_id, version)
+        vocabulary = _fuzzy_vocabularies.get(key)
+        if vocabulary is not None:
+            return vocabulary
+
+    products = Product.objects.filter(is_available=True)
+    if restaurant_id is not None:
+        products = products.filter(restaurant_products_q(restaurant_id))
+    vocabulary = [
+        (pk, [trigrams(word) for word in set(tokenize(name))])
+        for pk, name in products.values_list('pk', 'name')
+    ]
+
+    if key is not None:
+        _fuzzy_vocabularies.set(key, vocabulary)
+    return vocabulary
+
+
+def fuzzy_match(tokens, restaurant_id=None):
+    """Товары, в названии которых есть слова, похожие на каждое слово запроса"""
+    query_trigrams = [trigrams(token) for token in tokens if len(token) >= 3]
+    if not query_trigrams:
+        return []
+
+    matches = []
+    for pk, word_trigrams in _fuzzy_vocabulary(restaurant_id):
+        if not word_trigrams:
+            continue
+        score = sum(
+            max(similarity(query, word) for word in word_trigrams) for query in query_trigrams
+        ) / len(query_trigrams)
+        if score >= FUZZY_MIN_SIMILARITY:
+            matches.append((pk, score))
+    return matches
+
+
+def search_products(query, restaurant_id=None, category_id=None, tags=None,
+                    min_price=None, max_price=None, sort=None, queryset=None):
+    """
+    Ищет доступные товары. Возвращает список товаров: по релевантности
+    или в порядке sort (price_asc, price_desc, popular, new).
+    tags - id или slug тегов (товар должен иметь хотя бы один из них).
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    # Ранг - (точное совпадение, оценка): нечеткие совпадения всегда ниже точных
+    ranks = {}
+    backend = get_search_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            for pk, score in backend.match(cursor, tokens, restaurant_id, MAX_MATCHES):
+                ranks[pk] = (1, score)
+
+    if len(ranks) < FUZZY_FALLBACK_THRESHOLD:
+        for pk, score in fuzzy_match(tokens, restaurant_id):
+            ranks.setdefault(pk, (0, score))
+
+    if not ranks:
+        return []
+
+    products = (queryset if queryset is not None else Product.objects.all()).filter(
+        pk__in=list(ranks), is_available=True
+    )
+    if restaurant_id is not None:
+        products = products.filter(restaurant_products_q(restaurant_id))
+    if category_id is not None:
+        category = Category.objects.filter(pk=category_id).only('id', 'path').first()
+        if category is None:
+            return []
+        products = products.filter(subtree_q(category.path, 'category__path') if category.path else Q(category=category))
+    if tags:
+        tag_ids = [tag for tag in tags if str(tag).isdigit()]
+        tag_slugs = [tag for tag in tags if not str(tag).isdigit()]
+        products = products.filter(
+            pk__in=Product.tags.through.objects.filter(
+                Q(tag_id__in=tag_ids) | Q(tag__slug__in=tag_slugs)
+            ).values('product_id')
+        )
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+
+    ordering = SORT_ORDERINGS.get(sort)
+    if ordering is None:
+        return sorted(products, key=lambda product: ranks[product.pk], reverse=True)
+
+    if sort == 'popular':
+        products = products.annotate(order_count=Count('orderitem'))
+    return list(products.order_by(*ordering))
@@ -0,0 +1,164 @@
+import logging
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from restaurants.models import Restaurant
+from .models import Category, OptionValue, Product, ProductOption, ProductOptionMapping, Tag
+from .search import create_search_index, index_products, rebuild_search_index, remove_products
+from .sync import record_tombstone, touch
+
+# Остаток товара опустился до low_stock_threshold (см. orders.stock).
+# Аргументы: product_id, stock_quantity, threshold
+low_stock = Signal()
+
+logger = logging.getLogger(__name__)
+
+
+def bump_menu_version(*restaurant_ids):
+    """
+    Увеличивает версию меню ресторанов. Выполняется в той же транзакции,
+    что и изменение каталога, поэтому новая версия видна вместе с данными.
+    """
+    restaurant_ids = {restaurant_id for restaurant_id in restaurant_ids if restaurant_id}
+    if restaurant_ids:
+        Restaurant.objects.filter(pk__in=restaurant_ids).update(menu_version=F('menu_version') + 1)
+
+
+def _product_restaurant_ids(product):
+    restaurant_ids = [product.restaurant_id]
+    if product.category_id:
+        restaurant_ids.append(
+            Category.objects.filter(pk=product.category_id).values_list('restaurant_id', flat=True).first()
+        )
+    return restaurant_ids
+
+
+def _option_restaurant_ids(option_id, restaurant_id):
+    # Опция может быть без ресторана - меняем версию у ресторанов товаров, к которым она привязана
+    restaurant_ids = [restaurant_id]
+    products = Product.objects.filter(option_mappings__option_id=option_id)
+    for pair in products.values_list('restaurant_id', 'category__restaurant_id'):
+        restaurant_ids.extend(pair)
+    return restaurant_ids
+
+
+@receiver(post_migrate)
+def search_index_after_migrate(sender, using, **kwargs):
+    # Таблица поиска - не модель, создается после миграций каталога и сразу заполняется
+    if sender.name == 'catalog' and create_search_index(using):
+        rebuild_search_index()
+
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_changed(sender, instance, **kwargs):
+    # Данные ресторана входят в снимок меню
+    bump_menu_version(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_menu_version(instance.restaurant_id)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    # Название категории входит в поисковый документ товара
+    if not created:
+        index_products(Product.objects.filter(category_id=instance.pk).values_list('pk', flat=True))
+        # Название в category_name товаров, видимость - в составе меню
+        touch(Product.objects.filter(category_id=instance.pk))
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance, **kwargs):
+    # Товары останутся без категории (SET_NULL в обход save()) и пропадут из меню
+    touch(Product.objects.filter(category_id=instance.pk))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    record_tombstone('category', instance.pk, instance.restaurant_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    bump_menu_version(*_product_restaurant_ids(instance))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    remove_products([instance.pk])
+    # Меню ресторана строится по категории товара
+    restaurant_ids = [restaurant_id for restaurant_id in reversed(_product_restaurant_ids(instance)) if restaurant_id]
+    record_tombstone('product', instance.pk, restaurant_ids[0] if restaurant_ids else None)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    bump_menu_version(instance.restaurant_id)
+
+
+@receiver([post_save, pre_delete], sender=Tag)
+def tag_products_changed(sender, instance, **kwargs):
+    # Теги входят в данные товара
+    touch(Product.objects.filter(tags=instance))
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance - тег; теги принадлежат ресторану своих товаров
+        bump_menu_version(instance.restaurant_id)
+        if kwargs.get('pk_set'):
+            touch(Product.objects.filter(pk__in=kwargs['pk_set']))
+    else:
+        bump_menu_version(*_product_restaurant_ids(instance))
+        touch(Product.objects.filter(pk=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=ProductOption)
+def product_option_changed(sender, instance, **kwargs):
+    bump_menu_version(*_option_restaurant_ids(instance.pk, instance.restaurant_id))
+
+
+@receiver(post_save, sender=ProductOption)
+def product_option_saved(sender, instance, created, **kwargs):
+    # Значения выключенной опции клиент удаляет - при включении их нужно отдать снова
+    if not created:
+        touch(OptionValue.objects.filter(option_id=instance.pk))
+
+
+@receiver(post_delete, sender=ProductOption)
+def product_option_deleted(sender, instance, **kwargs):
+    record_tombstone('option', instance.pk, instance.restaurant_id)
+
+
+@receiver([post_save, post_delete], sender=OptionValue)
+def option_value_changed(sender, instance, **kwargs):
+    option_restaurant_id = ProductOption.objects.filter(pk=instance.option_id).values_list('restaurant_id', flat=True).first()
+    bump_menu_version(*_option_restaurant_ids(instance.option_id, option_restaurant_id))
+    if kwargs['signal'] is post_delete:
+        record_tombstone('option_value', instance.pk, option_restaurant_id)
+
+
+@receiver([post_save, post_delete], sender=ProductOptionMapping)
+def product_option_mapping_changed(sender, instance, **kwargs):
+    product = Product.objects.filter(pk=instance.product_id).only('restaurant_id', 'category_id').first()
+    if product is not None:
+        bump_menu_version(*_product_restaurant_ids(product))
+        # Опции товара отдаются в его данных (option_ids)
+        touch(Product.objects.filter(pk=product.pk))
+
+
+@receiver(low_stock)
+def log_low_stock(sender, product_id, stock_quantity, threshold, **kwargs):
+    logger.warning(f"Товар {product_id} заканчивается: осталось {stock_quantity} (порог {threshold})")
@@ -0,0 +1,148 @@
+"""
+Подсказки при вводе в строку поиска.
+
+Для каждого ресторана в памяти процесса строится отсортированный массив
+ключей: нормализованное название товара или категории, начиная с каждого
+его слова ("классический бургер", "бургер"). Префикс запроса находится
+двумя bisect, совпадения ранжируются по популярности (число проданных
+штук). Индекс ресторана перестраивается, когда меняется menu_version
+(проверяется не чаще раза в SUGGEST_VERSION_CHECK_INTERVAL секунд),
+и раз в SUGGEST_INDEX_TTL секунд - чтобы обновить популярность.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Q, Sum
+
+from restaurants.models import Restaurant
+from .models import Category, Product
+from .search import restaurant_products_q
+from .text import tokenize
+
+VERSION_CHECK_INTERVAL = getattr(settings, 'SUGGEST_VERSION_CHECK_INTERVAL', 2.0)
+INDEX_TTL = getattr(settings, 'SUGGEST_INDEX_TTL', 600)
+EXCLUDED_ORDER_STATUSES = ('cancelled', 'refunded', 'failed')
+
+
+class SuggestIndex:
+    def __init__(self, version, entries):
+        """entries - [(популярность, подсказка)], подсказка - dict с type, id и name"""
+        self.version = version
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+
+        keys = []
+        for position, (popularity, suggestion) in enumerate(entries):
+            words = tokenize(suggestion['name'])
+            for start in range(len(words)):
+                keys.append((' '.join(words[start:]), -popularity, position))
+        keys.sort()
+
+        self._keys = [key for key, _, _ in keys]
+        self._positions = [position for _, _, position in keys]
+        self._words = [frozenset(tokenize(suggestion['name'])) for _, suggestion in entries]
+        self._entries = entries
+
+    def lookup(self, query, limit=10):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        first, rest = tokens[0], tokens[1:]
+        start = bisect_left(self._keys, first)
+        end = bisect_left(self._keys, first + '\uffff', start)
+
+        matched = set()
+        for position in self._positions[start:end]:
+            if position in matched:
+                continue
+            # Остальные слова запроса - префиксы каких-либо слов названия
+            words = self._words[position]
+            if all(any(word.startswith(token) for word in words) for token in rest):
+                matched.add(position)
+
+        best = heapq.nlargest(limit, matched, key=lambda position: (self._entries[position][0], -position))
+        return [self._entries[position][1] for position in best]
+
+
+def _product_popularity(product_ids):
+    from orders.models import OrderItem
+
+    return dict(
+        OrderItem.objects.filter(product_id__in=product_ids)
+        .exclude(order__status__in=EXCLUDED_ORDER_STATUSES)
+        .values_list('product_id')
+        .annotate(sold=Sum('quantity'))
+    )
+
+
+def build_suggest_index(restaurant_id, version):
+    products = list(
+        Product.objects.filter(restaurant_products_q(restaurant_id), is_available=True)
+        .filter(Q(category__isnull=True) | Q(category__is_active=True, category__is_visible=True))
+        .values('id', 'name', 'price', 'category_id', 'main_image_url')
+    )
+    categories = list(
+        Category.objects.filter(restaurant_id=restaurant_id, is_active=True, is_visible=True).values('id', 'name')
+    )
+
+    popularity = _product_popularity([product['id'] for product in products])
+    category_popularity = {}
+    entries = []
+    for product in products:
+        sold = popularity.get(product['id'], 0)
+        category_popularity[product['category_id']] = category_popularity.get(product['category_id'], 0) + sold
+        entries.append((sold, {
+            'type': 'product',
+            'id': product['id'],
+            'name': product['name'],
+            'price': str(product['price']),
+            'category_id': product['category_id'],
+            'image_url': product['main_image_url'],
+        }))
+    for category in categories:
+        entries.append((category_popularity.get(category['id'], 0), {
+            'type': 'category',
+            'id': category['id'],
+            'name': category['name'],
+        }))
+
+    return SuggestIndex(version, entries)
+
+
+_indexes = {}
+_build_lock = threading.Lock()
+
+
+def get_suggest_index(restaurant_id):
+    """Индекс ресторана или None, если ресторана нет"""
+    index = _indexes.get(restaurant_id)
+    now = time.monotonic()
+    if index is not None and now - index.built_at < INDEX_TTL and now - index.checked_at < VERSION_CHECK_INTERVAL:
+        return index
+
+    version = Restaurant.objects.filter(pk=restaurant_id, is_active=True).values_list('menu_version', flat=True).first()
+    if version is None:
+        _indexes.pop(restaurant_id, None)
+        return None
+
+    if index is not None and index.version == version and now - index.built_at < INDEX_TTL:
+        index.checked_at = now
+        return index
+
+    with _build_lock:
+        index = _indexes.get(restaurant_id)
+        if index is None or index.version != version or time.monotonic() - index.built_at >= INDEX_TTL:
+            index = build_suggest_index(restaurant_id, version)
+            _indexes[restaurant_id] = index
+    return index
+
+
+def suggest(restaurant_id, query, limit=10):
+    index = get_suggest_index(restaurant_id)
+    if index is None:
+        return []
+    return index.lookup(query, limit)
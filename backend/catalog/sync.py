@@ -0,0 +1,147 @@
+"""
+Дельта-синхронизация меню: клиент хранит меню у себя и запрашивает только
+изменения после своего токена.
+
+Категории, товары, опции и значения опций хранят sync_version - значение
+глобального счетчика CatalogSyncState на момент последнего изменения.
+Счетчик увеличивается в той же транзакции, что и изменение строки, а его
+строка остается заблокированной до коммита. Поэтому версии становятся видны
+строго по возрастанию: если клиент получил токен N, все изменения с версией
+<= N он уже получил.
+
+Изменения в обход save() (bulk-операции, UPDATE) должны ставить версию сами
+(touch). Удаления записываются в CatalogTombstone; строки, пропавшие из меню
+(выключенные, скрытые, перенесенные), клиент тоже получает как удаления.
+"""
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from .models import CatalogSyncState, CatalogTombstone, Category, OptionValue, Product, ProductOption
+from .search import restaurant_products_q
+
+KINDS = ('category', 'product', 'option', 'option_value')
+
+
+def next_sync_version():
+    """Следующая версия; строка счетчика заблокирована до конца транзакции"""
+    with transaction.atomic():
+        if not CatalogSyncState.objects.filter(pk=1).update(version=F('version') + 1):
+            CatalogSyncState.objects.get_or_create(pk=1)
+            CatalogSyncState.objects.filter(pk=1).update(version=F('version') + 1)
+        return CatalogSyncState.objects.values_list('version', flat=True).get(pk=1)
+
+
+def touch(queryset):
+    """Новая sync_version для строк, измененных в обход save()"""
+    with transaction.atomic():
+        return queryset.update(sync_version=next_sync_version())
+
+
+def record_tombstone(kind, object_id, restaurant_id):
+    with transaction.atomic():
+        CatalogTombstone.objects.create(
+            kind=kind, object_id=object_id, restaurant_id=restaurant_id, sync_version=next_sync_version()
+        )
+
+
+def prune_tombstones(older_than):
+    """
+    Удаляет старые записи об удалениях. Клиентам с токеном старше удаленных
+    записей menu_changes вернет полную синхронизацию. Возвращает число записей.
+    """
+    with transaction.atomic():
+        max_version = CatalogTombstone.objects.filter(created_at__lt=older_than).aggregate(
+            Max('sync_version')
+        )['sync_version__max']
+        if max_version is None:
+            return 0
+        CatalogSyncState.objects.get_or_create(pk=1)
+        CatalogSyncState.objects.filter(pk=1, pruned_version__lt=max_version).update(pruned_version=max_version)
+        deleted, _ = CatalogTombstone.objects.filter(sync_version__lte=max_version).delete()
+        return deleted
+
+
+@dataclass
+class MenuChanges:
+    token: int
+    # True - клиенту нужно заменить свое меню целиком (первая или слишком старая синхронизация)
+    reset: bool
+    # вид -> queryset строк для отправки
+    upserts: dict = field(default_factory=dict)
+    # вид -> id строк, которые клиенту нужно удалить
+    deletes: dict = field(default_factory=dict)
+
+
+def _split(rows, visible):
+    """[(id, видна ли в меню)] -> (id для отправки, id для удаления)"""
+    upsert_ids, delete_ids = [], []
+    for pk, *state in rows:
+        (upsert_ids if visible(*state) else delete_ids).append(pk)
+    return upsert_ids, delete_ids
+
+
+def menu_changes(restaurant_id, since=None):
+    """
+    Изменения меню ресторана после токена since (None - все меню).
+    Состав меню тот же, что в снимке меню: активные и видимые категории
+    ресторана, доступные товары в них, опции этих товаров и их значения.
+    """
+    # Токен читается до данных: все, что видно с этим токеном, уже закоммичено
+    token, pruned_version = CatalogSyncState.objects.filter(pk=1).values_list(
+        'version', 'pruned_version'
+    ).first() or (0, 0)
+    reset = since is None or since < pruned_version or since > token
+    changes = MenuChanges(token=token, reset=reset)
+    if not reset and since == token:
+        # Ничего не менялось ни в одном ресторане
+        for kind, model in zip(KINDS, (Category, Product, ProductOption, OptionValue)):
+            changes.upserts[kind] = model.objects.none()
+            changes.deletes[kind] = []
+        return changes
+
+    visible_categories = set(Category.objects.filter(
+        restaurant_id=restaurant_id, is_active=True, is_visible=True
+    ).values_list('pk', flat=True))
+    menu_products = Product.objects.filter(category__restaurant_id=restaurant_id)
+    options = ProductOption.objects.filter(
+        Q(restaurant_id=restaurant_id)
+        | Q(restaurant__isnull=True, product_mappings__product__in=menu_products)
+    ).distinct()
+
+    candidates = {
+        'category': (
+            Category.objects.filter(restaurant_id=restaurant_id),
+            ('is_active', 'is_visible'),
+            lambda is_active, is_visible: is_active and is_visible,
+        ),
+        'product': (
+            # Товар, перенесенный из категорий ресторана, тоже нужно удалить у клиента
+            Product.objects.filter(Q(category__restaurant_id=restaurant_id) | restaurant_products_q(restaurant_id)),
+            ('is_available', 'category_id'),
+            lambda is_available, category_id: is_available and category_id in visible_categories,
+        ),
+        'option': (options, ('is_active',), bool),
+        'option_value': (
+            OptionValue.objects.filter(option__in=options.values('pk')),
+            ('option__is_active',),
+            bool,
+        ),
+    }
+    for kind, (queryset, state_fields, visible) in candidates.items():
+        if not reset:
+            queryset = queryset.filter(sync_version__gt=since)
+        rows = queryset.values_list('pk', *state_fields)
+        upsert_ids, delete_ids = _split(rows, visible)
+        changes.upserts[kind] = queryset.model.objects.filter(pk__in=upsert_ids)
+        # При полной синхронизации клиент и так заменяет меню целиком
+        changes.deletes[kind] = [] if reset else sorted(delete_ids)
+
+    if not reset:
+        tombstones = CatalogTombstone.objects.filter(
+            Q(restaurant_id=restaurant_id) | Q(restaurant__isnull=True), sync_version__gt=since
+        ).values_list('kind', 'object_id')
+        for kind, object_id in tombstones:
+            changes.deletes[kind].append(object_id)
+    return changes
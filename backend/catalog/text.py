@@ -0,0 +1,122 @@
+"""
+Нормализация текста каталога для поиска: токенизация, стемминг
+(алгоритм Snowball для русского языка) и триграммы для нечеткого поиска.
+"""
+import re
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+VOWELS = set('аеиоуыэюя')
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ((), ('ся', 'сь'))
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+    'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+))
+DERIVATIONAL = ((), ('ост', 'ость'))
+SUPERLATIVE = ((), ('ейш', 'ейше'))
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def _regions(word):
+    """Начала областей RV и R2 алгоритма Snowball"""
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    return rv, r2
+
+
+def _remove_ending(word, start, groups):
+    """
+    Удаляет самое длинное окончание из groups, целиком лежащее в word[start:].
+    Окончания первой группы должны идти после 'а' или 'я' (тоже в области).
+    Возвращает новое слово или None, если окончание не найдено.
+    """
+    best, best_group = '', None
+    for group_index, endings in enumerate(groups):
+        for ending in endings:
+            if len(ending) > len(best) and word.endswith(ending) and len(word) - len(ending) >= start:
+                best, best_group = ending, group_index
+
+    if best_group is None:
+        return None
+    cut = len(word) - len(best)
+    if best_group == 0 and not (cut - 1 >= start and word[cut - 1] in 'ая'):
+        return None
+    return word[:cut]
+
+
+@lru_cache(maxsize=50000)
+def stem(word):
+    word = normalize(word)
+    if not re.fullmatch('[а-я]+', word):
+        return word
+
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    result = _remove_ending(word, rv, PERFECTIVE_GERUND)
+    if result is None:
+        word = _remove_ending(word, rv, REFLEXIVE) or word
+        result = _remove_ending(word, rv, ADJECTIVE)
+        if result is not None:
+            result = _remove_ending(result, rv, PARTICIPLE) or result
+        else:
+            result = _remove_ending(word, rv, VERB)
+            if result is None:
+                result = _remove_ending(word, rv, NOUN)
+    if result is not None:
+        word = result
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word = _remove_ending(word, r2, DERIVATIONAL) or word
+
+    # Шаг 4
+    result = _remove_ending(word, rv, SUPERLATIVE)
+    if result is not None:
+        word = result
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    elif result is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    return word
+
+
+def stems(text):
+    return [stem(token) for token in tokenize(text)]
+
+
+def trigrams(word):
+    """Триграммы слова с границами, как в pg_trgm"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a, b):
+    """Коэффициент Жаккара двух множеств триграмм"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
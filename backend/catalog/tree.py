@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Concat, Substr
+
+from .models import Category
+
+
+def subtree_q(path, field='path'):
+    """
+    Условие "категория входит в поддерево path" (вместе с самой категорией).
+    Записывается диапазоном, а не LIKE, чтобы использовать обычный индекс:
+    все пути с префиксом '/1/5/' лежат в ['/1/5/', '/1/50'), т.к. '0' следует за '/'.
+    """
+    if not path.startswith('/') or not path.endswith('/') or len(path) < 3:
+        raise ValueError(f"Некорректный путь категории: {path!r}")
+    return Q(**{f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'})
+
+
+def move_subtree(old_path, new_path, depth_delta):
+    """Переписывает path и depth всех категорий поддерева old_path"""
+    Category.objects.filter(subtree_q(old_path)).update(
+        path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=CharField()),
+        depth=F('depth') + depth_delta
+    )
+
+
+def category_children_map(restaurant_ids, visible_only=True):
+    """
+    Загружает категории ресторанов одним запросом и возвращает
+    {id родителя: [дочерние категории в порядке display_order]}.
+    Корневые категории лежат под ключом None.
+    """
+    restaurant_ids = set(restaurant_ids)
+    condition = Q(restaurant_id__in=[rid for rid in restaurant_ids if rid is not None])
+    if None in restaurant_ids:
+        condition |= Q(restaurant__isnull=True)
+
+    categories = Category.objects.filter(condition).select_related('restaurant').order_by('display_order', 'id')
+    if visible_only:
+        categories = categories.filter(is_active=True, is_visible=True)
+
+    children = defaultdict(list)
+    for category in categories:
+        children[category.parent_id].append(category)
+    return children
+
+
+def rebuild_category_paths():
+    """
+    Пересчитывает path и depth всех категорий (заполнение существующих
+    данных). Возвращает число обновленных категорий.
+    """
+    categories = {category.pk: category for category in Category.objects.only('id', 'parent_id', 'path', 'depth')}
+    children = defaultdict(list)
+    for category in categories.values():
+        children[category.parent_id].append(category)
+
+    changed = []
+    # Обход от корней; категории в циклах (parent по кругу) не достижимы и пропускаются
+    stack = [(category, '/', 0) for category in children[None]]
+    while stack:
+        category, parent_path, depth = stack.pop()
+        path = f'{parent_path}{category.pk}/'
+        if category.path != path or category.depth != depth:
+            category.path, category.depth = path, depth
+            changed.append(category)
+        stack.extend((child, path, depth + 1) for child in children[category.pk])
+
+    Category.objects.bulk_update(changed, ['path', 'depth'], batch_size=500)
+    return len(changed)
@@ -0,0 +1,179 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+route_var = contextvars.ContextVar('route', default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Добавляет к записи id запроса и имя маршрута"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.route = route_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей ниже WARNING для шумных логгеров.
+    rates: {'имя.логгера': доля от 0 до 1}, действует и на дочерние логгеры.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition('.')[0]
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничивает число записей ниже ERROR с одного места вызова:
+    не больше rate записей за per секунд. Число подавленных записей
+    добавляется к следующей пропущенной записи (поле suppressed).
+    """
+
+    def __init__(self, rate=20, per=60.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.per:
+                window_start, count = now, 0
+
+            if count >= self.rate:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+
+            self._windows[key] = (window_start, count + 1, 0)
+
+        record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            payload['suppressed'] = suppressed
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Запись прошла через QueueListenerHandler - traceback уже текстом
+            payload['exc_info'] = record.exc_text
+
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_traceback_formatter = logging.Formatter()
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Неблокирующий обработчик: запись кладется в очередь, а в указанные
+    обработчики (файл, консоль) ее пишет фоновый QueueListener.
+    При переполнении очереди запись отбрасывается, а не ждет.
+
+    В dictConfig обработчики-приемники передаются как 'cfg://handlers.<имя>'
+    и должны быть объявлены под именами, которые сортируются раньше
+    имени этого обработчика (dictConfig создает их в алфавитном порядке).
+    """
+
+    def __init__(self, handlers, queue_size=10000, respect_handler_level=True):
+        self.queue_size = queue_size
+        # ConvertingList из dictConfig разрешает cfg:// только при обращении по индексу
+        self.handlers = [handlers[i] for i in range(len(handlers))]
+        self.respect_handler_level = respect_handler_level
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self._ensure_listener()
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        # После fork (gunicorn --preload) поток слушателя в дочернем процессе не существует
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+
+        with self._start_lock:
+            if self._listener_pid == pid:
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self._listener = QueueListener(
+                self.queue, *self.handlers, respect_handler_level=self.respect_handler_level
+            )
+            self._listener.start()
+            self._listener_pid = pid
+
+    def prepare(self, record):
+        """
+        В отличие от QueueHandler.prepare запись не форматируется: подставляются
+        аргументы сообщения, а исключение сохраняется текстом в exc_text, чтобы
+        приемники (JsonFormatter) вывели traceback отдельным полем.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
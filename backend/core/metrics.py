@@ -0,0 +1,301 @@
+import atexit
+import contextvars
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'api_request_duration_seconds': ('Время обработки запроса', SECONDS_BUCKETS),
+    'api_request_sql_queries': ('Число SQL-запросов на запрос', QUERY_COUNT_BUCKETS),
+    'api_request_sql_duration_seconds': ('Время SQL-запросов на запрос', SECONDS_BUCKETS),
+    'api_request_serializer_duration_seconds': ('Время сериализации на запрос', SECONDS_BUCKETS),
+    'api_response_size_bytes': ('Размер тела ответа', BYTES_BUCKETS),
+}
+
+# Сумма метрик завершившихся воркеров, чтобы счетчики не уменьшались
+TOMBSTONE_FILE = 'dead.json'
+LOCK_FILE = 'dead.lock'
+
+# Метрики текущего запроса (заполняются middleware и хуками)
+current_request_metrics = contextvars.ContextVar('current_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('sql_queries', 'sql_seconds', 'serializer_seconds', 'serializer_depth')
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    """Обертка для connection.execute_wrapper: считает запросы и их время"""
+    metrics = current_request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_queries += 1
+        metrics.sql_seconds += time.perf_counter() - started
+
+
+def install_serializer_timing():
+    """
+    Оборачивает BaseSerializer.data, чтобы учитывать время сериализации.
+    Вложенные вызовы (например, рекурсивные сериализаторы) не суммируются
+    повторно - считается только самый внешний.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data.fget
+    if getattr(original, '_metrics_wrapped', False):
+        return
+
+    def timed_data(self):
+        metrics = current_request_metrics.get()
+        if metrics is None:
+            return original(self)
+
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            metrics.serializer_depth -= 1
+            if metrics.serializer_depth == 0:
+                metrics.serializer_seconds += time.perf_counter() - started
+
+    timed_data._metrics_wrapped = True
+    BaseSerializer.data = property(timed_data)
+
+
+class MetricsRegistry:
+    """
+    Гистограммы в памяти процесса. Каждый процесс периодически сбрасывает
+    свое состояние в METRICS_DIR/<pid>.json; при выдаче метрик файлы всех
+    воркеров суммируются. Файлы завершившихся процессов (при выходе или,
+    если процесс убит, при следующем collect) добавляются в dead.json и
+    удаляются.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = {}
+        self._last_flush = 0.0
+        # Процесс, который уже писал свой файл (после fork pid меняется)
+        self._flush_pid = None
+        if directory:
+            atexit.register(self.retire)
+
+    def observe_request(self, route, method, status_code, duration, metrics, response_size):
+        labels = f'{route}\t{method}'
+        observations = {
+            'api_request_duration_seconds': duration,
+            'api_request_sql_queries': metrics.sql_queries,
+            'api_request_sql_duration_seconds': metrics.sql_seconds,
+            'api_request_serializer_duration_seconds': metrics.serializer_seconds,
+        }
+        if response_size is not None:
+            observations['api_response_size_bytes'] = response_size
+
+        with self._lock:
+            for name, value in observations.items():
+                buckets = HISTOGRAMS[name][1]
+                series = self._histograms.setdefault(name, {}).get(labels)
+                if series is None:
+                    series = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+                    self._histograms[name][labels] = series
+                series['buckets'][bisect_left(buckets, value)] += 1
+                series['sum'] += value
+                series['count'] += 1
+
+            status_key = f'{labels}\t{status_code}'
+            self._responses[status_key] = self._responses.get(status_key, 0) + 1
+
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps({'histograms': self._histograms, 'responses': self._responses}))
+
+    def maybe_flush(self, force=False):
+        if not self.directory:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            if self._flush_pid != os.getpid():
+                # Файл с тем же pid остался от завершившегося процесса
+                self._flush_pid = os.getpid()
+                if os.path.exists(path):
+                    self._retire_files([path])
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить метрики: {str(e)}")
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _retire_files(self, paths):
+        """Добавляет файлы в dead.json и удаляет их; под блокировкой, т.к. это делают все воркеры"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_FILE), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                tombstone = os.path.join(self.directory, TOMBSTONE_FILE)
+                merged = _read_metrics(tombstone) or {'histograms': {}, 'responses': {}}
+                retired = []
+                for path in paths:
+                    data = _read_metrics(path)
+                    if data is not None:
+                        _merge_metrics(merged, data)
+                        retired.append(path)
+                if not retired:
+                    return
+                tmp_path = f'{tombstone}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(merged, f)
+                os.replace(tmp_path, tombstone)
+                for path in retired:
+                    os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось перенести метрики завершившихся воркеров: {str(e)}")
+
+    def retire(self):
+        """При выходе процесса: последнее состояние уходит в dead.json"""
+        if self.directory:
+            self.maybe_flush(force=True)
+            self._retire_files([self._path(os.getpid())])
+
+    def collect(self):
+        """Суммирует состояние всех воркеров"""
+        if not self.directory:
+            return self.snapshot()
+
+        self.maybe_flush(force=True)
+        paths = glob.glob(os.path.join(self.directory, '*.json'))
+        dead = [path for path in paths if not _pid_alive(_file_pid(path))]
+        if dead:
+            self._retire_files(dead)
+            paths = glob.glob(os.path.join(self.directory, '*.json'))
+
+        merged = {'histograms': {}, 'responses': {}}
+        for path in paths:
+            data = _read_metrics(path)
+            if data is not None:
+                _merge_metrics(merged, data)
+        return merged
+
+    def render_prometheus(self):
+        data = self.collect()
+        lines = []
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, series in sorted(data['histograms'].get(name, {}).items()):
+                route, method = labels.split('\t')
+                base_labels = f'route="{_escape(route)}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(buckets, series['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{base_labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{base_labels},le="+Inf"}} {series["count"]}')
+                lines.append(f'{name}_sum{{{base_labels}}} {series["sum"]}')
+                lines.append(f'{name}_count{{{base_labels}}} {series["count"]}')
+
+        lines.append('# HELP api_responses_total Число ответов по коду статуса')
+        lines.append('# TYPE api_responses_total counter')
+        for key, count in sorted(data['responses'].items()):
+            route, method, status_code = key.split('\t')
+            lines.append(
+                f'api_responses_total{{route="{_escape(route)}",method="{method}",status="{status_code}"}} {count}'
+            )
+
+        return '\n'.join(lines) + '\n'
+
+
+def _file_pid(path):
+    """pid из имени <pid>.json; None для dead.json и посторонних файлов"""
+    try:
+        return int(os.path.basename(path)[:-len('.json')])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_metrics(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge_metrics(target, data):
+    for name, series_by_labels in data.get('histograms', {}).items():
+        histograms = target['histograms'].setdefault(name, {})
+        for labels, series in series_by_labels.items():
+            existing = histograms.get(labels)
+            if existing is None:
+                histograms[labels] = series
+                continue
+            existing['buckets'] = [a + b for a, b in zip(existing['buckets'], series['buckets'])]
+            existing['sum'] += series['sum']
+            existing['count'] += series['count']
+
+    for key, count in data.get('responses', {}).items():
+        target['responses'][key] = target['responses'].get(key, 0) + count
+    return target
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+registry = MetricsRegistry(
+    directory=getattr(settings, 'METRICS_DIR', None),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0),
+)
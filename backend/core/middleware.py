@@ -0,0 +1,70 @@
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .logging import request_id_var, route_var
+from .metrics import RequestMetrics, current_request_metrics, registry, sql_execute_wrapper
+
+
+class RequestMetricsMiddleware:
+    """
+    Собирает по каждому маршруту время ответа, число и время SQL-запросов,
+    время сериализации и размер ответа
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sql_execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+
+        duration = time.perf_counter() - started
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match else 'unresolved'
+        response_size = None if response.streaming else len(response.content)
+
+        registry.observe_request(route, request.method, response.status_code, duration, metrics, response_size)
+        return response
+
+
+class RequestContextMiddleware:
+    """
+    Проставляет id запроса (из X-Request-ID или новый) и имя маршрута
+    в контекст логирования
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID') or uuid.uuid4().hex
+        request_id_token = request_id_var.set(request_id)
+        route_token = route_var.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(request_id_token)
+            route_var.reset(route_token)
+
+        response['X-Request-ID'] = request_id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route_var.set(request.resolver_match.view_name)
+        return None
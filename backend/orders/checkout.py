@@ -0,0 +1,104 @@
+"""
+Оформление заказа из корзины.
+
+place_order вызывается в транзакции создания заказа (OrderViewSet): переносит
+позиции корзины в заказ, проверяет доставку по адресу и считает ее
+стоимость (restaurants.zones), пересчитывает суммы, занимает место в
+выбранном слоте времени (orders.slots) и резервирует остатки (orders.stock).
+Если проверка или резерв не удались, исключение откатывает всю
+транзакцию - и заказ, и уже сделанные резервы.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from restaurants.zones import validate_delivery
+from .models import CartItem, OrderItem
+from .slots import reserve_order_slot
+from .stock import reserve_order_stock
+
+
+# Поля, которые при создании заказа задает сервер, а не клиент
+ORDER_DEFAULTS = {
+    'status': 'pending',
+    'payment_status': 'pending',
+    'subtotal': Decimal('0.00'),
+    'discount_amount': Decimal('0.00'),
+    'bonus_used': Decimal('0.00'),
+    'promo_discount_amount': Decimal('0.00'),
+    'bonus_earned': Decimal('0.00'),
+    'total_amount': Decimal('0.00'),
+}
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def _order_item(order, cart_item):
+    product = cart_item.product
+    value_ids = defaultdict(list)
+    options_modifier = Decimal('0.00')
+    for value in cart_item.selected_options.all():
+        value_ids[value.option_id].append(value.pk)
+        options_modifier += value.price_modifier
+    item = OrderItem(
+        order=order,
+        product=product,
+        product_name=product.name,
+        product_description=product.short_description,
+        product_price=product.price,
+        quantity=cart_item.quantity,
+        selected_options=[
+            {'option_id': option_id, 'value_ids': ids} for option_id, ids in sorted(value_ids.items())
+        ],
+        options_modifier=options_modifier,
+    )
+    item.calculate_prices()
+    return item
+
+
+def fill_from_cart(order, user):
+    """Позиции заказа из корзины пользователя и subtotal; корзина очищается. EmptyCart, если она пуста"""
+    cart_items = list(
+        CartItem.objects.filter(cart__user=user).select_related('product').prefetch_related('selected_options')
+    )
+    if not cart_items:
+        raise EmptyCart('Корзина пуста')
+
+    items = OrderItem.objects.bulk_create([_order_item(order, cart_item) for cart_item in cart_items])
+    CartItem.objects.filter(pk__in=[cart_item.pk for cart_item in cart_items]).delete()
+
+    order.subtotal = sum((item.subtotal for item in items), Decimal('0.00'))
+    return items
+
+
+def apply_delivery_fee(order):
+    """
+    Стоимость доставки задает сервер. Адрес с координатами проверяется по
+    зонам и радиусу филиала (DeliveryUnavailable); без координат - базовая
+    стоимость филиала, у самовывоза - 0.
+    """
+    address = order.delivery_address
+    if order.order_type != 'delivery':
+        order.delivery_fee = Decimal('0.00')
+    elif address is None or address.latitude is None or address.longitude is None:
+        order.delivery_fee = order.branch.delivery_fee
+    else:
+        check = validate_delivery(order.branch, float(address.latitude), float(address.longitude), order.subtotal)
+        order.delivery_fee = check.delivery_fee
+    return order.delivery_fee
+
+
+def place_order(order, user):
+    """
+    Позиции из корзины, суммы и резервы; исключения - EmptyCart,
+    restaurants.zones.DeliveryUnavailable, orders.slots.SlotUnavailable,
+    orders.stock.InsufficientStock
+    """
+    fill_from_cart(order, user)
+    apply_delivery_fee(order)
+    order.total_amount = order.calculate_total()
+    order.save(update_fields=['subtotal', 'delivery_fee', 'total_amount', 'updated_at'])
+    reserve_order_slot(order)
+    reserve_order_stock(order)
+    return order
@@ -0,0 +1,199 @@
+"""
+Оценка времени готовности и доставки заказа.
+
+Для каждого филиала хранится BranchLoadStats: число заказов в очереди
+кухни (confirmed и preparing) и экспоненциальные скользящие средние
+длительностей приготовления (от подтверждения до выхода из очереди) и
+доставки (от передачи курьеру до вручения). Все обновляется одним UPDATE
+при смене статуса заказа, без агрегатов по таблице заказов; оценка читает
+одну строку статистики.
+
+Переход сначала закрепляется за заказом условным UPDATE (флаг
+in_kitchen_queue, пустые отметки времени и длительности), и статистика
+меняется, только если он удался: повторное сохранение того же перехода
+устаревшим экземпляром Order ее не меняет.
+
+Готовность = время приготовления x (1 + заказов впереди // ORDER_ETA_PARALLEL_ORDERS),
+пока статистики нет - среднее preparation_time_min и preparation_time_max.
+Доставка = готовность + среднее время доставки (ORDER_ETA_DELIVERY_MINUTES,
+пока статистики нет), но не раньше начала выбранного слота.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import BranchLoadStats, Order
+
+QUEUE_STATUSES = ('confirmed', 'preparing')
+FINAL_STATUSES = ('delivered', 'picked_up', 'cancelled', 'refunded', 'failed')
+NOT_PREPARED_STATUSES = ('cancelled', 'refunded', 'failed')
+
+ALPHA = getattr(settings, 'ORDER_ETA_ALPHA', 0.2)
+PARALLEL_ORDERS = getattr(settings, 'ORDER_ETA_PARALLEL_ORDERS', 4)
+DEFAULT_DELIVERY_MINUTES = getattr(settings, 'ORDER_ETA_DELIVERY_MINUTES', 30)
+# Если оценка уже прошла, а заказ не готов - сдвигаем ее от текущего момента
+LATE_PADDING_MINUTES = 5
+# Длительности дольше - забытые заказы, в статистику не попадают
+MAX_SAMPLE_MINUTES = 240
+
+
+@dataclass
+class Estimate:
+    ready_at: datetime.datetime
+    # None для самовывоза
+    delivered_at: Optional[datetime.datetime]
+
+
+def get_load_stats(branch_id):
+    """Статистика филиала (несохраненная пустая, если заказов еще не было)"""
+    return BranchLoadStats.objects.filter(branch_id=branch_id).first() or BranchLoadStats(branch_id=branch_id)
+
+
+def _preparation_minutes(branch, stats):
+    if stats.preparation_samples:
+        return stats.preparation_minutes
+    return (branch.preparation_time_min + branch.preparation_time_max) / 2
+
+
+def _delivery_minutes(stats):
+    return stats.delivery_minutes if stats.delivery_samples else DEFAULT_DELIVERY_MINUTES
+
+
+def estimate(branch, order_type='delivery', at=None, stats=None, ahead=None):
+    """
+    Оценка для нового заказа. ahead - заказов в очереди перед ним
+    (по умолчанию - вся текущая очередь филиала).
+    """
+    at = at or timezone.now()
+    stats = stats or get_load_stats(branch.pk)
+    ahead = stats.queue_depth if ahead is None else max(ahead, 0)
+    minutes = _preparation_minutes(branch, stats) * (1 + ahead // max(PARALLEL_ORDERS, 1))
+    ready_at = at + datetime.timedelta(minutes=max(minutes, branch.preparation_time_min))
+    delivered_at = None
+    if order_type == 'delivery':
+        delivered_at = ready_at + datetime.timedelta(minutes=_delivery_minutes(stats))
+    return Estimate(ready_at, delivered_at)
+
+
+def _not_before_slot(order, delivered_at):
+    if delivered_at is not None and order.time_slot_starts_at and delivered_at < order.time_slot_starts_at:
+        return order.time_slot_starts_at
+    return delivered_at
+
+
+def order_estimate(order, at=None, stats=None):
+    """Текущая оценка заказа по его статусу; для завершенных - сохраненные значения"""
+    at = at or timezone.now()
+    if order.status in FINAL_STATUSES:
+        return Estimate(order.estimated_preparation_time, order.estimated_delivery_time)
+
+    stats = stats or get_load_stats(order.branch_id)
+    late = at + datetime.timedelta(minutes=LATE_PADDING_MINUTES)
+    delivery = datetime.timedelta(minutes=_delivery_minutes(stats))
+    is_delivery = order.order_type == 'delivery'
+
+    if order.status == 'pending':
+        result = estimate(order.branch, order.order_type, at, stats)
+    elif order.status in QUEUE_STATUSES:
+        ready_at = order.estimated_preparation_time
+        if ready_at is None:
+            ready_at = estimate(order.branch, order.order_type, at, stats, stats.queue_depth - 1).ready_at
+        ready_at = max(ready_at, late)
+        result = Estimate(ready_at, ready_at + delivery if is_delivery else None)
+    elif order.status == 'ready':
+        ready_at = order.prepared_at or at
+        result = Estimate(ready_at, max(ready_at + delivery, late) if is_delivery else None)
+    else:  # delivering
+        dispatched_at = order.dispatched_at or at
+        ready_at = order.prepared_at or order.estimated_preparation_time or dispatched_at
+        result = Estimate(ready_at, max(dispatched_at + delivery, late))
+
+    result.delivered_at = _not_before_slot(order, result.delivered_at)
+    return result
+
+
+def _ewma(field, samples_field, minutes):
+    value = Value(float(minutes))
+    return {
+        field: Case(
+            When(**{samples_field: 0}, then=value),
+            default=F(field) + ALPHA * (value - F(field)),
+            output_field=FloatField(),
+        ),
+        samples_field: F(samples_field) + 1,
+    }
+
+
+def _minutes_since(start, now):
+    if start is None:
+        return None
+    minutes = (now - start).total_seconds() / 60
+    return round(minutes) if 0 <= minutes <= MAX_SAMPLE_MINUTES else None
+
+
+def _claim(orders, order, field, value):
+    """Ставит поле заказа, если оно еще пустое; True, если это сделал этот вызов"""
+    if not orders.filter(**{f'{field}__isnull': True}).update(**{field: value}):
+        return False
+    setattr(order, field, value)
+    return True
+
+
+def record_transition(order, old_status, new_status, at=None):
+    """
+    Обновляет статистику филиала, отметки времени и оценки заказа при смене
+    статуса на new_status. Вход в очередь и выход из нее определяются по
+    Order.in_kitchen_queue в БД, а не по old_status (он может быть устаревшим
+    или None у нового заказа).
+    """
+    now = at or timezone.now()
+    is_queued = new_status in QUEUE_STATUSES
+    orders = Order.objects.filter(pk=order.pk)
+
+    with transaction.atomic():
+        order.refresh_from_db(fields=['created_at', 'confirmed_at', 'prepared_at', 'dispatched_at'])
+        if is_queued:
+            entered, left = bool(orders.filter(in_kitchen_queue=False).update(in_kitchen_queue=True)), False
+        else:
+            entered, left = False, bool(orders.filter(in_kitchen_queue=True).update(in_kitchen_queue=False))
+        if entered or left:
+            order.in_kitchen_queue = is_queued
+
+        stats_update = {}
+        if entered:
+            stats_update['queue_depth'] = F('queue_depth') + 1
+        if new_status == 'confirmed':
+            _claim(orders, order, 'confirmed_at', now)
+        if left and new_status not in NOT_PREPARED_STATUSES:
+            _claim(orders, order, 'prepared_at', now)
+            minutes = _minutes_since(order.confirmed_at or order.created_at, now)
+            if minutes is not None and _claim(orders, order, 'preparation_duration_minutes', minutes):
+                stats_update.update(_ewma('preparation_minutes', 'preparation_samples', minutes))
+        if new_status == 'delivering':
+            _claim(orders, order, 'dispatched_at', now)
+        if new_status in ('delivered', 'picked_up') and _claim(orders, order, 'completed_at', now):
+            minutes = _minutes_since(order.dispatched_at, now) if new_status == 'delivered' else None
+            if minutes is not None and _claim(orders, order, 'delivery_duration_minutes', minutes):
+                stats_update.update(_ewma('delivery_minutes', 'delivery_samples', minutes))
+
+        if stats_update or left:
+            BranchLoadStats.objects.get_or_create(branch_id=order.branch_id)
+            stats = BranchLoadStats.objects.filter(branch_id=order.branch_id)
+            if left:
+                # Заказы, вставшие в очередь до появления in_kitchen_queue, в ней не учтены
+                stats.filter(queue_depth__gt=0).update(queue_depth=F('queue_depth') - 1)
+            if stats_update:
+                stats.update(updated_at=now, **stats_update)
+
+        if entered or (left and new_status not in FINAL_STATUSES):
+            # Новая оценка: при входе в очередь - с учетом очереди, дальше - от факта готовности
+            if entered:
+                order.estimated_preparation_time = None
+            eta = order_estimate(order, now)
+            order.estimated_preparation_time, order.estimated_delivery_time = eta.ready_at, eta.delivered_at
+            orders.update(estimated_preparation_time=eta.ready_at, estimated_delivery_time=eta.delivered_at)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q
+
+from orders.eta import QUEUE_STATUSES
+from orders.models import BranchLoadStats, Order
+from restaurants.models import RestaurantBranch
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает очередь и средние длительности заказов филиалов (если счетчики разошлись с заказами)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--last', type=int, default=50, help='по скольким последним заказам считать средние')
+
+    def handle(self, *args, **options):
+        # Флаг учета в очереди - по текущему статусу
+        Order.objects.filter(status__in=QUEUE_STATUSES, in_kitchen_queue=False).update(in_kitchen_queue=True)
+        Order.objects.exclude(status__in=QUEUE_STATUSES).filter(in_kitchen_queue=True).update(in_kitchen_queue=False)
+        queues = dict(Order.objects.filter(in_kitchen_queue=True).values_list('branch_id').annotate(Count('pk')))
+        for branch_id in RestaurantBranch.objects.values_list('pk', flat=True):
+            averages = {}
+            for field in ('preparation_duration_minutes', 'delivery_duration_minutes'):
+                recent = Order.objects.filter(~Q(**{field: None}), branch_id=branch_id).order_by('-created_at')
+                ids = recent.values_list('pk', flat=True)[:options['last']]
+                averages[field] = Order.objects.filter(pk__in=list(ids)).aggregate(
+                    average=Avg(field), samples=Count('pk')
+                )
+            BranchLoadStats.objects.update_or_create(branch_id=branch_id, defaults={
+                'queue_depth': queues.get(branch_id, 0),
+                'preparation_minutes': averages['preparation_duration_minutes']['average'],
+                'preparation_samples': averages['preparation_duration_minutes']['samples'],
+                'delivery_minutes': averages['delivery_duration_minutes']['average'],
+                'delivery_samples': averages['delivery_duration_minutes']['samples'],
+            })
+        self.stdout.write(self.style.SUCCESS(f'Филиалов в очереди: {len(queues)}'))
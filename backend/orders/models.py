@@ -86,6 +86,15 @@ class CartItem(models.Model):
         return f"{self.quantity}x {self.product.name} in cart"
 
 
+# Поля заказа, которые ведут orders.stock, orders.slots и orders.eta
+SERVER_MANAGED_FIELDS = (
+    'stock_reserved', 'time_slot_starts_at', 'in_kitchen_queue',
+    'confirmed_at', 'prepared_at', 'dispatched_at', 'completed_at',
+    'preparation_duration_minutes', 'delivery_duration_minutes',
+    'estimated_preparation_time', 'estimated_delivery_time',
+)
+
+
 class Order(models.Model):
     ORDER_TYPE_CHOICES = [
         ('delivery', 'Delivery'),
@@ -157,6 +166,13 @@ class Order(models.Model):
     payment_provider = models.CharField(max_length=50, blank=True)
     payment_id = models.CharField(max_length=100, blank=True)
     payment_url = models.URLField(blank=True)
+
+    # Остатки товаров списаны под заказ (orders.stock)
+    stock_reserved = models.BooleanField(default=False)
+    # Начало слота, в счетчике которого учтен заказ (orders.slots)
+    time_slot_starts_at = models.DateTimeField(null=True, blank=True)
+    # Заказ учтен в очереди кухни BranchLoadStats.queue_depth (orders.eta)
+    in_kitchen_queue = models.BooleanField(default=False)
     
     # Courier info (for delivery orders)
     courier = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='delivered_orders')
@@ -201,7 +217,7 @@ class Order(models.Model):
             models.Index(fields=['branch', '-created_at']),
             models.Index(fields=['status']),
             models.Index(fields=['order_type']),
-            models.Index(fields=['created_at']),
+            models.Index(fields=['created_at', 'id']),
         ]
         ordering = ['-created_at']
     
@@ -213,6 +229,14 @@ class Order(models.Model):
         
         # Update updated_at timestamp
         self.updated_at = timezone.now()
+
+        # Эти поля меняются только условными UPDATE: экземпляр, загруженный
+        # раньше, не должен вернуть их старые значения
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [field for field in update_fields if field not in SERVER_MANAGED_FIELDS]
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -305,6 +329,43 @@ class OrderStatusHistory(models.Model):
         return f"Status {self.status} for order {self.order.order_number} at {self.created_at}"
 
 
+class TimeSlotLoad(models.Model):
+    """Сколько заказов принято на слот филиала (orders.slots)"""
+    branch = models.ForeignKey(RestaurantBranch, on_delete=models.CASCADE, related_name='time_slot_loads')
+    starts_at = models.DateTimeField()
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'order_time_slot_loads'
+        verbose_name = _('time slot load')
+        verbose_name_plural = _('time slot loads')
+        unique_together = ['branch', 'starts_at']
+
+    def __str__(self):
+        return f"{self.branch_id} {self.starts_at}: {self.reserved}"
+
+
+class BranchLoadStats(models.Model):
+    """Загрузка филиала для оценки времени заказа; обновляется при смене статусов (orders.eta)"""
+    branch = models.OneToOneField(RestaurantBranch, on_delete=models.CASCADE, related_name='load_stats')
+    # Заказы в статусах confirmed и preparing
+    queue_depth = models.PositiveIntegerField(default=0)
+    # Экспоненциальные скользящие средние длительностей, минуты
+    preparation_minutes = models.FloatField(null=True, blank=True)
+    preparation_samples = models.PositiveIntegerField(default=0)
+    delivery_minutes = models.FloatField(null=True, blank=True)
+    delivery_samples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'branch_load_stats'
+        verbose_name = _('branch load stats')
+        verbose_name_plural = _('branch load stats')
+
+    def __str__(self):
+        return f"Load of branch {self.branch_id}: {self.queue_depth} in queue"
+
+
 class PromoCode(models.Model):
     PROMO_TYPE_CHOICES = [
         ('fixed_amount', 'Fixed Amount Discount'),
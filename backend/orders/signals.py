@@ -0,0 +1,52 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import Signal, receiver
+
+from .eta import record_transition
+from .models import Order
+from .slots import release_order_slot
+from .stock import RELEASE_STATUSES, release_order_stock
+
+# Статус заказа изменился. Аргументы: order, old_status (None, если неизвестен), new_status
+order_status_changed = Signal()
+
+
+@receiver(post_init, sender=Order)
+def remember_status(sender, instance, **kwargs):
+    # Статус на момент загрузки - без лишнего запроса в pre_save
+    if 'status' not in instance.get_deferred_fields():
+        instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    old_status = None if created else getattr(instance, '_loaded_status', None)
+    new_status = instance.status
+    instance._loaded_status = new_status
+    if created or old_status == new_status:
+        return
+    order_status_changed.send(sender=Order, order=instance, old_status=old_status, new_status=new_status)
+
+
+@receiver(order_status_changed, sender=Order)
+def release_stock_on_cancel(sender, order, old_status, new_status, **kwargs):
+    # stock_reserved у экземпляра может быть устаревшим - проверка атомарная внутри
+    if new_status in RELEASE_STATUSES:
+        release_order_stock(order)
+
+
+@receiver(order_status_changed, sender=Order)
+def release_slot_on_cancel(sender, order, old_status, new_status, **kwargs):
+    if new_status in RELEASE_STATUSES:
+        release_order_slot(order)
+
+
+@receiver(post_save, sender=Order)
+def record_new_order(sender, instance, created, **kwargs):
+    # Заказ, созданный сразу подтвержденным, тоже встает в очередь
+    if created and instance.status != 'pending':
+        record_transition(instance, None, instance.status)
+
+
+@receiver(order_status_changed, sender=Order)
+def update_load_stats(sender, order, old_status, new_status, **kwargs):
+    record_transition(order, old_status, new_status)
@@ -0,0 +1,154 @@
+"""
+Слоты времени доставки и самовывоза.
+
+Слоты строятся из скомпилированного расписания филиала (restaurants.hours):
+интервал работы для типа заказа режется по сетке time_slot_minutes от
+полуночи (первый и последний слоты могут быть короче). Слот можно выбрать,
+если заказ успевают приготовить к его концу: сейчас + preparation_time_min
+для самовывоза и preparation_time_max для доставки.
+
+Емкость слота (time_slot_capacity) общая для доставки и самовывоза - это
+емкость кухни. Занятость хранится в счетчиках TimeSlotLoad по началу слота:
+заказ учитывается условным UPDATE ... SET reserved = reserved + 1 WHERE
+reserved < емкость, при отмене счетчик уменьшается. Список слотов читает
+только счетчики своих слотов, а не заказы.
+
+Order.delivery_time_slot - "YYYY-MM-DD HH:MM-HH:MM" во времени ресторана;
+Order.time_slot_starts_at делает учет и возврат идемпотентными.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from restaurants.hours import ANY, ORDER_TYPES
+from .models import Order, TimeSlotLoad
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+@dataclass
+class TimeSlot:
+    starts_at: datetime.datetime
+    ends_at: datetime.datetime
+    capacity: Optional[int]
+    # Заказ успевают приготовить к концу слота
+    orderable: bool = True
+    reserved: int = 0
+
+    @property
+    def label(self):
+        return f'{self.starts_at:%Y-%m-%d %H:%M}-{self.ends_at:%H:%M}'
+
+    @property
+    def remaining(self):
+        return None if self.capacity is None else max(self.capacity - self.reserved, 0)
+
+    @property
+    def available(self):
+        return self.orderable and (self.capacity is None or self.reserved < self.capacity)
+
+
+def _lead_minutes(branch, order_type):
+    return branch.preparation_time_min if order_type == 'pickup' else branch.preparation_time_max
+
+
+def branch_slots(branch, date, order_type, at=None):
+    """Слоты даты (во времени ресторана) без счетчиков; restaurant филиала должен быть загружен"""
+    schedule = branch.get_schedule()
+    length = datetime.timedelta(minutes=max(branch.time_slot_minutes, 1))
+    ready_at = (at or timezone.now()) + datetime.timedelta(minutes=_lead_minutes(branch, order_type))
+    midnight = datetime.datetime.combine(date, datetime.time(), tzinfo=schedule.zone)
+
+    slots = []
+    for start, end in schedule.intervals(date, order_type if order_type in ORDER_TYPES else ANY):
+        # Первая точка сетки после начала интервала
+        boundary = midnight + (start - midnight) // length * length + length
+        slot_start = start
+        while slot_start < end:
+            slot_end = min(boundary, end)
+            slots.append(TimeSlot(slot_start, slot_end, branch.time_slot_capacity, orderable=ready_at <= slot_end))
+            slot_start, boundary = slot_end, boundary + length
+    return slots
+
+
+def load_slots(branch, slots):
+    """Проставляет reserved из счетчиков одним запросом"""
+    if slots:
+        reserved = dict(TimeSlotLoad.objects.filter(
+            branch_id=branch.pk, starts_at__in=[slot.starts_at for slot in slots]
+        ).values_list('starts_at', 'reserved'))
+        for slot in slots:
+            slot.reserved = reserved.get(slot.starts_at, 0)
+    return slots
+
+
+def time_slots(branch, date, order_type, at=None):
+    return load_slots(branch, branch_slots(branch, date, order_type, at))
+
+
+def find_slot(branch, value, order_type, at=None):
+    """Слот по строке delivery_time_slot; SlotUnavailable, если его нет или он прошел"""
+    try:
+        date = datetime.date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        raise SlotUnavailable(f'Некорректный слот: {value!r}')
+    for slot in branch_slots(branch, date, order_type, at):
+        if slot.label == str(value).strip():
+            if not slot.orderable:
+                raise SlotUnavailable('Слот уже недоступен')
+            return slot
+    raise SlotUnavailable(f'Нет такого слота: {value!r}')
+
+
+def reserve_order_slot(order, at=None):
+    """
+    Учитывает заказ в счетчике его слота. Вызывается при оформлении
+    (orders.checkout), если указан delivery_time_slot. Бросает
+    SlotUnavailable, ничего не учтя. Возвращает False, если слот не указан
+    или заказ уже учтен.
+    """
+    if not order.delivery_time_slot:
+        return False
+    branch = order.branch
+    slot = find_slot(branch, order.delivery_time_slot, order.order_type, at)
+
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, time_slot_starts_at__isnull=True).update(
+            time_slot_starts_at=slot.starts_at
+        ):
+            return False
+        TimeSlotLoad.objects.get_or_create(branch_id=branch.pk, starts_at=slot.starts_at)
+        loads = TimeSlotLoad.objects.filter(branch_id=branch.pk, starts_at=slot.starts_at)
+        if branch.time_slot_capacity is not None:
+            loads = loads.filter(reserved__lt=branch.time_slot_capacity)
+        full = not loads.update(reserved=F('reserved') + 1)
+        if full:
+            transaction.set_rollback(True)
+
+    if full:
+        raise SlotUnavailable('Слот заполнен')
+    order.time_slot_starts_at = slot.starts_at
+    return True
+
+
+def release_order_slot(order):
+    """Освобождает место отмененного заказа; False, если освобождать нечего"""
+    starts_at = Order.objects.filter(pk=order.pk).values_list('time_slot_starts_at', flat=True).first()
+    if starts_at is None:
+        return False
+    with transaction.atomic():
+        # Условие по starts_at - место освобождается один раз
+        if not Order.objects.filter(pk=order.pk, time_slot_starts_at=starts_at).update(time_slot_starts_at=None):
+            return False
+        TimeSlotLoad.objects.filter(branch_id=order.branch_id, starts_at=starts_at, reserved__gt=0).update(
+            reserved=F('reserved') - 1
+        )
+
+    order.time_slot_starts_at = None
+    return True
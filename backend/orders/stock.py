@@ -0,0 +1,188 @@
+"""
+Резервирование остатков под заказ.
+
+Остаток списывается условным UPDATE ... SET stock_quantity = stock_quantity - n
+WHERE stock_quantity >= n: одна инструкция на таблицу (товары, значения
+опций) для всего заказа, с CASE по id. Если хотя бы одна строка не
+обновилась, транзакция откатывается и ничего не списывается - перепродажи
+при параллельных оформлениях нет, блокировок на чтение тоже.
+
+Учитываются только товары с конечным остатком (stock_quantity не NULL и не
+is_unlimited_stock) и значения опций с заданным stock_quantity.
+Order.stock_reserved делает списание и возврат идемпотентными.
+
+При пересечении low_stock_threshold отправляется сигнал catalog.signals.low_stock
+(после коммита), а когда товар заканчивается или снова появляется - меняется
+menu_version, чтобы in_stock в кэшированном меню был актуален. Новая
+sync_version для дельта-синхронизации ставится после коммита отдельной
+короткой транзакцией (catalog.sync.touch), чтобы резервирование не держало
+блокировку глобального счетчика версий.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from catalog.models import OptionValue, Product
+from catalog.signals import bump_menu_version, low_stock
+from catalog.sync import touch
+from .models import Order, OrderItem
+
+RELEASE_STATUSES = ('cancelled', 'refunded', 'failed')
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        # [{'type': 'product' | 'option_value', 'id', 'requested', 'available'}]
+        self.shortages = shortages
+        super().__init__(f"Недостаточно остатков: {shortages}")
+
+
+def _option_value_ids(selected_options):
+    """id значений опций из OrderItem.selected_options ([{"option_id", "value_ids"}])"""
+    for option in selected_options or []:
+        if isinstance(option, dict):
+            yield from option.get('value_ids') or []
+
+
+def order_quantities(order):
+    """Сколько штук каждого товара и значения опции нужно заказу"""
+    products = Counter()
+    option_values = Counter()
+    items = OrderItem.objects.filter(order=order, product__isnull=False).values_list(
+        'product_id', 'quantity', 'selected_options'
+    )
+    for product_id, quantity, selected_options in items:
+        products[product_id] += quantity
+        for value_id in _option_value_ids(selected_options):
+            option_values[value_id] += quantity
+    return products, option_values
+
+
+def _per_row(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def _tracked_products(product_ids):
+    return Product.objects.filter(pk__in=product_ids, is_unlimited_stock=False, stock_quantity__isnull=False)
+
+
+def _tracked_option_values(value_ids):
+    return OptionValue.objects.filter(pk__in=value_ids, stock_quantity__isnull=False)
+
+
+def _apply(tracked, quantities, sign):
+    """
+    Списывает (sign=-1) или возвращает (sign=1) остатки одной инструкцией.
+    Возвращает {id: (остаток до, остаток после)} или None, если остатка не хватило.
+    """
+    needed = {pk: quantities[pk] for pk in tracked.values_list('pk', flat=True)}
+    if not needed:
+        return {}
+
+    rows = tracked.filter(pk__in=list(needed))
+    if sign < 0:
+        updated = rows.filter(stock_quantity__gte=_per_row(needed)).update(
+            stock_quantity=F('stock_quantity') - _per_row(needed)
+        )
+    else:
+        updated = rows.update(stock_quantity=F('stock_quantity') + _per_row(needed))
+    # Остаток входит в данные меню для дельта-синхронизации; при откате не вызывается
+    model, pks = tracked.model, list(needed)
+    transaction.on_commit(lambda: touch(model.objects.filter(pk__in=pks)))
+    if updated != len(needed):
+        return None
+
+    # Строки заблокированы этой транзакцией, поэтому остаток до - это остаток после минус изменение
+    after = dict(tracked.model.objects.filter(pk__in=list(needed)).values_list('pk', 'stock_quantity'))
+    return {pk: (after[pk] - sign * needed[pk], after[pk]) for pk in needed}
+
+
+def _shortages(products, option_values):
+    shortages = []
+    for kind, tracked, quantities in (
+        ('product', _tracked_products(list(products)), products),
+        ('option_value', _tracked_option_values(list(option_values)), option_values),
+    ):
+        for pk, available in tracked.values_list('pk', 'stock_quantity'):
+            if available < quantities[pk]:
+                shortages.append({'type': kind, 'id': pk, 'requested': quantities[pk], 'available': available})
+    return shortages
+
+
+def _send_low_stock(crossed):
+    for product_id, stock_quantity, threshold in crossed:
+        low_stock.send(sender=Product, product_id=product_id, stock_quantity=stock_quantity, threshold=threshold)
+
+
+def _after_change(product_changes, option_value_changes):
+    """Сигнал low_stock и смена menu_version для товаров и опций, у которых сменился in_stock"""
+    flipped_products = [pk for pk, (before, after) in product_changes.items() if (before > 0) != (after > 0)]
+    flipped_values = [pk for pk, (before, after) in option_value_changes.items() if (before > 0) != (after > 0)]
+
+    restaurant_ids = []
+    if flipped_products:
+        for pair in Product.objects.filter(pk__in=flipped_products).values_list('restaurant_id', 'category__restaurant_id'):
+            restaurant_ids.extend(pair)
+    if flipped_values:
+        products = Product.objects.filter(option_mappings__option__values__pk__in=flipped_values)
+        for pair in products.values_list('restaurant_id', 'category__restaurant_id'):
+            restaurant_ids.extend(pair)
+    bump_menu_version(*restaurant_ids)
+
+    if product_changes:
+        thresholds = dict(Product.objects.filter(pk__in=list(product_changes)).values_list('pk', 'low_stock_threshold'))
+        crossed = [
+            (pk, after, thresholds[pk]) for pk, (before, after) in product_changes.items()
+            if after <= thresholds[pk] < before
+        ]
+        if crossed:
+            transaction.on_commit(lambda: _send_low_stock(crossed))
+
+
+def reserve_order_stock(order):
+    """
+    Списывает остатки под все позиции заказа. Вызывается при оформлении,
+    после создания позиций. Бросает InsufficientStock, ничего не списав.
+    Возвращает False, если остатки заказа уже зарезервированы.
+    """
+    products, option_values = order_quantities(order)
+
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, stock_reserved=False).update(stock_reserved=True):
+            return False
+
+        product_changes = _apply(_tracked_products(list(products)), products, -1)
+        option_value_changes = None
+        if product_changes is not None:
+            option_value_changes = _apply(_tracked_option_values(list(option_values)), option_values, -1)
+
+        if product_changes is None or option_value_changes is None:
+            transaction.set_rollback(True)
+        else:
+            _after_change(product_changes, option_value_changes)
+
+    if product_changes is None or option_value_changes is None:
+        raise InsufficientStock(_shortages(products, option_values))
+
+    order.stock_reserved = True
+    return True
+
+
+def release_order_stock(order):
+    """Возвращает остатки отмененного заказа; False, если возвращать нечего"""
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, stock_reserved=True).update(stock_reserved=False):
+            return False
+        products, option_values = order_quantities(order)
+        # Возврат безусловный; None - часть строк перестала учитывать остаток, их пропускаем
+        _after_change(
+            _apply(_tracked_products(list(products)), products, 1) or {},
+            _apply(_tracked_option_values(list(option_values)), option_values, 1) or {}
+        )
+
+    order.stock_reserved = False
+    return True
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class RestaurantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'restaurants'
\ No newline at end of file
+    name = 'restaurants'
+
+    def ready(self):
+        from . import signals  # noqa
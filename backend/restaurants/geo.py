@@ -0,0 +1,144 @@
+"""
+Поиск филиалов, которые доставляют в точку.
+
+В памяти процесса держится сеточный индекс: координаты разбиты на ячейки
+CELL_DEGREES x CELL_DEGREES, каждый активный филиал записан во все ячейки,
+которые задевает его круг доставки. Запрос берет кандидатов из одной ячейки
+точки и проверяет их точным расстоянием (haversine).
+
+Индекс перестраивается, когда меняется отпечаток филиалов (число, последние
+updated_at филиалов и ресторанов); отпечаток проверяется не чаще раза в
+BRANCH_INDEX_CHECK_INTERVAL секунд, а изменения в своем процессе видны
+сразу (restaurants.signals). С BRANCH_GEO_INDEX = False кандидаты
+выбираются SQL-запросом по ограничивающему прямоугольнику.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import RestaurantBranch
+
+CELL_DEGREES = 0.05  # ~5.5 км по широте
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+INDEX_ENABLED = getattr(settings, 'BRANCH_GEO_INDEX', True)
+CHECK_INTERVAL = getattr(settings, 'BRANCH_INDEX_CHECK_INTERVAL', 5.0)
+
+BranchPoint = namedtuple('BranchPoint', ['id', 'restaurant_id', 'latitude', 'longitude', 'radius'])
+
+
+def haversine_meters(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """(min_lat, max_lat, min_lng, max_lng) прямоугольника вокруг круга"""
+    delta_lat = radius / METERS_PER_DEGREE
+    delta_lng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return latitude - delta_lat, latitude + delta_lat, longitude - delta_lng, longitude + delta_lng
+
+
+def _eligible_branches():
+    return RestaurantBranch.objects.filter(is_active=True, restaurant__is_active=True)
+
+
+def _branch_points(queryset):
+    rows = queryset.values_list('pk', 'restaurant_id', 'latitude', 'longitude', 'delivery_radius_meters')
+    return [
+        BranchPoint(pk, restaurant_id, float(latitude), float(longitude), radius)
+        for pk, restaurant_id, latitude, longitude, radius in rows
+    ]
+
+
+def _cell(latitude, longitude):
+    return math.floor(latitude / CELL_DEGREES), math.floor(longitude / CELL_DEGREES)
+
+
+def _fingerprint():
+    return tuple(RestaurantBranch.objects.aggregate(
+        count=Count('pk'), branches=Max('updated_at'), restaurants=Max('restaurant__updated_at')
+    ).values())
+
+
+class BranchGeoIndex:
+    def __init__(self, fingerprint, points):
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        self._cells = defaultdict(list)
+        for point in points:
+            min_lat, max_lat, min_lng, max_lng = bounding_box(point.latitude, point.longitude, point.radius)
+            (lat_from, lng_from), (lat_to, lng_to) = _cell(min_lat, min_lng), _cell(max_lat, max_lng)
+            for lat_cell in range(lat_from, lat_to + 1):
+                for lng_cell in range(lng_from, lng_to + 1):
+                    self._cells[(lat_cell, lng_cell)].append(point)
+
+    def candidates(self, latitude, longitude):
+        return self._cells.get(_cell(latitude, longitude), [])
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def invalidate_branch_index():
+    global _index
+    _index = None
+
+
+def get_branch_index():
+    global _index
+    index = _index
+    now = time.monotonic()
+    if index is not None and now - index.checked_at < CHECK_INTERVAL:
+        return index
+
+    fingerprint = _fingerprint()
+    if index is not None and index.fingerprint == fingerprint:
+        index.checked_at = now
+        return index
+
+    with _build_lock:
+        index = _index
+        if index is None or index.fingerprint != fingerprint:
+            index = BranchGeoIndex(fingerprint, _branch_points(_eligible_branches()))
+            _index = index
+    return index
+
+
+def _candidates_sql(latitude, longitude):
+    """Кандидаты без индекса: прямоугольник по наибольшему радиусу доставки"""
+    branches = _eligible_branches()
+    max_radius = branches.aggregate(radius=Max('delivery_radius_meters'))['radius']
+    if max_radius is None:
+        return []
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, max_radius)
+    return _branch_points(branches.filter(
+        latitude__range=(Decimal(str(min_lat)), Decimal(str(max_lat))),
+        longitude__range=(Decimal(str(min_lng)), Decimal(str(max_lng))),
+    ))
+
+
+def branches_delivering_to(latitude, longitude, restaurant_id=None, limit=None):
+    """[(расстояние в метрах, id филиала)] филиалов, в круг доставки которых попадает точка, по расстоянию"""
+    if INDEX_ENABLED:
+        candidates = get_branch_index().candidates(latitude, longitude)
+    else:
+        candidates = _candidates_sql(latitude, longitude)
+
+    matches = []
+    for point in candidates:
+        if restaurant_id is not None and point.restaurant_id != restaurant_id:
+            continue
+        distance = haversine_meters(latitude, longitude, point.latitude, point.longitude)
+        if distance <= point.radius:
+            matches.append((distance, point.id))
+    matches.sort()
+    return matches[:limit] if limit else matches
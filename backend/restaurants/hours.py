@@ -0,0 +1,190 @@
+"""
+Расписание работы филиала.
+
+business_hours ({"monday": {"pickup": {"start": "09:00", "end": "23:00"},
+"delivery": {...}}, ...}) и исключения по датам (праздники, сокращенные дни)
+при сохранении филиала компилируются в RestaurantBranch.schedule:
+
+    {"week": {тип: [[начало, конец], ...]},
+     "exceptions": {"YYYY-MM-DD": {тип: [[начало, конец], ...]}}}
+
+Тип - pickup, delivery или any (работает хотя бы один). Недельные интервалы -
+минуты от начала недели (понедельник 00:00), интервалы исключений - минуты
+от начала даты. Конец не включается; конец не позже начала - работа после
+полуночи ("22:00"-"02:00", "10:00"-"00:00"). Интервалы одного дня
+отсортированы и не пересекаются, поэтому "открыто ли" и следующее открытие
+ищутся бинарным поиском. Время - в часовом поясе ресторана.
+
+Исключение: {"date": "2026-12-31", "closed": true} или
+{"date": "2026-12-31", "pickup": {"start": "10:00", "end": "18:00"}} -
+заменяет часы этой даты, не указанные типы в этот день закрыты.
+"""
+import datetime
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.utils import timezone
+
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+ORDER_TYPES = ('pickup', 'delivery')
+ANY = 'any'
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes(value):
+    """'HH:MM' -> минуты от полуночи"""
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except ValueError:
+        raise ValueError(f'Некорректное время: {value!r}')
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > MINUTES_PER_DAY:
+        raise ValueError(f'Некорректное время: {value!r}')
+    return hours * 60 + minutes
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _day_intervals(day_hours):
+    """Часы одного дня -> {тип: [[начало, конец]]} в минутах от полуночи этого дня"""
+    intervals = {}
+    for order_type in ORDER_TYPES:
+        ranges = (day_hours or {}).get(order_type) or []
+        # Несколько промежутков в день (перерыв) - список
+        if isinstance(ranges, dict):
+            ranges = [ranges]
+        day = []
+        for hours in ranges:
+            try:
+                start, end = _minutes(hours['start']), _minutes(hours['end'])
+            except (KeyError, TypeError):
+                raise ValueError(f'Ожидается {{"start": "HH:MM", "end": "HH:MM"}}: {hours!r}')
+            if end <= start:
+                end += MINUTES_PER_DAY
+            day.append((start, end))
+        intervals[order_type] = _merge(day)
+    intervals[ANY] = _merge([interval for order_type in ORDER_TYPES for interval in intervals[order_type]])
+    return intervals
+
+
+def compile_schedule(business_hours, exceptions=()):
+    """Компилирует business_hours и исключения; ValueError при некорректных данных"""
+    week = {order_type: [] for order_type in (*ORDER_TYPES, ANY)}
+    for index, day_name in enumerate(DAY_NAMES):
+        for order_type, intervals in _day_intervals((business_hours or {}).get(day_name)).items():
+            offset = index * MINUTES_PER_DAY
+            week[order_type].extend([start + offset, end + offset] for start, end in intervals)
+
+    compiled_exceptions = {}
+    for exception in exceptions or []:
+        try:
+            date = datetime.date.fromisoformat(exception['date'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Некорректная дата исключения: {exception!r}')
+        day_hours = {} if exception.get('closed') else exception
+        compiled_exceptions[date.isoformat()] = _day_intervals(day_hours)
+
+    return {'week': week, 'exceptions': compiled_exceptions}
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(settings.TIME_ZONE)
+
+
+class Schedule:
+    """Скомпилированное расписание для проверок во времени ресторана"""
+
+    def __init__(self, compiled, timezone_name):
+        self.zone = get_zone(timezone_name)
+        self._week = {
+            order_type: ([start for start, _ in intervals], [end for _, end in intervals])
+            for order_type, intervals in compiled.get('week', {}).items()
+        }
+        self._exceptions = {
+            date: {
+                order_type: ([start for start, _ in intervals], [end for _, end in intervals])
+                for order_type, intervals in day.items()
+            }
+            for date, day in compiled.get('exceptions', {}).items()
+        }
+
+    def _day(self, date, order_type):
+        """(начала, концы, lo, hi, смещение) интервалов, начинающихся в эту дату"""
+        exception = self._exceptions.get(date.isoformat())
+        if exception is not None:
+            starts, ends = exception.get(order_type, ([], []))
+            return starts, ends, 0, len(starts), 0
+        starts, ends = self._week.get(order_type, ([], []))
+        offset = date.weekday() * MINUTES_PER_DAY
+        return starts, ends, bisect_left(starts, offset), bisect_left(starts, offset + MINUTES_PER_DAY), offset
+
+    def local(self, at=None):
+        return (at or timezone.now()).astimezone(self.zone)
+
+    def is_open_local(self, local, order_type=ANY):
+        minute = local.hour * 60 + local.minute
+        date = local.date()
+        # Интервал мог начаться накануне и продолжаться после полуночи
+        for day, position in ((date, minute), (date - datetime.timedelta(days=1), minute + MINUTES_PER_DAY)):
+            starts, ends, lo, hi, offset = self._day(day, order_type)
+            index = bisect_right(starts, offset + position, lo, hi) - 1
+            if index >= lo and offset + position < ends[index]:
+                return True
+        return False
+
+    def is_open(self, at=None, order_type=ANY):
+        return self.is_open_local(self.local(at), order_type)
+
+    def intervals(self, date, order_type=ANY):
+        """[(начало, конец)] интервалов работы, начинающихся в эту дату (aware datetime)"""
+        starts, ends, lo, hi, offset = self._day(date, order_type)
+        midnight = datetime.datetime.combine(date, datetime.time(), tzinfo=self.zone)
+        return [
+            (midnight + datetime.timedelta(minutes=starts[index] - offset),
+             midnight + datetime.timedelta(minutes=ends[index] - offset))
+            for index in range(lo, hi)
+        ]
+
+    def next_opening(self, at=None, order_type=ANY, days=14):
+        """Ближайшее начало работы после at (aware datetime) или None"""
+        local = self.local(at)
+        minute = local.hour * 60 + local.minute
+        for day_offset in range(days + 1):
+            day = local.date() + datetime.timedelta(days=day_offset)
+            position = minute if day_offset == 0 else -1
+            starts, ends, lo, hi, offset = self._day(day, order_type)
+            index = bisect_right(starts, offset + position, lo, hi)
+            if index < hi:
+                midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=self.zone)
+                return midnight + datetime.timedelta(minutes=starts[index] - offset)
+        return None
+
+
+def annotate_open_now(branches, at=None, order_type=ANY):
+    """
+    Проставляет branch.is_open для списка филиалов. Локальное время считается
+    один раз на часовой пояс; restaurant должен быть загружен (select_related).
+    """
+    at = at or timezone.now()
+    local_times = {}
+    for branch in branches:
+        schedule = branch.get_schedule()
+        local = local_times.get(schedule.zone)
+        if local is None:
+            local = local_times[schedule.zone] = schedule.local(at)
+        branch.is_open = schedule.is_open_local(local, order_type)
+    return branches
@@ -1,8 +1,11 @@
 
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from users.models import User
+from .hours import Schedule, compile_schedule
+from .polygons import normalize_polygon, polygon_bbox
 
 
 class Restaurant(models.Model):
@@ -31,6 +34,9 @@ class Restaurant(models.Model):
     currency = models.CharField(max_length=3, default='RUB')
     default_language = models.CharField(max_length=10, default='ru')
 
+    # Версия меню: увеличивается при любом изменении каталога ресторана
+    menu_version = models.PositiveBigIntegerField(default=0, editable=False)
+
     # Статус
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
@@ -76,6 +82,14 @@ class Restaurant(models.Model):
             self.slug = slug
         # Update updated_at timestamp
         self.updated_at = timezone.now()
+
+        # menu_version меняет только catalog.signals.bump_menu_version (UPDATE с F()):
+        # экземпляр, загруженный до этого, не должен вернуть старую версию
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [field for field in update_fields if field != 'menu_version']
         super().save(*args, **kwargs)
 
 
@@ -99,12 +113,19 @@ class RestaurantBranch(models.Model):
 
     # Business hours (JSON для гибкости)
     business_hours = models.JSONField(default=dict, blank=True)
+    # Праздники и сокращенные дни: [{"date": "2026-12-31", "closed": true}, ...] (см. restaurants.hours)
+    schedule_exceptions = models.JSONField(default=list, blank=True)
+    # business_hours и schedule_exceptions, скомпилированные в save()
+    schedule = models.JSONField(default=dict, blank=True, editable=False)
 
     # Order settings
     min_order_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     max_order_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     preparation_time_min = models.IntegerField(default=30)
     preparation_time_max = models.IntegerField(default=60)
+    # Слоты времени заказа (orders.slots): длина и сколько заказов принимается на слот
+    time_slot_minutes = models.PositiveIntegerField(default=60)
+    time_slot_capacity = models.PositiveIntegerField(null=True, blank=True)  # пусто - без ограничения
 
     # Delivery settings
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -152,6 +173,10 @@ class RestaurantBranch(models.Model):
                 "sunday": {"pickup": {"start": "10:00", "end": "22:00"}, "delivery": {"start": "11:00", "end": "21:00"}}
             }
 
+        self.schedule = compile_schedule(self.business_hours, self.schedule_exceptions)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'schedule'}
+
         # Update updated_at timestamp
         self.updated_at = timezone.now()
         super().save(*args, **kwargs)
@@ -159,80 +184,86 @@ class RestaurantBranch(models.Model):
     def __str__(self):
         return f"{self.name} ({self.restaurant.name})"
 
-    def is_open_now(self):
-        """Check if the branch is open now based on business hours."""
-        import datetime
-        now = timezone.now()
-        day_name = now.strftime('%A').lower()
-        current_time = now.time()
-
-        if day_name in self.business_hours:
-            day_hours = self.business_hours[day_name]
-            # Check both pickup and delivery times
-            for order_type in ['pickup', 'delivery']:
-                if order_type in day_hours:
-                    start_time = datetime.datetime.strptime(day_hours[order_type]['start'], '%H:%M').time()
-                    end_time = datetime.datetime.strptime(day_hours[order_type]['end'], '%H:%M').time()
-
-                    # Handle overnight shifts (when end time is less than start time)
-                    if start_time <= end_time:
-                        # Regular day shift
-                        if start_time <= current_time <= end_time:
-                            return True
-                    else:
-                        # Overnight shift (e.g., 22:00 to 02:00)
-                        if current_time >= start_time or current_time <= end_time:
-                            return True
-
-        return False
-
-    def get_next_opening_time(self):
-        """Get the next opening time."""
-        import datetime
-        now = timezone.now()
-        current_day = now.weekday()  # Monday is 0, Sunday is 6
-
-        # Try to find opening time in the rest of the week
-        for i in range(7):
-            day_idx = (current_day + i) % 7
-            day_names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-            day_name = day_names[day_idx]
-
-            if day_name in self.business_hours:
-                day_hours = self.business_hours[day_name]
-
-                # If it's the current day and we're closed, check opening time
-                if i == 0:  # Current day
-                    current_time = now.time()
-                    for order_type in ['pickup', 'delivery']:
-                        if order_type in day_hours:
-                            start_time = datetime.datetime.strptime(day_hours[order_type]['start'], '%H:%M').time()
-
-                            # If current time is before opening time
-                            if current_time < start_time:
-                                if day_idx == current_day:
-                                    # Same day
-                                    next_opening = now.replace(hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0)
-                                else:
-                                    # Different day
-                                    days_ahead = day_idx - current_day
-                                    if days_ahead < 0:  # Target day already happened this week
-                                        days_ahead += 7
-                                    next_opening = (now + datetime.timedelta(days=days_ahead)).replace(
-                                        hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0
-                                    )
-                                return next_opening
-
-                # If it's a different day, just return the opening time
-                else:
-                    day_hours = self.business_hours[day_name]
-                    start_time = datetime.datetime.strptime(day_hours['pickup']['start'], '%H:%M').time()  # Use pickup as default
-                    days_ahead = day_idx - current_day
-                    if days_ahead < 0:  # Target day already happened this week
-                        days_ahead += 7
-                    next_opening = (now + datetime.timedelta(days=days_ahead)).replace(
-                        hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0
-                    )
-                    return next_opening
-
-        return None
\ No newline at end of file
+    def clean(self):
+        try:
+            compile_schedule(self.business_hours, self.schedule_exceptions)
+        except ValueError as e:
+            raise ValidationError({'business_hours': str(e)})
+
+    def get_schedule(self):
+        """Скомпилированное расписание в часовом поясе ресторана (кэшируется на объекте)"""
+        timezone_name = self.restaurant.timezone_name
+        cached = getattr(self, '_schedule_cache', None)
+        if cached is not None and cached[0] is self.schedule and cached[1] == timezone_name:
+            return cached[2]
+        # Филиалы, сохраненные до появления schedule, компилируем на лету
+        compiled = self.schedule or compile_schedule(self.business_hours, self.schedule_exceptions)
+        schedule = Schedule(compiled, timezone_name)
+        self._schedule_cache = (self.schedule, timezone_name, schedule)
+        return schedule
+
+    def is_open_now(self, at=None, order_type='any'):
+        """Открыт ли филиал (для pickup, delivery или any - хотя бы для одного)"""
+        return self.get_schedule().is_open(at, order_type)
+
+    def get_next_opening_time(self, at=None, order_type='any'):
+        """Ближайшее время открытия после at (по умолчанию - сейчас) или None"""
+        return self.get_schedule().next_opening(at, order_type)
+
+
+class DeliveryZone(models.Model):
+    """
+    Зона доставки филиала - полигон со своими условиями. Если у филиала есть
+    активные зоны, доставка возможна только в них (см. restaurants.zones).
+    """
+    branch = models.ForeignKey(RestaurantBranch, on_delete=models.CASCADE, related_name='delivery_zones', db_index=True)
+    name = models.CharField(max_length=255, blank=True)
+
+    # [lat1, lng1, lat2, lng2, ...] (см. restaurants.polygons); при сохранении
+    # принимается и [[lat, lng], ...]
+    polygon = models.JSONField(default=list)
+    # Ограничивающий прямоугольник, считается в save()
+    min_latitude = models.FloatField(default=0, editable=False)
+    min_longitude = models.FloatField(default=0, editable=False)
+    max_latitude = models.FloatField(default=0, editable=False)
+    max_longitude = models.FloatField(default=0, editable=False)
+
+    delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Пусто - как у филиала
+    min_order_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    free_delivery_threshold = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    is_active = models.BooleanField(default=True)
+
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'restaurant_delivery_zones'
+        verbose_name = _('delivery zone')
+        verbose_name_plural = _('delivery zones')
+        indexes = [
+            models.Index(fields=['branch', 'is_active']),
+            models.Index(fields=['min_latitude', 'max_latitude', 'min_longitude', 'max_longitude']),
+        ]
+
+    def __str__(self):
+        return self.name or f"Zone #{self.pk} ({self.branch_id})"
+
+    def clean(self):
+        try:
+            normalize_polygon(self.polygon)
+        except ValueError as e:
+            raise ValidationError({'polygon': str(e)})
+
+    def save(self, *args, **kwargs):
+        self.polygon = normalize_polygon(self.polygon)
+        self.min_latitude, self.min_longitude, self.max_latitude, self.max_longitude = polygon_bbox(self.polygon)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {
+                *kwargs['update_fields'], 'polygon', 'updated_at',
+                'min_latitude', 'min_longitude', 'max_latitude', 'max_longitude',
+            }
+
+        self.updated_at = timezone.now()
+        super().save(*args, **kwargs)
@@ -0,0 +1,125 @@
+"""
+Геометрия зон доставки.
+
+Полигон хранится плоским списком [lat1, lng1, lat2, lng2, ...] (координаты
+округлены до 6 знаков, ~10 см), без повторения первой точки в конце.
+Попадание точки проверяется лучом (ray casting): луч из точки вдоль
+долготы пересекает границу нечетное число раз - точка внутри.
+
+RTree - статическое R-дерево, упакованное методом STR (Sort-Tile-Recursive):
+прямоугольники сортируются по центру долготы, режутся на полосы, внутри
+полосы сортируются по широте и пакуются в узлы по NODE_SIZE. Дерево
+строится один раз и только читается.
+"""
+import math
+
+NODE_SIZE = 8
+PRECISION = 6
+
+
+def normalize_polygon(value):
+    """
+    [[lat, lng], ...] или плоский список -> плоский список для хранения.
+    ValueError, если точек меньше трех или координаты некорректны.
+    """
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('Полигон должен быть списком точек [lat, lng]')
+    try:
+        if value and isinstance(value[0], (list, tuple)):
+            if any(len(point) != 2 for point in value):
+                raise ValueError
+            points = [(float(lat), float(lng)) for lat, lng in value]
+        else:
+            if len(value) % 2:
+                raise ValueError
+            points = [(float(value[i]), float(value[i + 1])) for i in range(0, len(value), 2)]
+    except (TypeError, ValueError):
+        raise ValueError('Полигон должен быть списком точек [lat, lng]')
+
+    points = [(round(lat, PRECISION), round(lng, PRECISION)) for lat, lng in points]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    if len(points) < 3:
+        raise ValueError('В полигоне должно быть не меньше трех точек')
+    for lat, lng in points:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or math.isnan(lat) or math.isnan(lng):
+            raise ValueError(f'Координаты вне диапазона: {lat}, {lng}')
+    return [coordinate for point in points for coordinate in point]
+
+
+def polygon_points(coords):
+    """Плоский список -> [[lat, lng], ...]"""
+    return [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]
+
+
+def polygon_bbox(coords):
+    """(min_lat, min_lng, max_lat, max_lng)"""
+    lats, lngs = coords[0::2], coords[1::2]
+    return min(lats), min(lngs), max(lats), max(lngs)
+
+
+def contains_point(coords, lat, lng):
+    inside = False
+    count = len(coords)
+    prev_lat, prev_lng = coords[count - 2], coords[count - 1]
+    for i in range(0, count, 2):
+        cur_lat, cur_lng = coords[i], coords[i + 1]
+        if (cur_lat > lat) != (prev_lat > lat):
+            cross_lng = cur_lng + (prev_lng - cur_lng) * (lat - cur_lat) / (prev_lat - cur_lat)
+            if lng < cross_lng:
+                inside = not inside
+        prev_lat, prev_lng = cur_lat, cur_lng
+    return inside
+
+
+def _union(boxes):
+    return (
+        min(box[0] for box in boxes), min(box[1] for box in boxes),
+        max(box[2] for box in boxes), max(box[3] for box in boxes),
+    )
+
+
+def _pack(entries, node_size):
+    """Один уровень STR: [(bbox, потомок)] -> [(bbox, узел)]"""
+    node_count = math.ceil(len(entries) / node_size)
+    slice_count = math.ceil(math.sqrt(node_count))
+    slice_size = slice_count * node_size
+    entries = sorted(entries, key=lambda entry: entry[0][1] + entry[0][3])
+    packed = []
+    for start in range(0, len(entries), slice_size):
+        vertical = sorted(entries[start:start + slice_size], key=lambda entry: entry[0][0] + entry[0][2])
+        for node_start in range(0, len(vertical), node_size):
+            node = vertical[node_start:node_start + node_size]
+            packed.append((_union([box for box, _ in node]), node))
+    return packed
+
+
+class RTree:
+    """Статическое R-дерево по [(bbox, значение)], bbox = (min_lat, min_lng, max_lat, max_lng)"""
+
+    def __init__(self, items, node_size=NODE_SIZE):
+        self._root = None
+        self._height = 0
+        level = list(items)
+        while level:
+            level = _pack(level, node_size)
+            self._height += 1
+            if len(level) == 1:
+                self._root = level[0][1]
+                break
+
+    def search_point(self, lat, lng):
+        """Значения, чей bbox содержит точку"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [(self._root, self._height)]
+        while stack:
+            node, depth = stack.pop()
+            for (min_lat, min_lng, max_lat, max_lng), child in node:
+                if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                    if depth == 1:
+                        found.append(child)
+                    else:
+                        stack.append((child, depth - 1))
+        return found
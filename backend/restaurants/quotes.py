@@ -0,0 +1,117 @@
+"""
+Расчет стоимости доставки для многих пар (точка, филиал) одним проходом NumPy.
+
+Правила те же для любой пары:
+- доставка возможна, если расстояние (haversine) не больше delivery_radius_meters;
+- стоимость - fee первого диапазона delivery_fee_ranges
+  ([{"min_distance", "max_distance", "fee"}], min <= d < max, max может
+  отсутствовать), в который попало расстояние, иначе delivery_fee;
+- от free_delivery_threshold доставка бесплатна.
+
+Диапазоны всех филиалов лежат в плоских массивах (смещение и число на
+филиал), поэтому пары с разными филиалами считаются вместе: каждая пара
+разворачивается в строки своих диапазонов, первый подходящий диапазон
+пары - np.unique по номеру пары.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_METERS
+
+CENTS = Decimal('0.01')
+
+
+class FeeTable:
+    """Параметры доставки филиалов в массивах; порядок - как в branches"""
+
+    def __init__(self, branches):
+        self.branches = list(branches)
+        self.positions = {branch.pk: position for position, branch in enumerate(self.branches)}
+        self.latitude = np.array([float(branch.latitude) for branch in self.branches], dtype=float)
+        self.longitude = np.array([float(branch.longitude) for branch in self.branches], dtype=float)
+        self.radius = np.array([branch.delivery_radius_meters for branch in self.branches], dtype=float)
+        self.base_fee = np.array([float(branch.delivery_fee) for branch in self.branches], dtype=float)
+        self.threshold = np.array([
+            np.nan if branch.free_delivery_threshold is None else float(branch.free_delivery_threshold)
+            for branch in self.branches
+        ], dtype=float)
+
+        ranges = [branch.delivery_fee_ranges or [] for branch in self.branches]
+        self.range_count = np.array([len(branch_ranges) for branch_ranges in ranges], dtype=np.int64)
+        self.range_offset = np.cumsum(self.range_count) - self.range_count
+        flat = [fee_range for branch_ranges in ranges for fee_range in branch_ranges]
+        self.range_min = np.array([float(fee_range.get('min_distance', 0)) for fee_range in flat], dtype=float)
+        self.range_max = np.array([
+            np.inf if fee_range.get('max_distance') is None else float(fee_range['max_distance'])
+            for fee_range in flat
+        ], dtype=float)
+        self.range_fee = np.array([float(fee_range['fee']) for fee_range in flat], dtype=float)
+
+
+@dataclass
+class Quotes:
+    """Результаты по парам в порядке запроса"""
+    distance: np.ndarray
+    deliverable: np.ndarray
+    fee: np.ndarray
+
+    def fee_decimal(self, index):
+        return Decimal(repr(float(self.fee[index]))).quantize(CENTS)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Расстояние в метрах; аргументы - массивы градусов одной формы (или скаляры)"""
+    lat1, lng1, lat2, lng2 = (np.radians(value) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def quote_pairs(table, branch_positions, latitude, longitude, order_amount=None):
+    """
+    Стоимость доставки для пар: branch_positions[i] - позиция филиала в table,
+    latitude[i], longitude[i] - точка. order_amount - сумма заказа (скаляр или
+    массив) для бесплатной доставки.
+    """
+    branch_positions = np.asarray(branch_positions, dtype=np.int64)
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+
+    distance = haversine(latitude, longitude, table.latitude[branch_positions], table.longitude[branch_positions])
+    deliverable = distance <= table.radius[branch_positions]
+    fee = table.base_fee[branch_positions].copy()
+
+    # Каждая пара -> строки диапазонов ее филиала (по порядку в delivery_fee_ranges)
+    counts = table.range_count[branch_positions]
+    if counts.sum():
+        pair_rows = np.repeat(np.arange(len(branch_positions)), counts)
+        first_row = np.repeat(table.range_offset[branch_positions], counts)
+        within = np.arange(len(pair_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        range_rows = first_row + within
+        row_distance = distance[pair_rows]
+        matched = (table.range_min[range_rows] <= row_distance) & (row_distance < table.range_max[range_rows])
+        matched_pairs, first_match = np.unique(pair_rows[matched], return_index=True)
+        fee[matched_pairs] = table.range_fee[range_rows[matched][first_match]]
+
+    if order_amount is not None:
+        threshold = table.threshold[branch_positions]
+        free = ~np.isnan(threshold) & (np.asarray(order_amount, dtype=float) >= threshold)
+        fee[free] = 0.0
+    return Quotes(distance=distance, deliverable=deliverable, fee=fee)
+
+
+def quote_grid(table, latitude, longitude, order_amount=None):
+    """
+    Все точки против всех филиалов таблицы. Результат - массивы формы
+    (число точек, число филиалов), развернутые построчно.
+    """
+    points = len(latitude)
+    branches = len(table.branches)
+    return quote_pairs(
+        table,
+        np.tile(np.arange(branches), points),
+        np.repeat(np.asarray(latitude, dtype=float), branches),
+        np.repeat(np.asarray(longitude, dtype=float), branches),
+        order_amount,
+    )
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geo import invalidate_branch_index
+from .models import DeliveryZone, Restaurant, RestaurantBranch
+from .zones import invalidate_zone_index
+
+
+@receiver([post_save, post_delete], sender=RestaurantBranch)
+@receiver([post_save, post_delete], sender=Restaurant)
+def branches_changed(sender, **kwargs):
+    # Другие процессы заметят изменение по отпечатку филиалов (см. restaurants.geo)
+    invalidate_branch_index()
+    invalidate_zone_index()
+
+
+@receiver([post_save, post_delete], sender=DeliveryZone)
+def delivery_zones_changed(sender, **kwargs):
+    invalidate_zone_index()
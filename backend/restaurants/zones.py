@@ -0,0 +1,245 @@
+"""
+Доставка по зонам-полигонам (DeliveryZone).
+
+Активные зоны активных филиалов держатся в памяти процесса в R-дереве по
+ограничивающим прямоугольникам (restaurants.polygons.RTree). Проверка
+точки - поиск в дереве, затем луч по полигонам найденных зон. Индекс
+перестраивается по отпечатку зон так же, как индекс филиалов в
+restaurants.geo.
+
+Если у филиала есть активные зоны, доставка возможна только в них; из
+нескольких зон, содержащих точку и подходящих по минимальной сумме заказа,
+выбирается самая дешевая. Филиалы без зон доставляют по радиусу и
+delivery_fee_ranges (restaurants.quotes). Поиск филиалов у точки
+(branches_delivering_to) и расчет для многих пар (check_many) следуют тем
+же правилам.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+from django.db.models import Count, Max
+
+from . import geo
+from .geo import CHECK_INTERVAL, haversine_meters
+from .models import DeliveryZone
+from .polygons import RTree, contains_point, polygon_bbox
+from .quotes import FeeTable, quote_grid
+
+# Условия зоны уже с учетом значений филиала по умолчанию
+Zone = namedtuple('Zone', [
+    'id', 'branch_id', 'name', 'polygon', 'delivery_fee', 'min_order_amount', 'free_delivery_threshold',
+    'restaurant_id', 'branch_latitude', 'branch_longitude',
+])
+
+OUTSIDE_ZONE = 'outside_zone'
+BELOW_MIN_ORDER = 'min_order_amount'
+
+
+@dataclass
+class DeliveryCheck:
+    deliverable: bool
+    distance_meters: float
+    delivery_fee: Optional[Decimal] = None
+    zone_id: Optional[int] = None
+    # Минимальная сумма заказа для доставки в эту точку
+    min_order_amount: Optional[Decimal] = None
+    # Почему доставка невозможна: OUTSIDE_ZONE или BELOW_MIN_ORDER
+    reason: Optional[str] = None
+
+
+class DeliveryUnavailable(Exception):
+    def __init__(self, check):
+        self.check = check
+        if check.reason == BELOW_MIN_ORDER:
+            message = f'Минимальная сумма заказа для доставки по этому адресу - {check.min_order_amount}'
+        else:
+            message = 'Адрес вне зоны доставки'
+        super().__init__(message)
+
+
+def _fingerprint():
+    return tuple(DeliveryZone.objects.aggregate(
+        count=Count('pk'), zones=Max('updated_at'),
+        branches=Max('branch__updated_at'), restaurants=Max('branch__restaurant__updated_at'),
+    ).values())
+
+
+def _load_zones():
+    rows = DeliveryZone.objects.filter(
+        is_active=True, branch__is_active=True, branch__restaurant__is_active=True
+    ).values_list(
+        'pk', 'branch_id', 'name', 'polygon', 'delivery_fee', 'min_order_amount', 'free_delivery_threshold',
+        'branch__min_order_amount', 'branch__free_delivery_threshold',
+        'branch__restaurant_id', 'branch__latitude', 'branch__longitude',
+    )
+    return [
+        Zone(
+            pk, branch_id, name, tuple(polygon), fee,
+            branch_min_order if min_order is None else min_order,
+            branch_threshold if threshold is None else threshold,
+            restaurant_id, float(latitude), float(longitude),
+        )
+        for (
+            pk, branch_id, name, polygon, fee, min_order, threshold,
+            branch_min_order, branch_threshold, restaurant_id, latitude, longitude,
+        ) in rows
+        if len(polygon) >= 6
+    ]
+
+
+class ZoneIndex:
+    def __init__(self, fingerprint, zones):
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        self.branches = defaultdict(list)
+        for zone in zones:
+            self.branches[zone.branch_id].append(zone)
+        self._tree = RTree((polygon_bbox(zone.polygon), zone) for zone in zones)
+
+    def zones_at(self, latitude, longitude, branch_id=None):
+        """Зоны, содержащие точку (только филиала branch_id, если он задан)"""
+        return [
+            zone for zone in self._tree.search_point(latitude, longitude)
+            if (branch_id is None or zone.branch_id == branch_id)
+            and contains_point(zone.polygon, latitude, longitude)
+        ]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def invalidate_zone_index():
+    global _index
+    _index = None
+
+
+def get_zone_index():
+    global _index
+    index = _index
+    now = time.monotonic()
+    if index is not None and now - index.checked_at < CHECK_INTERVAL:
+        return index
+
+    fingerprint = _fingerprint()
+    if index is not None and index.fingerprint == fingerprint:
+        index.checked_at = now
+        return index
+
+    with _build_lock:
+        index = _index
+        if index is None or index.fingerprint != fingerprint:
+            index = ZoneIndex(fingerprint, _load_zones())
+            _index = index
+    return index
+
+
+def _zone_fee(zone, order_amount):
+    threshold = zone.free_delivery_threshold
+    if order_amount is not None and threshold is not None and order_amount >= threshold:
+        return Decimal('0.00')
+    return zone.delivery_fee
+
+
+def _check_radius(branch, quotes, position, order_amount):
+    check = DeliveryCheck(
+        deliverable=bool(quotes.deliverable[position]),
+        distance_meters=float(quotes.distance[position]),
+        min_order_amount=branch.min_order_amount,
+    )
+    if not check.deliverable:
+        check.reason = OUTSIDE_ZONE
+    elif order_amount is not None and order_amount < branch.min_order_amount:
+        check.deliverable, check.reason = False, BELOW_MIN_ORDER
+    else:
+        check.delivery_fee = quotes.fee_decimal(position)
+    return check
+
+
+def _check_zones(index, branch, latitude, longitude, order_amount):
+    check = DeliveryCheck(
+        deliverable=False,
+        distance_meters=haversine_meters(latitude, longitude, float(branch.latitude), float(branch.longitude)),
+    )
+    zones = index.zones_at(latitude, longitude, branch.pk)
+    if not zones:
+        check.reason = OUTSIDE_ZONE
+        return check
+
+    eligible = [zone for zone in zones if order_amount is None or order_amount >= zone.min_order_amount]
+    if not eligible:
+        check.reason = BELOW_MIN_ORDER
+        check.min_order_amount = min(zone.min_order_amount for zone in zones)
+        return check
+
+    zone = min(eligible, key=lambda zone: (_zone_fee(zone, order_amount), zone.id))
+    check.deliverable = True
+    check.zone_id = zone.id
+    check.delivery_fee = _zone_fee(zone, order_amount)
+    check.min_order_amount = zone.min_order_amount
+    return check
+
+
+def check_many(branches, points, order_amount=None):
+    """
+    check_delivery для всех пар точка x филиал: результаты построчно по
+    точкам (points - [(lat, lng)]). Филиалы без зон считаются одним проходом
+    NumPy (restaurants.quotes).
+    """
+    index = get_zone_index()
+    radius_branches = [branch for branch in branches if branch.pk not in index.branches]
+    if radius_branches and points:
+        table = FeeTable(radius_branches)
+        quotes = quote_grid(table, [lat for lat, _ in points], [lng for _, lng in points], order_amount)
+
+    checks = []
+    for point_index, (latitude, longitude) in enumerate(points):
+        for branch in branches:
+            if branch.pk in index.branches:
+                checks.append(_check_zones(index, branch, latitude, longitude, order_amount))
+            else:
+                position = point_index * len(radius_branches) + table.positions[branch.pk]
+                checks.append(_check_radius(branch, quotes, position, order_amount))
+    return checks
+
+
+def check_delivery(branch, latitude, longitude, order_amount=None):
+    """
+    Можно ли доставить из филиала в точку и за сколько. order_amount -
+    сумма заказа (Decimal) для минимальной суммы и бесплатной доставки;
+    без нее выбирается самая дешевая зона без учета минимальной суммы.
+    """
+    return check_many([branch], [(latitude, longitude)], order_amount)[0]
+
+
+def validate_delivery(branch, latitude, longitude, order_amount):
+    """Проверка при оформлении (orders.checkout): DeliveryCheck или DeliveryUnavailable"""
+    check = check_delivery(branch, latitude, longitude, order_amount)
+    if not check.deliverable:
+        raise DeliveryUnavailable(check)
+    return check
+
+
+def branches_delivering_to(latitude, longitude, restaurant_id=None, limit=None):
+    """
+    [(расстояние в метрах, id филиала)] филиалов, которые доставляют в точку,
+    по расстоянию: филиалы без зон - по радиусу (restaurants.geo), с зонами -
+    если точка внутри хотя бы одной зоны (без учета минимальной суммы).
+    """
+    index = get_zone_index()
+    matches = [
+        (distance, branch_id)
+        for distance, branch_id in geo.branches_delivering_to(latitude, longitude, restaurant_id)
+        if branch_id not in index.branches
+    ]
+    zoned = {}
+    for zone in index.zones_at(latitude, longitude):
+        if restaurant_id is None or zone.restaurant_id == restaurant_id:
+            zoned[zone.branch_id] = haversine_meters(latitude, longitude, zone.branch_latitude, zone.branch_longitude)
+    matches.extend((distance, branch_id) for branch_id, distance in zoned.items())
+    matches.sort()
+    return matches[:limit] if limit else matches
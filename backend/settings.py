@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     # Third-party apps
     'rest_framework',
     'rest_framework.authtoken',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'djoser',
     'django_filters',
@@ -57,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.RequestContextMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # ✅ Добавить для статических файлов
@@ -113,6 +116,22 @@ DATABASES = {
     }
 }
 
+# Cache: Redis, если задан REDIS_URL (общий для всех воркеров), иначе память процесса
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -158,10 +177,8 @@ AUTH_USER_MODEL = 'users.User'  # ✅ Только 'users.User'
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-        'api.authentication.TelegramAuthentication',  # Add Telegram authentication
+        # JWT, Token, Session и Telegram - выбор бэкенда по заголовкам запроса
+        'backend.api.authentication.CredentialDispatchAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # Allow public access by default
@@ -220,6 +237,9 @@ CSRF_TRUSTED_ORIGINS = [
 # Разрешаем передачу CSRF токена через заголовок X-CSRFToken
 CSRF_HEADER_NAME = 'HTTP_X_CSRFTOKEN'
 SIMPLE_JWT = {
+    # Access-токен на stateless-эндпоинтах проверяется без запроса к users:
+    # заблокированный пользователь сохраняет доступ до истечения токена,
+    # новый он получить не сможет (refresh проверяет is_blocked)
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
@@ -230,6 +250,26 @@ SIMPLE_JWT = {
 # Telegram bot settings
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 
+# Кэш проверенных initData (размер, время жизни записи и максимальный возраст auth_date в секундах)
+TELEGRAM_INIT_DATA_CACHE_SIZE = int(os.environ.get('TELEGRAM_INIT_DATA_CACHE_SIZE', 10000))
+TELEGRAM_INIT_DATA_CACHE_TTL = int(os.environ.get('TELEGRAM_INIT_DATA_CACHE_TTL', 3600))
+TELEGRAM_INIT_DATA_MAX_AGE = int(os.environ.get('TELEGRAM_INIT_DATA_MAX_AGE', 86400))
+
+# Отложенная запись профиля и last_activity пользователей (интервал в секундах, порог по числу пользователей)
+USER_WRITE_BUFFER_ENABLED = os.environ.get('USER_WRITE_BUFFER_ENABLED', 'True').lower() == 'true'
+USER_WRITE_BUFFER_INTERVAL = float(os.environ.get('USER_WRITE_BUFFER_INTERVAL', 5))
+USER_WRITE_BUFFER_MAX_PENDING = int(os.environ.get('USER_WRITE_BUFFER_MAX_PENDING', 500))
+
+# Кэш DRF Token -> пользователь (размер и время жизни записи в секундах)
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 60))
+
+# Логирование: обработчики в запросе только кладут запись в очередь,
+# в консоль и файл пишет фоновый поток (core.logging.QueueListenerHandler).
+# Имена приемников ('console', 'file') должны сортироваться раньше 'queue'.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+LOG_FILE = os.environ.get('LOG_FILE', 'debug.log')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -242,6 +282,28 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'core.logging.JsonFormatter',
+        },
+    },
+    'filters': {
+        'request_context': {
+            '()': 'core.logging.RequestContextFilter',
+        },
+        # Доля сохраняемых DEBUG/INFO записей для шумных логгеров
+        'sampling': {
+            '()': 'core.logging.SamplingFilter',
+            'rates': {
+                'backend.api.authentication': 0.1,
+                'users.write_buffer': 0.1,
+            },
+        },
+        # Не больше 20 записей ниже ERROR в минуту с одного места вызова
+        'rate_limit': {
+            '()': 'core.logging.RateLimitFilter',
+            'rate': 20,
+            'per': 60,
+        },
     },
     'handlers': {
         'console': {
@@ -251,25 +313,43 @@ LOGGING = {
         },
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log',
-            'formatter': 'verbose'
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'formatter': 'json'
+        },
+        'queue': {
+            '()': 'core.logging.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+            'filters': ['request_context', 'sampling', 'rate_limit'],
         },
     },
     'loggers': {
         '': {
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False,
         },
     },
 }
 
+# Метрики запросов (/api/_metrics). Воркеры сбрасывают свои гистограммы
+# в METRICS_DIR не чаще раза в METRICS_FLUSH_INTERVAL секунд
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'var', 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# В DEBUG ленивые загрузки при сериализации (api.prefetch) пишутся в лог;
+# с этим флагом запрос падает с AssertionError
+AUTO_PREFETCH_RAISE_ON_LAZY_LOAD = os.environ.get('AUTO_PREFETCH_RAISE_ON_LAZY_LOAD', 'False').lower() == 'true'
+
 # Для session authentication
 SESSION_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_HTTPONLY = True
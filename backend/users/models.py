@@ -124,6 +124,10 @@ class User(AbstractBaseUser, PermissionsMixin):
         db_table = 'users'
         verbose_name = _('user')
         verbose_name_plural = _('users')
+        indexes = [
+            # Keyset-пагинация списка пользователей (api.pagination)
+            models.Index(fields=['created_at', 'id']),
+        ]
 
     def save(self, *args, **kwargs):
         # Set default values for JSON fields if they are empty
@@ -0,0 +1,119 @@
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class UserWriteBuffer:
+    """
+    Отложенная запись изменений пользователей.
+
+    Изменения полей копятся в памяти процесса (последнее значение поля
+    побеждает) и записываются пачками через bulk_update - по таймеру,
+    при достижении max_pending пользователей и при завершении процесса.
+    bulk_update пишет только изменившиеся столбцы и не вызывает
+    User.save(), поэтому JSON-поля не перезаписываются.
+
+    Каждый воркер gunicorn держит свой буфер; поток записи стартует
+    лениво в том процессе, где буфер используется, так что fork после
+    импорта безопасен. Буферизовать можно только идемпотентные значения
+    "последнее известное состояние" (имя, username, last_activity).
+    """
+
+    def __init__(self, flush_interval=5.0, max_pending=500, batch_size=200, enabled=True):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+
+    def enqueue(self, user_id, **fields):
+        if not fields:
+            return
+
+        if not self.enabled:
+            self._write({user_id: fields})
+            return
+
+        with self._lock:
+            self._pending.setdefault(user_id, {}).update(fields)
+            pending_count = len(self._pending)
+
+        self._ensure_worker()
+        if pending_count >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Записывает накопленные изменения, возвращает число пользователей"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if pending:
+            self._write(pending)
+        return len(pending)
+
+    def _write(self, pending: dict) -> None:
+        from users.models import User
+
+        # bulk_update требует одинаковый набор полей для всех объектов
+        groups = defaultdict(list)
+        for user_id, fields in pending.items():
+            groups[tuple(sorted(fields))].append(User(pk=user_id, **fields))
+
+        for field_names, users in groups.items():
+            try:
+                User.objects.bulk_update(users, field_names, batch_size=self.batch_size)
+                continue
+            except Exception:
+                # bulk_update атомарен - одна плохая строка откатывает всю группу
+                logger.warning(f"Ошибка пакетной записи полей {field_names}, пишем по одному пользователю")
+            self._write_rows(users, field_names)
+
+    def _write_rows(self, users, field_names) -> None:
+        from users.models import User
+
+        for user in users:
+            try:
+                User.objects.filter(pk=user.pk).update(**{name: getattr(user, name) for name in field_names})
+            except Exception:
+                logger.exception(f"Ошибка отложенной записи полей {field_names} пользователя {user.pk}")
+
+    def _ensure_worker(self) -> None:
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+
+        with self._lock:
+            if self._worker_pid == pid:
+                return
+            self._worker_pid = pid
+            thread = threading.Thread(target=self._run, name='user-write-buffer', daemon=True)
+            thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+user_write_buffer = UserWriteBuffer(
+    flush_interval=getattr(settings, 'USER_WRITE_BUFFER_INTERVAL', 5.0),
+    max_pending=getattr(settings, 'USER_WRITE_BUFFER_MAX_PENDING', 500),
+    enabled=getattr(settings, 'USER_WRITE_BUFFER_ENABLED', True),
+)
+
+atexit.register(user_write_buffer.flush)